@@ -0,0 +1,128 @@
+"""Micro-benchmark of the per-movie normalization CPU cost
+
+Compares the movieLib2Db extraction before the normalization stage (path
+normalized with pathlib for each of the 8 keys, attributes read again for
+each key) with plexinfo.normalize.normalizeMovie(), and the cost of the
+[pathmap] rules as their number grows.
+
+usage: python benchmarks/bench_normalize.py [items]
+"""
+import sys
+import time
+import logging
+from pathlib import Path, PureWindowsPath
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from plexinfo import normalize  # noqa: E402
+
+logger = logging.getLogger("PlexUtils")
+
+
+class _Tag():
+    def __init__(self, tag):
+        self.tag = tag
+
+
+class _Movie():
+    """Stand in for a plexapi Movie, only the attributes that are read"""
+
+    def __init__(self, i):
+        self.ratingKey = i
+        self.updatedAt = None
+        self.addedAt = None
+        self.guid = f"plex://movie/{i:08x}"
+        self.title = f"Movie {i}"
+        self.titleSort = f"Movie {i}"
+        self.originalTitle = None
+        self.year = 1950 + i % 70
+        self.locations = [f"Z:\\MediaFolders\\Movies\\Movie {i} ({self.year})\\Movie {i}.mkv"]
+        self.genres = [_Tag("Drama"), _Tag("Action")]
+        self.media = [f"<Media:{i}>"]
+
+
+def _legacyUFilePath(plexLoc):
+    # pathlib version, as it ran on windows, with its debug logging
+    p_theLoc = PureWindowsPath(plexLoc)
+    logger.debug(f"plexLoc = {plexLoc}")
+    logger.debug(f"p_theLoc = {p_theLoc}")
+    logger.debug(f"str(p_theLoc) = {str(p_theLoc)}")
+    if p_theLoc.drive:
+        offset = 1
+    else:
+        offset = 2
+    uPath = ""
+    for x in range(offset, len(p_theLoc.parts)):
+        uPath = uPath + f"/{p_theLoc.parts[x]}"
+    return uPath
+
+
+def _legacyGenreStr(genreList):
+    tmpLst = []
+    for i in genreList:
+        tmpLst.append(i.tag)
+    tmpLst.sort()
+    return tmpLst
+
+
+def legacyExtract(m):
+    """The 8 key/value records movieLib2Db built per movie"""
+    return [(_legacyUFilePath(m.locations[0]), "guid", str(m.guid)),
+            (_legacyUFilePath(m.locations[0]), "Title", m.title),
+            (_legacyUFilePath(m.locations[0]), "TitleSort", m.titleSort),
+            (_legacyUFilePath(m.locations[0]), "OrigTitle", m.originalTitle),
+            (_legacyUFilePath(m.locations[0]), "Year", m.year),
+            (_legacyUFilePath(m.locations[0]), "Location", str(m.locations)),
+            (_legacyUFilePath(m.locations[0]), "Genres", str(_legacyGenreStr(m.genres))),
+            (_legacyUFilePath(m.locations[0]), "Media", str(m.media))]
+
+
+def normalizedExtract(m):
+    rec = normalize.normalizeMovie(m)
+    return [(rec.uFilePath, k, v) for k, v in zip(normalize.MOVIE_KEYS, rec.values)]
+
+
+def _perItem(func, movies):
+    start = time.process_time()
+    for m in movies:
+        func(m)
+    return (time.process_time() - start) / len(movies) * 1e6
+
+
+def _perPath(pathMap, paths):
+    normalize.setPathMap(pathMap)
+    start = time.process_time()
+    for p in paths:
+        normalize.uFilePath(p)
+    return (time.process_time() - start) / len(paths) * 1e6
+
+
+def benchPathMap(items):
+    """uncached uFilePath() cost, by number of [pathmap] rules"""
+    paths = [_Movie(i).locations[0] for i in range(items)]
+    print(f"{items} paths, CPU per path, uncached")
+    for nRules in (0, 10, 100, 1000):
+        rules = {f"p{r}": f"prefix:Z:\\MediaFolders\\Share{r} => /S{r}" for r in range(nRules)}
+        rules.update({f"r{r}": f"regex:/volume{r}/(\\w+) => /\\1" for r in range(nRules // 10)})
+        rules["hit"] = "prefix:Z:\\MediaFolders => /"
+        print(f"  {nRules:5} prefix + {nRules // 10:3} regex rules : {_perPath(normalize.PathMap(rules), paths):8.2f} us")
+    normalize.setPathMap(None)
+
+
+def main(items):
+    movies = [_Movie(i) for i in range(items)]
+    # same records from both
+    assert legacyExtract(movies[0]) == normalizedExtract(movies[0])
+
+    before = _perItem(legacyExtract, movies)
+    normalize.uFilePath.cache_clear()
+    after = _perItem(normalizedExtract, movies)
+    cached = _perItem(normalizedExtract, movies)
+    print(f"{items} movies, CPU per movie")
+    print(f"  before (pathlib x8)        : {before:8.2f} us")
+    print(f"  after  (normalize once)    : {after:8.2f} us")
+    print(f"  after, path cache warm     : {cached:8.2f} us")
+    benchPathMap(items)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,243 @@
+"""Benchmark of the compare pipeline on synthetic libraries, no network
+
+Times each phase of a movie library compare for 1k, 10k and 100k movie
+libraries served by benchmarks/synthlib.py:
+    movies       movieLib2Db of both servers
+    collections  collection2Db of both servers
+    diff         building the diff results (createtables*.sql views)
+    export_lib   exportLibDiff
+    export_col   exportColDiff
+    matrix       exportLibMatrix, the N-way compare of the two servers
+    moved        unmatchedItems and exportMoved, the moved movies file
+    pipeline     exportServers of both servers into a new database
+    merge        mergeCompare of both servers, fetch to diff files without
+                 the database, compare with pipeline + diff + export_*
+
+Each size runs in its own process, so its peak RSS is its own. The
+results are written as JSON, and compared with a saved baseline when
+one is given.
+
+The databases are in memory, or in a file of a temporary directory with
+--dbfile, set up with the storage profile of --profile. With --workers
+the listing pages are parsed by a pagepool of that many processes.
+
+usage: python benchmarks/bench_pipeline.py [--sizes 1000,10000,100000]
+           [--divergence 0.05] [--moved 0.0] [--schema eav|wide] [--fields guid,Title]
+           [--profile auto|durable|fast-ephemeral] [--dbfile] [--workers 0]
+           [--out results.json] [--baseline baseline.json] [--threshold 0.2]
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+
+# Phases shorter than this in the baseline are too noisy to compare
+MIN_SECONDS = 0.05
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+
+def peakRssMB():
+    """Peak resident memory of this process in MB, None when unknown"""
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Phases():
+    """Wall clock time and items/sec of each phase"""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, items, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.results[name] = {"seconds": round(seconds, 4), "items": items,
+                              "itemsPerSec": round(items / seconds, 1) if seconds > 0 else None}
+        print(f"  {name:12} {seconds:9.3f} s  {self.results[name]['itemsPerSec']:>12} items/s", file=sys.stderr)
+        return result
+
+
+def benchOne(items, divergence, schema, containerSize, fieldList=None, moved=0.0, profile="auto", dbDir=None,
+             workers=0):
+    """Run all the phases for one library size, in this process"""
+    import synthlib
+    from plexinfo import sqlitedb as mydb
+    from plexinfo import plexutils as myutil
+    from plexinfo import normalize
+    from plexinfo import fuzzymatch
+    from plexinfo import pagepool
+
+    fields = normalize.parseFields(fieldList)
+    # before the libraries are built, the forked processes do not need them
+    pagepool.start(workers)
+
+    svr1, svr2 = synthlib.syntheticServers(items, divergence, moved=moved)
+    sec1 = svr1.library.section(synthlib.LIBRARY)
+    sec2 = svr2.library.section(synthlib.LIBRARY)
+    scripts = REPO_DIR / "scripts"
+    phases = Phases()
+    print(f"{items} movies, schema {schema}, fields {','.join(fields)}, profile {profile}"
+          f"{', file' if dbDir != None else ''}, {workers} workers", file=sys.stderr)
+
+    db = mydb.LocalDB(dbLoc=None if dbDir == None else str(Path(dbDir) / "bench.db"), schema=schema,
+                      fields=fields, profile=profile)
+    db.initDB(scripts)
+    nCols = len(svr1._session.adapter.library.collections) + len(svr2._session.adapter.library.collections)
+    phases.run("movies", items * 2, lambda: (myutil.movieLib2Db(db, sec1, "server1", containerSize=containerSize,
+                                                                fields=fields),
+                                             myutil.movieLib2Db(db, sec2, "server2", containerSize=containerSize,
+                                                                fields=fields)))
+    phases.run("collections", nCols, lambda: (myutil.collection2Db(db, sec1, "server1", containerSize=containerSize),
+                                              myutil.collection2Db(db, sec2, "server2", containerSize=containerSize)))
+    phases.run("diff", items * 2, db.buildDiff)
+    with tempfile.TemporaryDirectory() as tmp:
+        phases.run("export_lib", items * 2, db.exportLibDiff, Path(tmp) / "lib.csv")
+        phases.run("export_col", nCols, db.exportColDiff, Path(tmp) / "col.csv")
+        phases.run("matrix", items * 2, db.exportLibMatrix, Path(tmp) / "matrix.csv",
+                   [("server1", svr1.friendlyName), ("server2", svr2.friendlyName)])
+        phases.run("moved", items * 2, lambda: fuzzymatch.exportMoved(Path(tmp) / "moved.csv", synthlib.LIBRARY,
+                                                                      *db.unmatchedItems(synthlib.LIBRARY)))
+    db.conn.close()
+
+    db = mydb.LocalDB(dbLoc=None if dbDir == None else str(Path(dbDir) / "pipeline.db"), schema=schema,
+                      fields=fields, profile=profile)
+    db.initDB(scripts)
+    phases.run("pipeline", items * 2 + nCols, myutil.exportServers, db,
+               [("server1", svr1), ("server2", svr2)], synthlib.LIBRARY, containerSize=containerSize,
+               fields=fields)
+    db.conn.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        phases.run("merge", items * 2 + nCols, myutil.mergeCompare, [svr1, svr2], synthlib.LIBRARY,
+                   Path(tmp) / "lib.csv", Path(tmp) / "col.csv", containerSize=containerSize, fields=fields,
+                   diffOnly=schema == "wide")
+
+    requests = {}
+    for svr in (svr1, svr2):
+        for kind, n in svr._session.adapter.requests.items():
+            requests[kind] = requests.get(kind, 0) + n
+    pagepool.stop()
+    return {"items": items, "phases": phases.results, "peakRssMB": peakRssMB(), "requests": requests}
+
+
+def compareBaseline(results, baseline, threshold):
+    """Print the phases slower than the baseline by more than threshold
+
+    Returns:
+        int: number of regressions
+    """
+    regressions = 0
+    for size, result in results["results"].items():
+        base = baseline.get("results", {}).get(size)
+        if base == None:
+            print(f"{size}: not in the baseline")
+            continue
+        for name, phase in result["phases"].items():
+            basePhase = base["phases"].get(name)
+            if basePhase == None or basePhase["seconds"] < MIN_SECONDS:
+                continue
+            ratio = phase["seconds"] / basePhase["seconds"]
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{size:>7} {name:12} {basePhase['seconds']:9.3f} s -> {phase['seconds']:9.3f} s  x{ratio:5.2f}{flag}")
+        if base.get("peakRssMB") and result.get("peakRssMB"):
+            print(f"{size:>7} {'peak rss':12} {base['peakRssMB']:9.1f} MB -> {result['peakRssMB']:9.1f} MB")
+    return regressions
+
+
+def main(args):
+    if args.one and args.dbFile:
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(benchOne(args.one, args.divergence, args.schema, args.containerSize, args.fields,
+                                      args.moved, args.profile, tmp, args.workers)))
+        return 0
+    if args.one:
+        print(json.dumps(benchOne(args.one, args.divergence, args.schema, args.containerSize, args.fields,
+                                  args.moved, args.profile, workers=args.workers)))
+        return 0
+
+    results = {"meta": {"date": datetime.now().isoformat(timespec="seconds"),
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "divergence": args.divergence,
+                        "moved": args.moved,
+                        "schema": args.schema,
+                        "fields": args.fields,
+                        "profile": args.profile,
+                        "dbFile": args.dbFile,
+                        "workers": args.workers,
+                        "containerSize": args.containerSize},
+               "results": {}}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        # a process per size, for its own peak rss
+        cmd = [sys.executable, __file__, "--one", str(size), "--divergence", str(args.divergence),
+               "--moved", str(args.moved),
+               "--schema", args.schema, "--containersize", str(args.containerSize), "--profile", args.profile,
+               "--workers", str(args.workers)]
+        if args.fields != None:
+            cmd += ["--fields", args.fields]
+        if args.dbFile:
+            cmd += ["--dbfile"]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, cwd=str(BENCH_DIR), check=True)
+        results["results"][str(size)] = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+
+    if args.out != None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline != None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compareBaseline(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare pipeline benchmark")
+    parser.add_argument('--sizes', help='Library sizes, comma separated. Default 1000,10000,100000',
+                        default="1000,10000,100000")
+    parser.add_argument('--divergence', help='Fraction of the movies different on server 2. Default 0.05',
+                        type=float, default=0.05)
+    parser.add_argument('--moved', help='Fraction of the movies moved or renamed on server 2. Default 0',
+                        type=float, default=0.0)
+    parser.add_argument('--schema', help='Database schema. Default eav', choices=("eav", "wide"), default="eav")
+    parser.add_argument('--fields', help='Movie fields compared, comma separated. Default all of them',
+                        metavar='guid,Title')
+    parser.add_argument('--profile', help='Database storage profile. Default auto',
+                        choices=("auto", "durable", "fast-ephemeral"), default="auto")
+    parser.add_argument('--dbfile', help='Databases in a file of a temporary directory, instead of in memory',
+                        action='store_true', dest='dbFile')
+    parser.add_argument('--workers', help='Processes parsing the listing pages. Default 0, no pagepool', type=int,
+                        default=0)
+    parser.add_argument('--containersize', help='Items fetched per page. Default 500', type=int,
+                        default=500, dest='containerSize')
+    parser.add_argument('--out', help='JSON results file', metavar='results.json')
+    parser.add_argument('--baseline', help='JSON results file to compare with', metavar='baseline.json')
+    parser.add_argument('--threshold', help='Slowdown reported as a regression. Default 0.2 (20%%)',
+                        type=float, default=0.2)
+    parser.add_argument('--one', help=argparse.SUPPRESS, type=int)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""Check the merge diff engine writes the same files as the database engine
+
+Exports the synthetic libraries of synthlib.py with exportServers and the
+database diff (eav and wide schemas, all the fields and a projection),
+and with plexutils.mergeCompare, and compares the library, collection
+and member diff csv files byte for byte, then the differences only JSON
+Lines files, uncompressed. A small sort chunk makes the merge engine
+spill its sorted runs to temporary files.
+
+usage: python benchmarks/check_engines.py [--sizes 1000,4000] [--chunk 700]
+Exits with 1 when a check fails.
+"""
+import sys
+import gzip
+import argparse
+import tempfile
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import synthlib  # noqa: E402
+from plexinfo import sqlitedb as mydb  # noqa: E402
+from plexinfo import plexutils as myutil  # noqa: E402
+from plexinfo import normalize  # noqa: E402
+from plexinfo import mergediff  # noqa: E402
+
+FIELDS = (normalize.MOVIE_KEYS, ("guid", "Title"))
+
+# (diffOnly, format, compression) of the diff files compared
+OUTPUTS = ((False, "csv", None), (True, "jsonl", "gzip"))
+
+
+def _content(oFile, compress):
+    opener = gzip.open if compress == "gzip" else open
+    with opener(oFile, "rb") as f:
+        return f.read()
+
+
+def checkSize(items, tmp):
+    failures = []
+    svr1, svr2 = synthlib.syntheticServers(items, divergence=0.05)
+    for schema in mydb.SCHEMAS:
+        for fields in FIELDS:
+            name = f"{items} {schema} {','.join(fields)}"
+            db = mydb.LocalDB(schema=schema, fields=fields)
+            db.initDB(REPO_DIR / "scripts")
+            myutil.exportServers(db, [("server1", svr1), ("server2", svr2)], synthlib.LIBRARY,
+                                 containerSize=250, fields=fields)
+            for diffOnly, fmt, compress in OUTPUTS:
+                db.exportLibDiff(tmp / f"sql_lib.{fmt}", diffOnly=diffOnly, fmt=fmt, compress=compress)
+                db.exportColDiff(tmp / f"sql_col.{fmt}", diffOnly=diffOnly, fmt=fmt, compress=compress)
+                db.exportMemberDiff(tmp / f"sql_members.{fmt}", fmt=fmt, compress=compress)
+            db.conn.close()
+
+            for diffOnly, fmt, compress in OUTPUTS:
+                myutil.mergeCompare([svr1, svr2], synthlib.LIBRARY, tmp / f"merge_lib.{fmt}", tmp / f"merge_col.{fmt}",
+                                    containerSize=250, fields=fields, diffOnly=diffOnly or schema == "wide",
+                                    colDiffOnly=diffOnly, fmt=fmt, compress=compress,
+                                    memberFile=tmp / f"merge_members.{fmt}")
+                for kind in ("lib", "col", "members"):
+                    same = (_content(tmp / f"sql_{kind}.{fmt}", compress) ==
+                            _content(tmp / f"merge_{kind}.{fmt}", compress))
+                    print(f"{name:40} {kind} {fmt}{' diff only' if diffOnly else ''}: {'same' if same else 'DIFFERENT'}")
+                    if not same:
+                        failures.append(f"{name} {kind} {fmt} diff files are different")
+    return failures
+
+
+def main(args):
+    mergediff.SORT_CHUNK = args.chunk
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            failures.extend(checkSize(size, Path(tmp)))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: the merge engine and the database engine diff files are the same")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge and database diff engines check")
+    parser.add_argument('--sizes', help='Library sizes, comma separated. Default 1000,4000', default="1000,4000")
+    parser.add_argument('--chunk', help='Records sorted in memory by the merge engine. Default 700', type=int,
+                        default=700)
+    sys.exit(main(parser.parse_args()))
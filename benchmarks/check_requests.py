@@ -0,0 +1,91 @@
+"""Check the number of plex requests of an export grows with pages, not items
+
+Counts the requests made to the synthetic servers of synthlib.py by
+exportServers, movieLib2Db and collection2Db, for several library sizes.
+A library pass must be a request per page of the listing (and per page
+of each genre), with no request per movie or per collection.
+
+usage: python benchmarks/check_requests.py [--sizes 1000,4000] [--containersize 250]
+Exits with 1 when a check fails.
+"""
+import sys
+import argparse
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import synthlib  # noqa: E402
+from plexinfo import sqlitedb as mydb  # noqa: E402
+from plexinfo import plexutils as myutil  # noqa: E402
+
+
+def _pages(items, containerSize):
+    # the last page is short, or empty
+    return items // containerSize + 1
+
+
+def pageBound(library, containerSize):
+    """Requests of one pass over the movies, their genres and the collections"""
+    genrePages = sum(_pages(sum(1 for m in library.movies if g in m.genres), containerSize)
+                     for g in synthlib.GENRES)
+    return (_pages(len(library.movies), containerSize) + 1 + genrePages +
+            _pages(len(library.collections), containerSize))
+
+
+def checkSize(items, containerSize):
+    failures = []
+    svr1, svr2 = synthlib.syntheticServers(items, divergence=0.05)
+    scripts = REPO_DIR / "scripts"
+
+    def counted(name, svr, bound, func):
+        adapter = svr._session.adapter
+        adapter.requests.clear()
+        func()
+        reqs = dict(adapter.requests)
+        perItem = reqs.get("metadata", 0) + reqs.get("children", 0)
+        total = sum(reqs.values())
+        print(f"{items:>7} {name:14} {total:6} requests (bound {bound}) {reqs}")
+        if perItem:
+            failures.append(f"{items} {name}: {perItem} requests per movie or collection")
+        if total > bound:
+            failures.append(f"{items} {name}: {total} requests, more than {bound}")
+
+    bound = pageBound(svr1._session.adapter.library, containerSize)
+    db = mydb.LocalDB()
+    db.initDB(scripts)
+    sec1 = svr1.library.section(synthlib.LIBRARY)
+    # +2: the library and its sections
+    counted("movieLib2Db", svr1, bound + 2,
+            lambda: myutil.movieLib2Db(db, sec1, "server1", containerSize=containerSize))
+    counted("collection2Db", svr1, bound + 2,
+            lambda: myutil.collection2Db(db, sec1, "server1", containerSize=containerSize))
+    db.conn.close()
+
+    db = mydb.LocalDB()
+    db.initDB(scripts)
+    counted("exportServers", svr2, pageBound(svr2._session.adapter.library, containerSize) + 2,
+            lambda: myutil.exportServers(db, [("server1", svr1), ("server2", svr2)], synthlib.LIBRARY,
+                                         containerSize=containerSize))
+    db.conn.close()
+    return failures
+
+
+def main(args):
+    failures = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        failures.extend(checkSize(size, args.containerSize))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: the requests grow with the pages, not the items")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plex requests per export check")
+    parser.add_argument('--sizes', help='Library sizes, comma separated. Default 1000,4000', default="1000,4000")
+    parser.add_argument('--containersize', help='Items fetched per page. Default 250', type=int,
+                        default=250, dest='containerSize')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,335 @@
+"""Synthetic plex servers for the benchmarks, no network
+
+SyntheticAdapter is a requests transport adapter that answers the plex
+http api from a generated movie library, so real plexapi PlexServer,
+MovieSection, Movie and Collections objects are built from it, with the
+same xml parsing and partial object reloads as a real server.
+
+Usage:
+    svr1, svr2 = syntheticServers(10000, divergence=0.05)
+    section = svr1.library.section(LIBRARY)
+"""
+import re
+import random
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+from xml.sax.saxutils import quoteattr
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from plexapi.server import PlexServer
+
+LIBRARY = "Movies"
+SECTION_KEY = "1"
+SHOW_LIBRARY = "TV Shows"
+SHOW_KEY = "2"
+MUSIC_LIBRARY = "Music"
+MUSIC_KEY = "3"
+# Episodes per show and tracks per album
+SHOW_SIZE = 50
+ALBUM_SIZE = 10
+GENRES = ("Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary",
+          "Drama", "Family", "Fantasy", "Horror", "Mystery", "Romance", "Thriller")
+# Movies per collection
+COLLECTION_SIZE = 10
+# ratingKeys of the collections start here
+COLLECTION_KEYS = 10000000
+BASE_TIME = 1600000000
+
+
+class SyntheticMovie():
+    __slots__ = ("ratingKey", "guid", "title", "originalTitle", "year", "genres", "location", "updatedAt",
+                 "collections")
+
+    def __init__(self, ratingKey, guid, title, originalTitle, year, genres, location, updatedAt):
+        self.ratingKey = ratingKey
+        self.guid = guid
+        self.title = title
+        self.originalTitle = originalTitle
+        self.year = year
+        self.genres = genres
+        self.location = location
+        self.updatedAt = updatedAt
+        self.collections = []
+
+
+class SyntheticLibrary():
+    """A generated movie library of one server
+
+    Server 1 has windows locations (z:\\MediaFolders\\Movies\\...) and
+    the other servers linux locations (/mnt/MediaFolders/Movies/...), all
+    with the same universal file path. On the other servers a `divergence`
+    fraction of the movies is different: a third have another title, a
+    third another year, and a third are missing and replaced by movies only
+    on that server. Servers 3 and up have their own different movies.
+    A `moved` fraction of the movies of the other servers have another
+    folder and file name.
+    With episodes or tracks, the server also has a "TV Shows" or "Music"
+    section, and the same `divergence` fraction of them have another
+    title on the other servers.
+    """
+
+    def __init__(self, items, server=1, divergence=0.0, seed=1, moved=0.0, episodes=0, tracks=0):
+        """
+        Args:
+            items (int): movies in the library
+            server (int, optional): 1, 2 or more. Defaults to 1.
+            divergence (float, optional): fraction of different movies on servers 2 and up. Defaults to 0.0.
+            seed (int, optional): random seed, the same seed builds the same library. Defaults to 1.
+            moved (float, optional): fraction of moved movies on servers 2 and up. Defaults to 0.0.
+            episodes (int, optional): episodes of the TV Shows section. Defaults to 0, no section.
+            tracks (int, optional): tracks of the Music section. Defaults to 0, no section.
+        """
+        self.server = server
+        self.movies = []
+        rnd = random.Random(seed)
+        # the same movies on all the servers, the changes of servers 3 and up are their own
+        changeRnd = random.Random(f"{seed}-{server}") if server > 2 else None
+        movedRnd = random.Random(f"{seed}-moved-{server}")
+        for i in range(items):
+            title = f"Movie {i:07d}"
+            year = 1950 + rnd.randrange(70)
+            genres = sorted(rnd.sample(GENRES, 1 + rnd.randrange(3)))
+            originalTitle = f"Original {i}" if rnd.random() < 0.1 else None
+            folder = f"{title} ({year})"
+            change = rnd.random()
+            if changeRnd != None:
+                change = changeRnd.random()
+            if server >= 2 and change < divergence / 3:
+                title += " (Director's Cut)"
+            elif server >= 2 and change < divergence * 2 / 3:
+                year += 1
+            elif server >= 2 and change < divergence:
+                i += items
+                title = f"Other Movie {i:07d}"
+                folder = f"{title} ({year})"
+            if server >= 2 and movedRnd.random() < moved:
+                folder = f"{title} [{year}]"
+            self.movies.append(SyntheticMovie(
+                str(server * 1000000 + i), f"plex://movie/{i:08x}", title, originalTitle, year, genres,
+                self._location(folder), BASE_TIME + i))
+        self.byKey = {m.ratingKey: m for m in self.movies}
+        self.collections = []
+        for c in range(items // (COLLECTION_SIZE * 2)):
+            members = self.movies[c * COLLECTION_SIZE * 2:c * COLLECTION_SIZE * 2 + COLLECTION_SIZE]
+            self.collections.append((str(COLLECTION_KEYS + c), f"Collection {c:06d}", members))
+            for m in members:
+                m.collections.append(f"Collection {c:06d}")
+        self.collectionsByKey = {c[0]: c for c in self.collections}
+
+        itemRnd = random.Random(f"{seed}-items-{server}" if server > 2 else f"{seed}-items")
+        self.episodes = []
+        for i in range(episodes):
+            show, season, episode = i // SHOW_SIZE, (i // 10) % 5 + 1, i % 10 + 1
+            title = f"Episode {i:07d}"
+            if server >= 2 and itemRnd.random() < divergence:
+                title += " (Extended)"
+            name = f"Show {show:05d}"
+            self.episodes.append((str(server * 1000000 + 500000 + i), f"plex://episode/{i:08x}", name, season,
+                                  episode, title, 1990 + show % 30,
+                                  self._location(f"{name}\\Season {season:02d}\\{name} - s{season:02d}e{episode:02d}",
+                                                 "TV")))
+        self.tracks = []
+        for i in range(tracks):
+            artist, album, track = i // (ALBUM_SIZE * 10), (i // ALBUM_SIZE) % 10, i % ALBUM_SIZE + 1
+            title = f"Track {i:07d}"
+            if server >= 2 and itemRnd.random() < divergence:
+                title += " (Live)"
+            name, albumName = f"Artist {artist:05d}", f"Album {artist:05d}-{album}"
+            self.tracks.append((str(server * 1000000 + 800000 + i), f"plex://track/{i:08x}", name, albumName,
+                                track, title, 180000 + i % 120000,
+                                self._location(f"{name}\\{albumName}\\{track:02d} Track {i:07d}", "Music",
+                                               "flac")))
+
+    def _location(self, folder, root="Movies", ext="mkv"):
+        # a movie file is named as its folder, the episodes and tracks are
+        # given their folders and file name
+        path = folder if root != "Movies" else f"{folder}\\{folder}"
+        if self.server == 1:
+            return f"Z:\\MediaFolders\\{root}\\{path}.{ext}"
+        return f"/mnt/MediaFolders/{root}/{path.replace(chr(92), '/')}.{ext}"
+
+    def sections(self):
+        """(key, type, title) of the library sections of the server"""
+        sections = [(SECTION_KEY, "movie", LIBRARY)]
+        if self.episodes:
+            sections.append((SHOW_KEY, "show", SHOW_LIBRARY))
+        if self.tracks:
+            sections.append((MUSIC_KEY, "artist", MUSIC_LIBRARY))
+        return sections
+
+
+def _movieXml(m, full):
+    # plex leaves out the empty attributes, so plexapi reloads a partial
+    # movie without originalTitle when it is read
+    attrs = (f'ratingKey="{m.ratingKey}" key="/library/metadata/{m.ratingKey}" type="movie" '
+             f'guid={quoteattr(m.guid)} title={quoteattr(m.title)} year="{m.year}" '
+             f'addedAt="{BASE_TIME}" updatedAt="{m.updatedAt}"')
+    if m.originalTitle != None:
+        attrs += f" originalTitle={quoteattr(m.originalTitle)}"
+    genres = "".join(f'<Genre tag="{g}"/>' for g in m.genres)
+    genres += "".join(f"<Collection tag={quoteattr(c)}/>" for c in m.collections)
+    extra = '<Country tag="USA"/>' if full else ""
+    return (f'<Video {attrs}><Media id="{m.ratingKey}" container="mkv">'
+            f'<Part id="{m.ratingKey}" file={quoteattr(m.location)}/></Media>{genres}{extra}</Video>')
+
+
+def _episodeXml(e):
+    ratingKey, guid, show, season, episode, title, year, location = e
+    return (f'<Video ratingKey="{ratingKey}" key="/library/metadata/{ratingKey}" type="episode" '
+            f'guid={quoteattr(guid)} title={quoteattr(title)} grandparentTitle={quoteattr(show)} '
+            f'parentIndex="{season}" index="{episode}" year="{year}" '
+            f'addedAt="{BASE_TIME}" updatedAt="{BASE_TIME}"><Media id="{ratingKey}" container="mkv">'
+            f'<Part id="{ratingKey}" file={quoteattr(location)}/></Media></Video>')
+
+
+def _trackXml(t):
+    ratingKey, guid, artist, album, track, title, duration, location = t
+    return (f'<Track ratingKey="{ratingKey}" key="/library/metadata/{ratingKey}" type="track" '
+            f'guid={quoteattr(guid)} title={quoteattr(title)} grandparentTitle={quoteattr(artist)} '
+            f'parentTitle={quoteattr(album)} index="{track}" duration="{duration}" '
+            f'addedAt="{BASE_TIME}" updatedAt="{BASE_TIME}"><Media id="{ratingKey}" container="flac">'
+            f'<Part id="{ratingKey}" file={quoteattr(location)}/></Media></Track>')
+
+
+def _collectionXml(col):
+    ratingKey, title, members = col
+    return (f'<Directory ratingKey="{ratingKey}" key="/library/metadata/{ratingKey}/children" '
+            f'type="collection" title={quoteattr(title)} collectionMode="-1" collectionSort="0" '
+            f'childCount="{len(members)}" addedAt="{BASE_TIME}" updatedAt="{BASE_TIME}"/>')
+
+
+def _container(body, size=None, total=None, attrs=""):
+    sizeAttrs = f' size="{size}"' if size != None else ""
+    if total != None:
+        sizeAttrs += f' totalSize="{total}"'
+    return f'<?xml version="1.0" encoding="UTF-8"?><MediaContainer{sizeAttrs}{attrs}>{body}</MediaContainer>'
+
+
+class SyntheticAdapter(HTTPAdapter):
+    """requests adapter serving a SyntheticLibrary as a plex server
+
+    `requests` counts the requests by kind: root, sections, genres, page
+    (section listing, filtered or not), metadata (movie details or
+    reloads), children (collection members).
+    """
+    _metadataRe = re.compile(r"^/library/metadata/([0-9,]+)(/children)?$")
+
+    def __init__(self, library, name):
+        super().__init__()
+        self.library = library
+        self.name = name
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        params = dict(p.split("=", 1) for p in url.query.split("&") if "=" in p)
+        for header in ("X-Plex-Container-Start", "X-Plex-Container-Size"):
+            if request.headers.get(header) != None:
+                params[header] = request.headers[header]
+        status, body = self._route(url.path, params)
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": "text/xml;charset=utf-8"})
+        response.encoding = "utf-8"
+        response._content = body.encode("utf-8")
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def _route(self, path, params):
+        lib = self.library
+        path = path.rstrip("/") or "/"
+        if path == "/":
+            self._count("root")
+            return 200, _container("", attrs=f' friendlyName="{self.name}" machineIdentifier="{self.name}" '
+                                   'version="1.20.0.0" platform="Linux"')
+        if path in ("/library", "/library/sections"):
+            self._count("sections")
+            sections = lib.sections()
+            return 200, _container("".join(f'<Directory key="{key}" type="{kind}" title="{title}"/>'
+                                           for key, kind, title in sections), size=len(sections))
+        if path == f"/library/sections/{SECTION_KEY}/genre":
+            self._count("genres")
+            return 200, _container("".join(f'<Directory key="{i + 1}" fastKey="/library/sections/{SECTION_KEY}/all?genre={i + 1}" '
+                                           f'title="{g}"/>' for i, g in enumerate(GENRES)), size=len(GENRES))
+        for key, items, toXml in ((SHOW_KEY, lib.episodes, _episodeXml), (MUSIC_KEY, lib.tracks, _trackXml)):
+            if path == f"/library/sections/{key}/all":
+                self._count("page")
+                start = int(params.get("X-Plex-Container-Start", 0))
+                size = int(params.get("X-Plex-Container-Size", len(items)))
+                page = items[start:start + size]
+                return 200, _container("".join(toXml(i) for i in page), size=len(page), total=len(items),
+                                       attrs=f' librarySectionID="{key}"')
+        if path == f"/library/sections/{SECTION_KEY}/all":
+            self._count("page")
+            items = lib.collections if params.get("type") == "18" else lib.movies
+            if params.get("genre") != None:
+                genre = GENRES[int(params["genre"]) - 1]
+                items = [m for m in items if genre in m.genres]
+            start = int(params.get("X-Plex-Container-Start", 0))
+            size = int(params.get("X-Plex-Container-Size", len(items)))
+            page = items[start:start + size]
+            toXml = _collectionXml if params.get("type") == "18" else (lambda m: _movieXml(m, False))
+            return 200, _container("".join(toXml(i) for i in page), size=len(page), total=len(items),
+                                   attrs=f' librarySectionID="{SECTION_KEY}"')
+        m = self._metadataRe.match(path)
+        if m != None:
+            if m.group(2):
+                self._count("children")
+                col = lib.collectionsByKey.get(m.group(1))
+                if col == None:
+                    return 404, ""
+                return 200, _container("".join(_movieXml(i, False) for i in col[2]), size=len(col[2]))
+            self._count("metadata")
+            found = [lib.byKey[k] for k in m.group(1).split(",") if k in lib.byKey]
+            if not found:
+                return 404, ""
+            return 200, _container("".join(_movieXml(i, True) for i in found), size=len(found),
+                                   attrs=f' librarySectionID="{SECTION_KEY}"')
+        return 404, ""
+
+
+def syntheticServer(library, name):
+    """plexapi PlexServer answered by a SyntheticAdapter
+
+    Args:
+        library (SyntheticLibrary): the library of the server
+        name (string): friendlyName of the server
+
+    Returns:
+        plexapi.server.PlexServer: the server, its adapter is session.adapter
+    """
+    adapter = SyntheticAdapter(library, name)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.adapter = adapter
+    return PlexServer(f"http://{name}:32400", "synthetic-token", session=session)
+
+
+def syntheticServers(items, divergence=0.05, seed=1, servers=2, moved=0.0, episodes=0, tracks=0):
+    """The servers compared by the benchmarks
+
+    Args:
+        items (int): movies in each library
+        divergence (float, optional): fraction of different movies. Defaults to 0.05.
+        seed (int, optional): random seed. Defaults to 1.
+        servers (int, optional): number of servers. Defaults to 2.
+        moved (float, optional): fraction of moved movies. Defaults to 0.0.
+        episodes (int, optional): episodes of a TV Shows section. Defaults to 0, no section.
+        tracks (int, optional): tracks of a Music section. Defaults to 0, no section.
+
+    Returns:
+        tuple: (server1, server2, ...) plexapi PlexServer
+    """
+    return tuple(syntheticServer(SyntheticLibrary(items, n, divergence, seed, moved, episodes, tracks),
+                                 f"synthetic{n}")
+                 for n in range(1, servers + 1))
@@ -1,9 +1,9 @@
 import os
 import sys
-import getpass
 import logging.config
 import yaml
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -11,7 +11,14 @@ from datetime import datetime
 from plexinfo import sqlitedb as mydb
 from plexinfo import plexutils as myutil
 from plexinfo import appconfig as appcfg
-from plexapi.myplex import MyPlexAccount
+from plexinfo import merkle
+from plexinfo import normalize
+from plexinfo import metrics
+from plexinfo import transport
+from plexinfo import fuzzymatch
+from plexinfo import conncache
+from plexinfo import diffout
+from plexinfo import pagepool
 
 logger = logging.getLogger("PlexCompare")
 now = datetime.now()
@@ -33,55 +40,389 @@ def movieCompare(dbObj, svr1, svr2, args):
         args : arguments from the command line parser
     """
     logger.debug(f"Comparison starting for movie library type")
-    xlist = ['server1', 'server2']
-    for svrNameTag in xlist:
-        if svrNameTag == 'server1':
-            plexSvrName = args.server1
-            xmovLib = svr1.library.section(args.movieLibName)
-        else:
-            plexSvrName = args.server2
-            xmovLib = svr2.library.section(args.movieLibName)
+    for plexSvrName in [args.server1, args.server2]:
+        msg = f"{plexSvrName}: Exporting collection and movie data from movie library : {args.movieLibName}"
+        print(msg)
+        logger.info(msg)
 
-        msg = f"{plexSvrName}: Exporting collection data from movie library : {args.movieLibName}"
+    counts = myutil.exportServers(dbObj, [('server1', svr1), ('server2', svr2)], args.movieLibName,
+                                  movieMax=int(appcfg.sec_compare.get("moviemax", 0)),
+                                  colMax=int(appcfg.sec_compare.get("collectionmax", 0)),
+                                  containerSize=int(appcfg.sec_compare.get("containersize", myutil.CONTAINER_SIZE)),
+                                  incremental=appcfg.getBool(appcfg.sec_db, 'snapshot'),
+                                  fields=dbObj.fields, resume=args.resume)
+    for plexSvrName, svrNameTag in [(args.server1, 'server1'), (args.server2, 'server2')]:
+        msg = f"{plexSvrName}: Exported {counts[svrNameTag]['collections']} collections, {counts[svrNameTag]['movies']} movies"
+        if counts[svrNameTag]['deleted']:
+            msg += f", {counts[svrNameTag]['deleted']} movies deleted"
         print(msg)
         logger.info(msg)
-        myutil.collection2Db(
-            dbObj, xmovLib, dbSvrNameTag=svrNameTag, maxItems=int(appcfg.sec_compare.get("collectionmax", 0)))
 
-        msg = f"{plexSvrName}: Exporting movie data from movie library : {args.movieLibName}"
+    movieDiffFiles(dbObj, args)
+
+
+def nwayCompare(dbObj, plexServers, args):
+    """Compares the movie library (and collections) of all the servers at once
+
+    Each server is exported once, at the same time, and every key is
+    compared to the majority of the servers, or to the --reference server.
+
+    Args:
+        dbObj (databse obj): database object to save data to
+        plexServers (list): Plex server connection objects, same order as serverNames(args)
+        args : arguments from the command line parser
+    """
+    svrNames = serverNames(args)
+    logger.debug(f"N-way comparison starting for {len(svrNames)} servers")
+    for plexSvrName in svrNames:
+        msg = f"{plexSvrName}: Exporting collection and movie data from movie library : {args.movieLibName}"
         print(msg)
         logger.info(msg)
-        myutil.movieLib2Db(dbObj, xmovLib, svrNameTag,
-                           maxItems=int(appcfg.sec_compare.get("moviemax", 0)))
 
-    # Create Collection diff csv file
-    csvFilename = f"{args.movieLibName}_collections_{now.strftime('%Y-%m-%d-%H%M')}.csv"
-    logger.debug(f"exporting to file: {csvFilename}")
+    svrTags = serverTags(args)
+    counts = myutil.exportServers(dbObj, list(zip(svrTags, plexServers)), args.movieLibName,
+                                  movieMax=int(appcfg.sec_compare.get("moviemax", 0)),
+                                  colMax=int(appcfg.sec_compare.get("collectionmax", 0)),
+                                  containerSize=int(appcfg.sec_compare.get("containersize", myutil.CONTAINER_SIZE)),
+                                  incremental=appcfg.getBool(appcfg.sec_db, 'snapshot'),
+                                  fields=dbObj.fields, resume=args.resume)
+    for plexSvrName, svrNameTag in zip(svrNames, svrTags):
+        msg = f"{plexSvrName}: Exported {counts[svrNameTag]['collections']} collections, {counts[svrNameTag]['movies']} movies"
+        if counts[svrNameTag]['deleted']:
+            msg += f", {counts[svrNameTag]['deleted']} movies deleted"
+        print(msg)
+        logger.info(msg)
+
+    nwayDiffFiles(dbObj, args)
+
+
+def sectionCompare(dbObj, svr1, svr2, args):
+    """Compares all the movie, show and music sections of the two servers
+
+    The sections are exported by a pool of [compare] sectionworkers
+    threads into the database, then the diff files of each section are
+    created, and the throughput of each section type is printed.
+
+    Args:
+        dbObj (databse obj): database object to save data to
+        svr1 (Plex server connection object): Server1 to compare
+        svr2 (Plex server connection object): Server 2 to compare
+        args : arguments from the command line parser
+    """
+    workers = int(appcfg.sec_compare.get("sectionworkers", myutil.SECTION_WORKERS))
+    msg = f"{args.server1}, {args.server2}: Exporting all the sections with {workers} workers"
+    print(msg)
+    logger.info(msg)
+    results = myutil.exportSections(dbObj, [('server1', svr1), ('server2', svr2)], workers=workers,
+                                    maxItems=int(appcfg.sec_compare.get("moviemax", 0)),
+                                    colMax=int(appcfg.sec_compare.get("collectionmax", 0)),
+                                    containerSize=int(appcfg.sec_compare.get("containersize", myutil.CONTAINER_SIZE)),
+                                    fields=dbObj.fields, resume=args.resume)
+
+    byType = {}
+    for result in results:
+        libName, itemKind = result["section"], f"{result['type']}s"
+        msg = f"Section {libName} ({itemKind})"
+        for plexSvrName, svrNameTag in [(args.server1, 'server1'), (args.server2, 'server2')]:
+            count = result.get(svrNameTag)
+            if count == None:
+                msg += f", not on {plexSvrName}"
+                continue
+            msg += f", {plexSvrName}: {count[itemKind]} {itemKind} in {count['seconds']:.1f}s"
+            total = byType.setdefault(itemKind, {"sections": set(), "items": 0, "seconds": 0.0})
+            total["sections"].add(libName)
+            total["items"] += count[itemKind]
+            total["seconds"] += count["seconds"]
+        print(msg)
+        logger.info(msg)
+
+        libCSVFile = _csvFile(args, libName, "library")
+        print(f"  Creating Library Diff file {libCSVFile}")
+        dbObj.exportLibDiff(libCSVFile, libName, args.diffOnly, args.outFormat, args.compress)
+        if result["type"] == "movie":
+            colCSVFile = _csvFile(args, libName, "collections")
+            print(f"  Creating Collection Diff file {colCSVFile}")
+            dbObj.exportColDiff(colCSVFile, libName, args.diffOnly, args.outFormat, args.compress)
+            memberCSVFile = _csvFile(args, libName, "members")
+            print(f"  Creating Collection Members Diff file {memberCSVFile}")
+            dbObj.exportMemberDiff(memberCSVFile, libName, args.outFormat, args.compress)
+
+    print("Throughput by section type (fetch seconds of all the servers' sections):")
+    for itemKind, total in sorted(byType.items()):
+        rate = total["items"] / total["seconds"] if total["seconds"] > 0 else 0.0
+        msg = (f"  {itemKind:9} {len(total['sections']):3} sections {total['items']:9} {itemKind} "
+               f"{total['seconds']:8.1f}s {rate:9.0f} {itemKind}/sec")
+        print(msg)
+        logger.info(msg)
+
+
+def _csvFile(args, libName, kind):
+    """Path of a <libName>_<kind>_<date>.csv file, in --OutPath or the current directory
+
+    The extension is of the --format and --compress options, i.e. .jsonl.gz
+    """
+    csvFilename = diffout.fileName(f"{libName}_{kind}_{now.strftime('%Y-%m-%d-%H%M')}", args.outFormat, args.compress)
     if args.dirSave == None:
-        collectionCSVFile = Path.cwd() / csvFilename
+        return Path.cwd() / csvFilename
+    return Path(args.dirSave) / csvFilename
+
+
+def serverNames(args):
+    """Names of all the plex servers compared, in command line order"""
+    return [args.server1, args.server2] + args.moreServers
+
+
+def serverTags(args):
+    """Database server tags of serverNames(), server1, server2, server3..."""
+    return [f"server{i + 1}" for i in range(len(serverNames(args)))]
+
+
+def isNway(args):
+    """True for a comparison of more than two servers, or with a reference server"""
+    return len(serverNames(args)) > 2 or args.reference != None
+
+
+def nwayDiffFiles(dbObj, args):
+    """Creates the N-way movie library and collection csv files
+
+    Args:
+        dbObj (databse obj): database object with the saved data
+        args : arguments from the command line parser
+    """
+    servers = list(zip(serverTags(args), serverNames(args)))
+    reference = None
+    if args.reference != None:
+        reference = serverTags(args)[serverNames(args).index(args.reference)]
+        msg = f"Comparing to the reference server {args.reference}"
     else:
-        collectionCSVFile = Path(args.dirSave) / csvFilename
+        msg = f"Comparing to the majority of the {len(servers)} servers"
+    print(msg)
+    logger.info(msg)
+
+    for kind, export in (("collections", dbObj.exportColMatrix), ("library", dbObj.exportLibMatrix)):
+        csvFile = _csvFile(args, args.movieLibName, f"{kind}_matrix")
+        msg = f"Creating {kind} N-way diff file {csvFile}"
+        print(msg)
+        logger.info(msg)
+        export(csvFile, servers, reference, args.outFormat, args.compress)
+
+
+def mergeCompare(svr1, svr2, args):
+    """Compares the movie library (and collections) with the merge engine
+
+    Both servers are fetched at the same time, and their sorted records are
+    merge joined straight to the diff csv files, no database is used.
+    The diff files are the same as the database ones, with the [db] schema
+    setting deciding whether the movie file has only the different keys.
+
+    Args:
+        svr1 (Plex server connection object): Server1 to compare
+        svr2 (Plex server connection object): Server 2 to compare
+        args : arguments from the command line parser
+    """
+    for plexSvrName in [args.server1, args.server2]:
+        msg = f"{plexSvrName}: Exporting collection and movie data from movie library : {args.movieLibName}"
+        print(msg)
+        logger.info(msg)
+
+    csvFiles = {kind: _csvFile(args, args.movieLibName, kind) for kind in ("collections", "members", "library", "moved")}
+    print(f"Creating Collection Diff file {csvFiles['collections']}")
+    print(f"Creating Collection Members Diff file {csvFiles['members']}")
+    print(f"Creating Movie Library Diff file {csvFiles['library']}")
+    print(f"Creating Moved Movies file {csvFiles['moved']}")
+    counts = myutil.mergeCompare([svr1, svr2], args.movieLibName, csvFiles["library"], csvFiles["collections"],
+                                 movieMax=int(appcfg.sec_compare.get("moviemax", 0)),
+                                 colMax=int(appcfg.sec_compare.get("collectionmax", 0)),
+                                 containerSize=int(appcfg.sec_compare.get("containersize", myutil.CONTAINER_SIZE)),
+                                 fields=compareFields(args),
+                                 diffOnly=args.diffOnly or appcfg.sec_db.get('schema', 'eav') == "wide",
+                                 movedFile=csvFiles["moved"], colDiffOnly=args.diffOnly,
+                                 fmt=args.outFormat, compress=args.compress, memberFile=csvFiles["members"])
+    for plexSvrName, n in [(args.server1, "items1"), (args.server2, "items2")]:
+        msg = f"{plexSvrName}: Compared {counts['collections'][n]} collections, {counts['library'][n]} movies"
+        print(msg)
+        logger.info(msg)
+    msg = f"  {counts['moved']['moved']} movies moved or renamed, {counts['moved']['server1']} only on {args.server1}, {counts['moved']['server2']} only on {args.server2}"
+    print(msg)
+    logger.info(msg)
+
+
+def quickCompare(svr1, svr2, args):
+    """Quick compare of the movie library with merkle trees, no database
+
+    Prints the divergent folders, and writes the keys that differ to the
+    movie library csv file.
+
+    Args:
+        svr1 (Plex server connection object): Server1 to compare
+        svr2 (Plex server connection object): Server 2 to compare
+        args : arguments from the command line parser
+    """
+    msg = f"Quick compare of movie library : {args.movieLibName}"
+    print(msg)
+    logger.info(msg)
+    movieMax = int(appcfg.sec_compare.get("moviemax", 0))
+    containerSize = int(appcfg.sec_compare.get("containersize", myutil.CONTAINER_SIZE))
+    # the fields of the setting, or the quick compare ones
+    fields = compareFields(args)
+    if fields == normalize.MOVIE_KEYS:
+        fields = merkle.QUICK_FIELDS
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        tree1, tree2 = pool.map(lambda svr: myutil.movieLibTree(svr, args.movieLibName, movieMax, containerSize,
+                                                                fields),
+                                [svr1, svr2])
+
+    with metrics.phase("quick.diff"):
+        folders, itemDiffs = merkle.diffTrees(tree1, tree2)
+    maxDepth = int(appcfg.sec_compare.get("quickdepth", 3))
+    print(f"{tree1.root.count} movies on {args.server1}, {tree2.root.count} movies on {args.server2}")
+    if not folders and not itemDiffs:
+        print("No differences")
+    for folderPath, depth, changed, only1, only2 in folders:
+        if depth <= maxDepth:
+            print(f"{'  ' * depth}{folderPath}  changed: {changed}  only {args.server1}: {only1}  only {args.server2}: {only2}")
+
+    libCSVFile = _csvFile(args, args.movieLibName, "library")
+    print(f"Creating Movie Library Diff file {libCSVFile}")
+    with diffout.openText(libCSVFile, args.compress) as textFile:
+        csv_writer = diffout.DiffWriter(textFile, ["library", "filePath", "sKey", "server1_VAL", "server2_VAL", "isDiff"],
+                                        args.outFormat)
+        for filePath, sKey, val1, val2 in sorted(itemDiffs, key=lambda d: (d[0], d[1])):
+            csv_writer.writerow([args.movieLibName, filePath, sKey, _csvVal(val1), _csvVal(val2), '***Different***'])
+
+
+def compareFields(args):
+    """Library keys compared, of --fields or the [compare] fields setting
+
+    Args:
+        args : arguments from the command line parser
+
+    Returns:
+        tuple: the keys, normalize.MOVIE_KEYS when neither is set
+    """
+    if args.fields != None:
+        return normalize.parseFields(args.fields)
+    return normalize.parseFields(appcfg.sec_compare.get("fields"))
+
 
+def _csvVal(val):
+    """Diff file value, same as the database diff results"""
+    if val is merkle.MISSING:
+        return '--Value missing--'
+    if val == None:
+        return '--NULL VALUE--'
+    return val
+
+
+def movieDiffFiles(dbObj, args):
+    """Creates the movie library and collection diff csv files
+
+    Args:
+        dbObj (databse obj): database object with the saved data
+        args : arguments from the command line parser
+    """
+    # Create Collection diff csv file
+    collectionCSVFile = _csvFile(args, args.movieLibName, "collections")
     logger.debug(f"exporting to file: {collectionCSVFile}")
     msg = f"Creating Collection Diff file {collectionCSVFile}"
     print(msg)
     logger.info(msg)
-    dbObj.exportColDiff(collectionCSVFile)
+    dbObj.exportColDiff(collectionCSVFile, diffOnly=args.diffOnly, fmt=args.outFormat, compress=args.compress)
+
+    # Create the collection members csv file
+    memberCSVFile = _csvFile(args, args.movieLibName, "members")
+    msg = f"Creating Collection Members Diff file {memberCSVFile}"
+    print(msg)
+    logger.info(msg)
+    dbObj.exportMemberDiff(memberCSVFile, fmt=args.outFormat, compress=args.compress)
 
     # Create Movie diff csv file
-    csvFilename = f"{args.movieLibName}_library_{now.strftime('%Y-%m-%d-%H%M')}.csv"
-    # Path.cwd
-    if args.dirSave == None:
-        libCSVFile = Path.cwd() / csvFilename
+    libCSVFile = _csvFile(args, args.movieLibName, "library")
+    print(f"Creating Movie Library Diff file {libCSVFile}")
+    dbObj.exportLibDiff(libCSVFile, diffOnly=args.diffOnly, fmt=args.outFormat, compress=args.compress)
+
+    # Create the moved movies csv file
+    movedCSVFile = _csvFile(args, args.movieLibName, "moved")
+    print(f"Creating Moved Movies file {movedCSVFile}")
+    only1, only2 = dbObj.unmatchedItems(args.movieLibName)
+    counts = fuzzymatch.exportMoved(movedCSVFile, args.movieLibName, only1, only2, args.outFormat, args.compress)
+    msg = f"  {counts['moved']} movies moved or renamed, {counts['server1']} only on {args.server1}, {counts['server2']} only on {args.server2}"
+    print(msg)
+    logger.info(msg)
+
+
+def openDb(args):
+    """Sets up the database, the snapshot database when there is one
+
+    Args:
+        args : arguments from the command line parser
+
+    Returns:
+        tuple: (sqlitedb.LocalDB, database file), the database is initialized
+    """
+    msg = f"Setting up internal database"
+    print(msg)
+    logger.info(msg)
+    snapshot = appcfg.getBool(appcfg.sec_db, 'snapshot')
+    if appcfg.sec_db.get('filename') == None:
+        dbFile = ":memory:"
+        logger.debug(f"No dbfile config setting. dbFile = {dbFile}")
+        if snapshot or args.cacheOnly or args.rekey or args.resume:
+            msg = f"A [db] filename setting is required for the snapshot or --resume"
+            print(msg)
+            logger.critical(msg)
+            sys.exit(1)
     else:
-        libCSVFile = Path(args.dirSave) / csvFilename
+        dbFile = appcfg.sec_paths['data'] / appcfg.sec_db['filename']
+        msg = f"  OVERRIDE: database saving to file: {dbFile}"
+        logger.info(msg)
+        print(msg)
+        if args.cacheOnly and not dbFile.exists():
+            msg = f"No snapshot database {dbFile} for --cache-only"
+            print(msg)
+            logger.critical(msg)
+            sys.exit(1)
+        if dbFile.exists() and not (snapshot or args.cacheOnly or args.rekey or args.resume):
+            logger.debug(f"Deleting existing dbfile : {dbFile}")
+            dbFile.unlink()
+            # the write-ahead log of the durable profile goes with it
+            for walFile in (Path(f"{dbFile}-wal"), Path(f"{dbFile}-shm")):
+                if walFile.exists():
+                    walFile.unlink()
 
-    print(f"Creating Movie Library Diff file {libCSVFile}")
-    dbObj.exportLibDiff(libCSVFile)
+    db1 = mydb.LocalDB(dbLoc=str(dbFile), batchSize=int(
+        appcfg.sec_db.get('batchsize', 5000)), schema=appcfg.sec_db.get('schema', 'eav'),
+        fields=compareFields(args), profile=appcfg.sec_db.get('profile', 'auto'),
+        ramBudget=int(appcfg.sec_db.get('rambudget', mydb.RAM_BUDGET)))
+    if db1.isInitialized():
+        logger.info(f"Using the snapshot in {dbFile}")
+    db1.initDB(appcfg.sec_paths['scripts'])
+    return db1, dbFile
 
 
 def main(args):
     logger.debug(f"args is {args}")
+    if args.reference != None and args.reference not in serverNames(args):
+        msg = f"The reference server {args.reference} is not one of the servers compared"
+        print(msg)
+        logger.critical(msg)
+        sys.exit(1)
+    if args.quick and isNway(args):
+        msg = f"--quick compares two servers, without --reference"
+        print(msg)
+        logger.critical(msg)
+        sys.exit(1)
+    if args.allSections and (args.movieLibName != None or isNway(args) or args.quick or args.engine == "merge"
+                             or args.cacheOnly):
+        msg = f"--all-sections compares all the sections of two servers, without --Movie, --quick, --engine merge or --cache-only"
+        print(msg)
+        logger.critical(msg)
+        sys.exit(1)
+    if args.engine == "merge" and (isNway(args) or args.cacheOnly or args.rekey or args.resume):
+        msg = f"--engine merge compares two servers, without the database"
+        print(msg)
+        logger.critical(msg)
+        sys.exit(1)
     logger.debug(f"Checking for config file")
 
     logger.debug(
@@ -103,59 +444,93 @@ def main(args):
     logger.debug(f"Config section [db]: {appcfg.sec_db}")
     logger.debug(f"Config section [server]: {appcfg.sec_server}")
     logger.debug(f"Config section [paths]: {appcfg.sec_paths}")
+    logger.debug(f"Config section [pathmap]: {appcfg.sec_pathmap}")
+    normalize.setPathMap(normalize.PathMap(appcfg.sec_pathmap))
+    myutil.setRetries(int(appcfg.sec_compare.get("retries", myutil.RETRIES)),
+                      float(appcfg.sec_compare.get("retrydelay", myutil.RETRY_DELAY)))
 
-    # quit()
-    logger.debug(f"getpass from user {args.userName}")
-    userPass = getpass.getpass(
-        prompt=f"Enter {args.userName}'s Plex Password: ")
-    msg = f"Authenticating {args.userName}"
-    print(msg)
-    logger.info(f"{msg}")
-    try:
-        plexAcct = MyPlexAccount(args.userName, userPass)
-    except Exception as err:
-        logger.critical(f"Error:  {err}", exc_info=True)
-        sys.exit()
-
-    logger.info(f"username: {args.userName} authenticated.")
-    ###################################################
-    # Setting up database
-    msg = f"Setting up internal database"
-    print(msg)
-    logger.info(msg)
-    if appcfg.sec_db.get('filename') == None:
-        dbFile = ":memory:"
-        logger.debug(f"No dbfile config setting. dbFile = {dbFile}")
+    if args.engine == "merge":
+        # the merge engine does not use the database
+        db1, dbFile = None, None
     else:
-        dbFile = appcfg.sec_paths['data'] / appcfg.sec_db['filename']
-        msg = f"  OVERRIDE: database saving to file: {dbFile}"
+        db1, dbFile = openDb(args)
+
+    if args.rekey:
+        msg = f"Re-keying the snapshot in {dbFile} with the [pathmap] rules"
+        print(msg)
         logger.info(msg)
+        msg = f"  {db1.rekeyPaths(normalize.uFilePath)} movies have a new path"
         print(msg)
-        if dbFile.exists():
-            logger.debug(f"Deleting existing dbfile : {dbFile}")
-            dbFile.unlink()
+        logger.info(msg)
 
-    db1 = mydb.LocalDB(dbLoc=str(dbFile))
-    db1.initDB(appcfg.sec_paths['scripts'])
+    if args.cacheOnly:
+        msg = f"Cache only, creating the diff files from the snapshot in {dbFile}"
+        print(msg)
+        logger.info(msg)
+        if args.movieLibName != None and isNway(args):
+            nwayDiffFiles(db1, args)
+        elif args.movieLibName != None:
+            movieDiffFiles(db1, args)
+        return
+
+    # Recording or replaying the plex responses
+    plexTransport = None
+    if args.record != None:
+        plexTransport = transport.Recorder(args.record)
+    elif args.replay != None:
+        plexTransport = transport.Replayer(args.replay)
+    if plexTransport != None:
+        plexTransport.start()
+    pagepool.start(args.workers)
+    try:
+        plexCompare(db1, args)
+    finally:
+        pagepool.stop()
+        if plexTransport != None:
+            plexTransport.stop()
+
+
+def plexCompare(dbObj, args):
+    """Connects to plex and compares the servers
+
+    Args:
+        dbObj (databse obj): database object to save data to
+        args : arguments from the command line parser
+    """
+    if args.record != None or args.replay != None:
+        # the sign in and connections are recorded, or replayed without a password
+        cache = None
+    else:
+        cache = conncache.fromConfig(appcfg.sec_server, appcfg.sec_paths['data'], args.userName)
+    userPass = "" if args.replay != None else None
+    if args.replay != None:
+        # a replayed error is replayed again
+        myutil.setRetries(0)
     ############################################################
     # Connecting to Plex Servers
     msg = f"Connecting to servers"
     print(msg)
     logger.info(f"{msg}")
-    plexServer1 = myutil.connectPlexServer(plexAcct, args.server1)
-
-    msg = f"  {args.server1} - Connected"
-    print(msg)
-    logger.info(f"{msg}")
-
-    plexServer2 = myutil.connectPlexServer(plexAcct, args.server2)
-    msg = f"  {args.server2} - Connected"
-    print(msg)
-    logger.info(f"{msg}")
+    plexServers = myutil.connectPlexServers(lambda: myutil.plexAccount(args.userName, userPass, cache),
+                                            serverNames(args), cache)
+    plexServer1, plexServer2 = plexServers[:2]
+    for svrName in serverNames(args):
+        msg = f"  {svrName} - Connected"
+        print(msg)
+        logger.info(f"{msg}")
     ############################################################
     # Reporting Movie Libary section differences
-    if args.movieLibName != None:
-        movieCompare(db1, plexServer1, plexServer2, args)
+    if args.allSections:
+        sectionCompare(dbObj, plexServer1, plexServer2, args)
+    elif args.movieLibName != None:
+        if isNway(args):
+            nwayCompare(dbObj, plexServers, args)
+        elif args.quick:
+            quickCompare(plexServer1, plexServer2, args)
+        elif args.engine == "merge":
+            mergeCompare(plexServer1, plexServer2, args)
+        else:
+            movieCompare(dbObj, plexServer1, plexServer2, args)
 
 
 if __name__ == '__main__':
@@ -170,10 +545,55 @@ if __name__ == '__main__':
                         metavar='server_name')
     parser.add_argument('server2', help='Second plex server',
                         type=str, metavar='server_name')
+    parser.add_argument('moreServers', help='More plex servers, for an N-way compare of all the servers',
+                        type=str, metavar='server_name', nargs='*')
     parser.add_argument(
         '--OutPath', help='Directory path where csv files will be placed. Default is current directory', metavar='DirPath', type=str, dest='dirSave')
 
     parser.add_argument(
         '--Movie', help='Movie library name to compare', dest='movieLibName', metavar='lib_name', type=str)
+    parser.add_argument(
+        '--all-sections', help='Compare all the movie, show and music sections of the two servers', action='store_true', dest='allSections')
+    parser.add_argument(
+        '--cache-only', help='Create the csv files from the snapshot database, without connecting to plex', action='store_true', dest='cacheOnly')
+    parser.add_argument(
+        '--resume', help='Continue the exports of the last run that stopped, from their checkpoints in the database', action='store_true', dest='resume')
+    parser.add_argument(
+        '--rekey', help='Re-key the snapshot database after the [pathmap] rules were changed', action='store_true', dest='rekey')
+    transportGroup = parser.add_mutually_exclusive_group()
+    transportGroup.add_argument(
+        '--record', help='Record the plex responses of this run to a zip archive', metavar='archive', type=str, dest='record')
+    transportGroup.add_argument(
+        '--replay', help='Replay the plex responses of a --record archive, without any network', metavar='archive', type=str, dest='replay')
+    parser.add_argument(
+        '--reference', help='N-way compare to this server, instead of the majority of the servers', metavar='server_name', type=str, dest='reference')
+    parser.add_argument(
+        '--engine', help='Diff engine, sql (the database, default) or merge (sort-merge of the two servers, no database)', choices=('sql', 'merge'), default='sql', dest='engine')
+    parser.add_argument(
+        '--quick', help='Quick compare of the movie library by folder, prints the folders that are different', action='store_true', dest='quick')
+    parser.add_argument(
+        '--fields', help='Movie fields to compare, comma separated, i.e. guid,Title. Overrides the [compare] fields setting', metavar='field_list', type=str, dest='fields')
+    parser.add_argument(
+        '--diff-only', help='Only write the keys that are different to the diff files', action='store_true', dest='diffOnly')
+    parser.add_argument(
+        '--format', help='Diff file format, csv (default) or jsonl (JSON Lines, an object per row)', choices=tuple(diffout.FORMATS), default='csv', dest='outFormat')
+    parser.add_argument(
+        '--compress', help='Compress the diff files with gzip, bz2 or xz', choices=tuple(diffout.COMPRESSIONS), dest='compress')
+    parser.add_argument(
+        '--workers', help='Parse and normalize the listing pages in N processes, for very large libraries. Default 0, in the fetch threads', metavar='N', type=int, default=0, dest='workers')
+    parser.add_argument(
+        '--metrics', help='Write the timings and counts of the run to a json file', metavar='out.json', type=str, dest='metricsFile')
+    parser.add_argument(
+        '--profile', help='Run with cProfile and print the top hot spots', action='store_true', dest='profile')
     parsedArgs = parser.parse_args()
-    main(parsedArgs)
+    if parsedArgs.metricsFile != None:
+        metrics.enable()
+    try:
+        if parsedArgs.profile:
+            metrics.profileCall(main, parsedArgs)
+        else:
+            main(parsedArgs)
+    finally:
+        if parsedArgs.metricsFile != None:
+            metrics.write(parsedArgs.metricsFile)
+            print(f"Metrics written to {parsedArgs.metricsFile}")
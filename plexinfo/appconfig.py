@@ -7,6 +7,7 @@ sec_compare = dict()
 sec_db = dict()
 sec_server = dict()
 sec_paths = dict()
+sec_pathmap = dict()
 
 # Defaults for the values:
 sec_paths['data'] = default = Path.cwd() / 'data'
@@ -32,3 +33,24 @@ def loadCfg(cfgFile):
     if cfgParser.has_section('paths'):
         for k, v in cfgParser.items('paths'):
             sec_paths[k] = Path(v)
+
+    if cfgParser.has_section('pathmap'):
+        for k, v in cfgParser.items('pathmap', raw=True):
+            sec_pathmap[k] = v
+
+
+def getBool(section, key, default=False):
+    """Boolean value of a config setting
+
+    Args:
+        section (dict): config section, i.e. sec_db
+        key (string): setting name
+        default (bool, optional): value when not set. Defaults to False.
+
+    Returns:
+        bool: True for 1, yes, true, on (same as ConfigParser.getboolean)
+    """
+    value = section.get(key)
+    if value == None:
+        return default
+    return str(value).strip().lower() in ('1', 'yes', 'true', 'on')
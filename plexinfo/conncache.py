@@ -0,0 +1,163 @@
+# Cache of the plex.tv sign in token and the server connections, between runs
+import os
+import json
+import time
+import logging
+import threading
+from plexinfo import appconfig as appcfg
+
+logger = logging.getLogger("conncache")
+
+# Hours a cached token or connection is used before it is discovered again
+CACHE_HOURS = 168
+
+
+class ConnectionCache():
+    """The auth token of a plex user and the last working URI of each server
+
+    The cache is a JSON file of all the users, only readable by the user
+    running the scripts, as it has the tokens. Entries older than
+    maxHours are not used, and are replaced by the next sign in or
+    connection discovery.
+
+    Usage:
+        cache = ConnectionCache("data/plexcache.json", userName)
+        token = cache.token()
+        ...
+        cache.save()
+    """
+
+    def __init__(self, cacheFile, userName, maxHours=CACHE_HOURS):
+        """
+        Args:
+            cacheFile (string): JSON cache file, created by save()
+            userName (string): plex user the tokens and connections are for
+            maxHours (float, optional): age of the entries used. Defaults to CACHE_HOURS.
+        """
+        self.cacheFile = str(cacheFile)
+        self.userName = userName
+        self.maxAge = float(maxHours) * 3600
+        self._users = {}
+        self._changed = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Read the cache file, a missing or unreadable file is an empty cache"""
+        if not os.path.isfile(self.cacheFile):
+            logger.debug(f"no connection cache {self.cacheFile}")
+            return
+        try:
+            mode = os.stat(self.cacheFile).st_mode & 0o777
+            if mode & 0o077:
+                logger.warning(f"{self.cacheFile} is readable by other users, restricting it to the owner")
+                os.chmod(self.cacheFile, 0o600)
+            with open(self.cacheFile, "rt") as f:
+                self._users = json.load(f).get("users", {})
+        except (OSError, ValueError) as err:
+            logger.warning(f"Ignoring the connection cache {self.cacheFile}: {err}")
+            self._users = {}
+        logger.debug(f"connection cache {self.cacheFile} loaded")
+
+    def save(self):
+        """Write the cache file when it was changed, only readable by the user"""
+        with self._lock:
+            if not self._changed:
+                return
+            tmpFile = f"{self.cacheFile}.tmp"
+            try:
+                fd = os.open(tmpFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "wt") as f:
+                    json.dump({"users": self._users}, f, indent=1, sort_keys=True)
+                os.replace(tmpFile, self.cacheFile)
+            except OSError as err:
+                # the run goes on without the cache
+                logger.warning(f"Cannot write the connection cache {self.cacheFile}: {err}")
+                return
+            self._changed = False
+        logger.debug(f"connection cache {self.cacheFile} saved")
+
+    def _fresh(self, entry):
+        if entry == None or time.time() - entry.get("savedAt", 0) > self.maxAge:
+            return None
+        return entry
+
+    def token(self):
+        """The cached auth token of the user
+
+        Returns:
+            string: the token, None when there is none or it expired
+        """
+        with self._lock:
+            entry = self._fresh(self._users.get(self.userName, {}).get("account"))
+        return entry["token"] if entry != None else None
+
+    def setToken(self, token):
+        """Cache the auth token of the user
+
+        Args:
+            token (string): MyPlexAccount authenticationToken
+        """
+        with self._lock:
+            self._users.setdefault(self.userName, {})["account"] = {"token": token, "savedAt": time.time()}
+            self._changed = True
+
+    def forgetToken(self):
+        """Remove the cached token of the user, i.e. it was refused"""
+        with self._lock:
+            if self._users.get(self.userName, {}).pop("account", None) != None:
+                self._changed = True
+
+    def server(self, svrName):
+        """The last working connection of a server
+
+        Args:
+            svrName (string): plex server name
+
+        Returns:
+            tuple: (uri, server access token), None when there is none or it expired
+        """
+        with self._lock:
+            entry = self._fresh(self._users.get(self.userName, {}).get("servers", {}).get(svrName))
+        return (entry["uri"], entry["token"]) if entry != None else None
+
+    def setServer(self, svrName, uri, token):
+        """Cache the working connection of a server
+
+        Args:
+            svrName (string): plex server name
+            uri (string): server URI connected to
+            token (string): server access token
+        """
+        with self._lock:
+            servers = self._users.setdefault(self.userName, {}).setdefault("servers", {})
+            servers[svrName] = {"uri": uri, "token": token, "savedAt": time.time()}
+            self._changed = True
+
+    def forgetServer(self, svrName):
+        """Remove the cached connection of a server, i.e. it failed
+
+        Args:
+            svrName (string): plex server name
+        """
+        with self._lock:
+            if self._users.get(self.userName, {}).get("servers", {}).pop(svrName, None) != None:
+                self._changed = True
+
+
+def fromConfig(secServer, dataDir, userName):
+    """The connection cache of the [server] config section
+
+    Args:
+        secServer (dict): [server] section, cache, cachefile and cachehours settings
+        dataDir (Path): data directory of a relative cachefile
+        userName (string): plex user
+
+    Returns:
+        ConnectionCache: None when the cache setting is not on
+    """
+    if not appcfg.getBool(secServer, "cache"):
+        return None
+    cacheFile = dataDir / secServer.get("cachefile", "plexcache.json")
+    logger.info(f"Using the connection cache {cacheFile}")
+    return ConnectionCache(cacheFile, userName, secServer.get("cachehours", CACHE_HOURS))
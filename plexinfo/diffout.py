@@ -0,0 +1,167 @@
+# Diff file writers, csv or JSON Lines, optionally compressed
+import io
+import sys
+import bz2
+import csv
+import gzip
+import json
+import lzma
+import logging
+from itertools import count
+from operator import itemgetter
+
+logger = logging.getLogger("diffout")
+
+# Output formats and their file extension
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl"}
+
+# Compressions of the standard library and their file extension
+COMPRESSIONS = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+
+# Bytes buffered before a write to the file
+BUFFER_SIZE = 1 << 20
+
+# Fast levels, the diff files are large and mostly repeated text,
+# the speed of bz2 hardly depends on its level
+_LEVELS = {"gzip": 1, "bz2": 9, "xz": 1}
+
+
+def checkOptions(fmt, compress):
+    """Exit when the format or the compression is not supported
+
+    Args:
+        fmt (string): a key of FORMATS
+        compress (string): a key of COMPRESSIONS, None for no compression
+    """
+    if fmt not in FORMATS:
+        logger.critical(f"Unknown diff file format {fmt}. Must be one of {', '.join(FORMATS)}")
+        sys.exit(1)
+    if compress != None and compress not in COMPRESSIONS:
+        logger.critical(f"Unknown compression {compress}. Must be one of {', '.join(COMPRESSIONS)}")
+        sys.exit(1)
+
+
+def fileName(baseName, fmt="csv", compress=None):
+    """File name of a diff file, with the extensions of its format and compression
+
+    Args:
+        baseName (string): name without an extension, i.e. Movies_library_2024-01-31-1200
+        fmt (string, optional): a key of FORMATS. Defaults to csv.
+        compress (string, optional): a key of COMPRESSIONS. Defaults to None.
+
+    Returns:
+        string: i.e. Movies_library_2024-01-31-1200.jsonl.gz
+    """
+    return baseName + FORMATS[fmt] + (COMPRESSIONS[compress] if compress != None else "")
+
+
+def openText(oFile, compress=None):
+    """Open a text file for writing, through a BUFFER_SIZE buffer
+
+    An uncompressed file has the default encoding, as the csv files
+    always had, a compressed file is utf-8.
+
+    Args:
+        oFile (string): File name
+        compress (string, optional): a key of COMPRESSIONS. Defaults to None.
+
+    Returns:
+        file object: text file, closing it closes the file
+    """
+    if compress == None:
+        return open(oFile, "w", newline='', buffering=BUFFER_SIZE)
+    raw = open(oFile, "wb", buffering=BUFFER_SIZE)
+    try:
+        if compress == "gzip":
+            packed = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=_LEVELS[compress])
+        elif compress == "bz2":
+            packed = bz2.BZ2File(raw, mode="wb", compresslevel=_LEVELS[compress])
+        else:
+            packed = lzma.LZMAFile(raw, mode="wb", preset=_LEVELS[compress])
+    except Exception:
+        raw.close()
+        raise
+    return _PackedText(packed, raw)
+
+
+class _PackedText(io.TextIOWrapper):
+    """utf-8 text of a compressed file, closes the file under the compressor too"""
+
+    def __init__(self, packed, raw):
+        super().__init__(packed, encoding="utf-8", newline='', write_through=False)
+        self._raw = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw.close()
+
+
+class DiffWriter():
+    """Writes the rows of a diff file, as csv.writer, in csv or JSON Lines
+
+    A JSON Lines row is an object of the column names to the values.
+
+    Usage:
+        with diffout.openText(oFile, compress) as f:
+            writer = diffout.DiffWriter(f, columns, fmt)
+            writer.writerows(rows)
+    """
+
+    def __init__(self, textFile, columns, fmt="csv"):
+        """
+        Args:
+            textFile (file object): text file, see openText()
+            columns (list): column names, the csv header
+            fmt (string, optional): a key of FORMATS. Defaults to csv.
+        """
+        self.columns = list(columns)
+        self.rowCount = 0
+        if fmt == "csv":
+            self._csv = csv.writer(textFile, dialect='excel')
+            self._csv.writerow(self.columns)
+        else:
+            self._csv = None
+            self._file = textFile
+            self._encode = json.JSONEncoder(ensure_ascii=False, check_circular=False).encode
+
+    def writerow(self, row):
+        self.rowCount += 1
+        if self._csv != None:
+            self._csv.writerow(row)
+        else:
+            self._file.write(self._encode(dict(zip(self.columns, row))) + "\n")
+
+    def writerows(self, rows):
+        # counted without a python loop, the rows are not held
+        counter = count()
+        rows = map(itemgetter(0), zip(rows, counter))
+        if self._csv != None:
+            self._csv.writerows(rows)
+        else:
+            columns = self.columns
+            self._file.writelines(self._encode(dict(zip(columns, row))) + "\n" for row in rows)
+        self.rowCount += next(counter)
+
+
+def writeCursor(cursor, oFile, fmt="csv", compress=None):
+    """Write the rows of an executed query to a diff file
+
+    The cursor is streamed straight into the writer, which is faster
+    than fetchmany() chunks with sqlite3, and the file is written
+    through a BUFFER_SIZE buffer.
+
+    Args:
+        cursor (sqlite3.Cursor): executed query, its column names are the header
+        oFile (string): File name
+        fmt (string, optional): a key of FORMATS. Defaults to csv.
+        compress (string, optional): a key of COMPRESSIONS. Defaults to None.
+
+    Returns:
+        int: rows written
+    """
+    with openText(oFile, compress) as textFile:
+        writer = DiffWriter(textFile, [d[0] for d in cursor.description], fmt)
+        writer.writerows(cursor)
+    return writer.rowCount
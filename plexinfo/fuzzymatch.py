@@ -0,0 +1,137 @@
+# Matches the movies only on one server to moved or renamed movies of the other
+import re
+import sys
+import logging
+import unicodedata
+from collections import deque
+from plexinfo import metrics
+from plexinfo import diffout
+
+logger = logging.getLogger("fuzzymatch")
+
+# Library keys read by the matching, a projection without them is
+# matched by file name only
+MATCH_KEYS = ("guid", "Title", "Year")
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normText(text):
+    """Lower case letters and digits of a text, accents removed, words separated by a space
+
+    Args:
+        text (string): i.e. a title
+
+    Returns:
+        string: normalized text, empty when there is nothing left
+    """
+    if text == None:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+
+def _guidKey(path, keyVals):
+    guid = keyVals.get("guid")
+    # local:// guids are only unique on one server, str(None) is saved for no guid
+    if guid == None or guid in ("", "None") or str(guid).startswith("local://"):
+        return None
+    return guid
+
+
+def _titleYearKey(path, keyVals):
+    title = normText(keyVals.get("Title"))
+    if not title:
+        return None
+    return f"{title}\x1f{keyVals.get('Year')}"
+
+
+def _stemKey(path, keyVals):
+    name = path.rsplit("/", 1)[-1]
+    stem = name.rsplit(".", 1)[0] if "." in name else name
+    return normText(stem) or None
+
+
+# Blocking passes, in order: name and the key of a movie, None when the
+# movie can not be matched by this pass
+BLOCKS = (("guid", _guidKey),
+          ("title+year", _titleYearKey),
+          ("file name", _stemKey))
+
+
+def matchMoved(only1, only2):
+    """Match the movies only on server1 to movies only on server2
+
+    Each pass of BLOCKS indexes the movies of server2 still unmatched by
+    its key, and looks up the movies of server1 still unmatched, so there
+    is no comparison of every pair. Movies with the same key are paired
+    in file path order.
+
+    Args:
+        only1 (dict): uFilePath to keyVals of the movies only on server1
+        only2 (dict): uFilePath to keyVals of the movies only on server2
+
+    Returns:
+        tuple: (matches, left1, left2), matches is a list of
+            (server1 path, server2 path, block name), left1 and left2 the
+            movies that were not matched
+    """
+    left1 = dict(only1)
+    left2 = dict(only2)
+    matches = []
+    for name, blockKey in BLOCKS:
+        if not left1 or not left2:
+            break
+        index = {}
+        for path in sorted(left2):
+            key = blockKey(path, left2[path])
+            if key != None:
+                index.setdefault(key, deque()).append(path)
+        for path in sorted(left1):
+            key = blockKey(path, left1[path])
+            candidates = index.get(key) if key != None else None
+            if candidates:
+                path2 = candidates.popleft()
+                matches.append((path, path2, name))
+                del left1[path]
+                del left2[path2]
+        logger.debug(f"{name}: {len(matches)} matched, {len(left1)} and {len(left2)} left")
+    return matches, left1, left2
+
+
+def exportMoved(oFile, library, only1, only2, fmt="csv", compress=None):
+    """Write the moved or renamed movies, and the movies only on one server, to a csv file
+
+    Args:
+        oFile (string): File name for the csv file
+        library (string): library name
+        only1 (dict): uFilePath to keyVals of the movies only on server1
+        only2 (dict): uFilePath to keyVals of the movies only on server2
+        fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+        compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
+
+    Returns:
+        dict: {"moved": count, "server1": count, "server2": count}
+    """
+    with metrics.phase("fuzzy.match"):
+        matches, left1, left2 = matchMoved(only1, only2)
+        rows = [(library, "moved", path1, path2, matchedBy,
+                 only1[path1].get("Title"), only1[path1].get("Year")) for path1, path2, matchedBy in matches]
+        rows.extend((library, "only server1", path, "", "", keyVals.get("Title"), keyVals.get("Year"))
+                    for path, keyVals in sorted(left1.items()))
+        rows.extend((library, "only server2", "", path, "", keyVals.get("Title"), keyVals.get("Year"))
+                    for path, keyVals in sorted(left2.items()))
+        try:
+            with diffout.openText(oFile, compress) as textFile:
+                csv_writer = diffout.DiffWriter(textFile, ["library", "status", "server1_filePath", "server2_filePath",
+                                                           "matchedBy", "Title", "Year"], fmt)
+                csv_writer.writerows(rows)
+        except OSError as e:
+            logger.critical(f"Unexpected error writing {oFile}. Exception: {e}", exc_info=True)
+            sys.exit(1)
+
+    counts = {"moved": len(matches), "server1": len(left1), "server2": len(left2)}
+    logger.info(f"{oFile}: {counts['moved']} moved or renamed, {counts['server1']} only on server1, "
+                f"{counts['server2']} only on server2")
+    return counts
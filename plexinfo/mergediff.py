@@ -0,0 +1,229 @@
+# Sort-merge diff of two servers, streamed to csv without the database
+import sys
+import heapq
+import pickle
+import logging
+import tempfile
+from plexinfo import metrics
+from plexinfo import diffout
+
+logger = logging.getLogger("mergediff")
+
+# Records sorted in memory at a time, bigger inputs are sorted in runs
+# spilled to temporary files and merged
+SORT_CHUNK = 50000
+
+# Records pickled together in a spilled run
+_SPILL_BLOCK = 1000
+
+# Diff values, same as the database diff results
+_VALUE_MISSING = '--Value missing--'
+_NULL_VALUE = '--NULL VALUE--'
+
+
+def _itemKey(rec):
+    return rec[0]
+
+
+def _spill(recs):
+    """Write a sorted run to a temporary file (internal use only)"""
+    f = tempfile.TemporaryFile()
+    for start in range(0, len(recs), _SPILL_BLOCK):
+        pickle.dump(recs[start:start + _SPILL_BLOCK], f, protocol=pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _readRun(f):
+    """Records of a spilled run, the file is closed at the end (internal use only)"""
+    with f:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+
+def sortedRecords(recs, chunkSize=None):
+    """Sort records by their item key, with bounded memory
+
+    Up to chunkSize records are sorted in memory, more are sorted in runs
+    of chunkSize written to temporary files, and the runs are merged when
+    the records are read. Records with the same key keep their order.
+
+    Args:
+        recs (iterable): (item key, keyVals) records, i.e. (uFilePath, keyVals)
+        chunkSize (int, optional): records sorted in memory. Defaults to SORT_CHUNK.
+
+    Returns:
+        iterator: the records, sorted by item key
+    """
+    if chunkSize == None:
+        chunkSize = SORT_CHUNK
+    runs = []
+    chunk = []
+    for rec in recs:
+        chunk.append(rec)
+        if len(chunk) >= chunkSize:
+            chunk.sort(key=_itemKey)
+            runs.append(_spill(chunk))
+            chunk = []
+    chunk.sort(key=_itemKey)
+    if not runs:
+        return iter(chunk)
+    logger.debug(f"merging {len(runs) + 1} sorted runs")
+    # the last run stays in memory
+    return heapq.merge(*[_readRun(f) for f in runs], iter(chunk), key=_itemKey)
+
+
+def _lastOfKey(recs):
+    """One record per item key, the last one, as the database keeps (internal use only)"""
+    prev = None
+    for rec in recs:
+        if prev != None and prev[0] != rec[0]:
+            yield prev
+        prev = rec
+    if prev != None:
+        yield prev
+
+
+def _diffVal(keyVals, sKey):
+    if keyVals == None or sKey not in keyVals:
+        return _VALUE_MISSING
+    value = keyVals[sKey]
+    return _NULL_VALUE if value == None else value
+
+
+def mergeDiff(recs1, recs2, csvWriter, library, diffOnly=False, unmatched=None):
+    """Merge join the records of two servers and write their diff rows
+
+    One pass over both record streams, only the current record of each
+    server is held.
+
+    Args:
+        recs1 (iterable): (item key, keyVals) of server1, sorted by item key
+        recs2 (iterable): (item key, keyVals) of server2, sorted by item key
+        csvWriter (csv.writer): writer of the diff rows, or a diffout.DiffWriter
+        library (string): library name of the rows
+        diffOnly (bool, optional): only the keys that are different, as
+            the wide schema. Defaults to False, every key of every item.
+        unmatched (tuple, optional): two dicts, filled with item key to
+            keyVals of the items only on server1 and only on server2.
+            Defaults to None.
+
+    Returns:
+        dict: {"items1": count, "items2": count, "rows": count, "different": count}
+    """
+    counts = {"items1": 0, "items2": 0, "rows": 0, "different": 0}
+    it1 = _lastOfKey(recs1)
+    it2 = _lastOfKey(recs2)
+    rec1 = next(it1, None)
+    rec2 = next(it2, None)
+    while rec1 != None or rec2 != None:
+        if rec2 == None or (rec1 != None and rec1[0] < rec2[0]):
+            item, keyVals1, keyVals2 = rec1[0], rec1[1], None
+            rec1 = next(it1, None)
+            counts["items1"] += 1
+            if unmatched != None:
+                unmatched[0][item] = keyVals1
+        elif rec1 == None or rec2[0] < rec1[0]:
+            item, keyVals1, keyVals2 = rec2[0], None, rec2[1]
+            rec2 = next(it2, None)
+            counts["items2"] += 1
+            if unmatched != None:
+                unmatched[1][item] = keyVals2
+        else:
+            item, keyVals1, keyVals2 = rec1[0], rec1[1], rec2[1]
+            rec1 = next(it1, None)
+            rec2 = next(it2, None)
+            counts["items1"] += 1
+            counts["items2"] += 1
+            if diffOnly and keyVals1 == keyVals2:
+                continue
+
+        sKeys = set(keyVals1 or ()) | set(keyVals2 or ())
+        for sKey in sorted(sKeys):
+            val1 = _diffVal(keyVals1, sKey)
+            val2 = _diffVal(keyVals2, sKey)
+            if val1 == val2:
+                if diffOnly:
+                    continue
+                isDiff = ''
+            else:
+                isDiff = '***Different***'
+                counts["different"] += 1
+            csvWriter.writerow((library, item, sKey, val1, val2, isDiff))
+            counts["rows"] += 1
+    return counts
+
+
+def exportDiff(recs1, recs2, oFile, library, itemCol="filePath", diffOnly=False, unmatched=None, fmt="csv",
+               compress=None):
+    """Write the diff of two servers' records to a diff file
+
+    The same layout as LocalDB.exportLibDiff() and exportColDiff().
+
+    Args:
+        recs1 (iterable): (item key, keyVals) of server1, sorted by item key
+        recs2 (iterable): (item key, keyVals) of server2, sorted by item key
+        oFile (string): File name for the csv file
+        library (string): library name
+        itemCol (string, optional): item key column name. Defaults to filePath.
+        diffOnly (bool, optional): only the keys that are different. Defaults to False.
+        unmatched (tuple, optional): filled as by mergeDiff(). Defaults to None.
+        fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+        compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
+
+    Returns:
+        dict: counts of mergeDiff()
+    """
+    diffout.checkOptions(fmt, compress)
+    with metrics.phase("merge.diff"):
+        try:
+            with diffout.openText(oFile, compress) as textFile:
+                csv_writer = diffout.DiffWriter(textFile, ["library", itemCol, "sKey", "server1_VAL", "server2_VAL",
+                                                           "isDiff"], fmt)
+                counts = mergeDiff(recs1, recs2, csv_writer, library, diffOnly, unmatched)
+        except OSError as e:
+            logger.critical(f"Unexpected error writing {oFile}. Exception: {e}", exc_info=True)
+            sys.exit(1)
+    logger.info(f"{oFile}: {counts['rows']} rows, {counts['different']} different")
+    return counts
+
+
+def exportMemberDiff(recs1, recs2, oFile, library, fmt="csv", compress=None):
+    """Write the collection members only on one of the servers to a diff file
+
+    The same layout as LocalDB.exportMemberDiff().
+
+    Args:
+        recs1 (iterable): (colName, keyVals, members) of server1, sorted by colName
+        recs2 (iterable): (colName, keyVals, members) of server2, sorted by colName
+        oFile (string): File name for the csv file
+        library (string): library name
+        fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+        compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
+
+    Returns:
+        int: rows written
+    """
+    members1 = {rec[0]: set(rec[2]) for rec in _lastOfKey(recs1)}
+    members2 = {rec[0]: set(rec[2]) for rec in _lastOfKey(recs2)}
+    diffout.checkOptions(fmt, compress)
+    with metrics.phase("merge.members"):
+        try:
+            with diffout.openText(oFile, compress) as textFile:
+                writer = diffout.DiffWriter(textFile, ["library", "colname", "member", "status"], fmt)
+                for colName in sorted(members1.keys() | members2.keys()):
+                    set1 = members1.get(colName, set())
+                    set2 = members2.get(colName, set())
+                    if set1 == set2:
+                        continue
+                    writer.writerows(sorted([(library, colName, m, "only server1") for m in set1 - set2] +
+                                            [(library, colName, m, "only server2") for m in set2 - set1]))
+        except OSError as e:
+            logger.critical(f"Unexpected error writing {oFile}. Exception: {e}", exc_info=True)
+            sys.exit(1)
+    logger.info(f"{oFile}: {writer.rowCount} members only on one server")
+    return writer.rowCount
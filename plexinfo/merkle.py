@@ -0,0 +1,164 @@
+# Merkle tree summary of a library, by universal folder path
+import logging
+import hashlib
+
+logger = logging.getLogger("merkle")
+
+# Value of a key for an item the server does not have
+MISSING = object()
+
+# Keys hashed by default. Location and Media hold the server's own file
+# path and media ids, so they are different on every server.
+QUICK_FIELDS = ("guid", "Title", "TitleSort", "OrigTitle", "Year", "Genres")
+
+
+def recordHash(keyVals, fields=QUICK_FIELDS):
+    """Hash of the normalized values of a library item
+
+    Args:
+        keyVals (dict): sKey to value of the item
+        fields (tuple, optional): the keys hashed. Defaults to QUICK_FIELDS.
+
+    Returns:
+        bytes: sha1 digest
+    """
+    h = hashlib.sha1()
+    for sKey in fields:
+        # separators keep ("ab", "c") and ("a", "bc") apart
+        h.update(f"{sKey}\x1e{keyVals.get(sKey)!r}\x1f".encode())
+    return h.digest()
+
+
+class MerkleNode():
+    """A folder (children) or a library item (keyVals) of a MerkleTree"""
+    __slots__ = ("children", "hash", "count", "keyVals")
+
+    def __init__(self):
+        self.children = {}
+        self.hash = None
+        self.count = 0
+        self.keyVals = None
+
+
+class MerkleTree():
+    """Library items hashed and rolled up along their universal folder path
+
+    Usage:
+        tree = MerkleTree()
+        tree.add("/Movies/A/A.mkv", {"Title": "A"})
+        tree.seal()
+    """
+
+    def __init__(self, fields=QUICK_FIELDS):
+        self.fields = tuple(fields)
+        self.root = MerkleNode()
+
+    def add(self, uFilePath, keyVals):
+        """Add a library item
+
+        Args:
+            uFilePath (string): universal file path of the item
+            keyVals (dict): sKey to value of the item
+        """
+        node = self.root
+        for part in uFilePath.strip("/").split("/"):
+            node = node.children.setdefault(part, MerkleNode())
+        if node.keyVals != None:
+            logger.warning(f"Duplicate file path, keeping the last one: {uFilePath}")
+        node.keyVals = keyVals
+        node.hash = recordHash(keyVals, self.fields)
+
+    def seal(self):
+        """Compute the folder hashes, call after the last add()"""
+        self._seal(self.root)
+
+    def _seal(self, node):
+        node.count = 1 if node.keyVals != None else 0
+        if not node.children:
+            return
+        h = hashlib.sha1(node.hash or b"")
+        for name in sorted(node.children):
+            child = node.children[name]
+            self._seal(child)
+            node.count += child.count
+            h.update(f"{name}\x1f".encode())
+            h.update(child.hash or b"")
+        node.hash = h.digest()
+
+
+def _leaves(node, path):
+    """All the library items under a node, as (path, keyVals)"""
+    if node.keyVals != None:
+        yield path, node.keyVals
+    for name in sorted(node.children):
+        yield from _leaves(node.children[name], f"{path}/{name}")
+
+
+def diffTrees(tree1, tree2):
+    """Compare two sealed trees top down
+
+    Subtrees with the same hash are skipped without looking inside, only
+    the divergent folders are expanded.
+
+    Args:
+        tree1 (MerkleTree): server1 tree
+        tree2 (MerkleTree): server2 tree
+
+    Returns:
+        tuple: (folders, itemDiffs)
+            folders: (folderPath, depth, changed, only1, only2) for each
+                divergent folder, in path order
+            itemDiffs: (filePath, sKey, server1 value, server2 value) for
+                each key that differs, MISSING when the server does not
+                have the item
+    """
+    folders = []
+    itemDiffs = []
+    _diffNodes(tree1.root, tree2.root, "", 0, tree1.fields, folders, itemDiffs)
+    return folders, itemDiffs
+
+
+def _diffNodes(node1, node2, path, depth, fields, folders, itemDiffs):
+    """Returns [changed, only1, only2] item counts at and below the nodes"""
+    counts = [0, 0, 0]
+    if node1.hash == node2.hash:
+        return counts
+
+    keyVals1 = node1.keyVals
+    keyVals2 = node2.keyVals
+    if keyVals1 != None and keyVals2 != None:
+        diffs = [(path, sKey, keyVals1.get(sKey), keyVals2.get(sKey)) for sKey in fields
+                 if keyVals1.get(sKey) != keyVals2.get(sKey)]
+        if diffs:
+            itemDiffs.extend(diffs)
+            counts[0] += 1
+    elif keyVals1 != None:
+        itemDiffs.extend((path, sKey, keyVals1.get(sKey), MISSING) for sKey in fields)
+        counts[1] += 1
+    elif keyVals2 != None:
+        itemDiffs.extend((path, sKey, MISSING, keyVals2.get(sKey)) for sKey in fields)
+        counts[2] += 1
+
+    if not node1.children and not node2.children:
+        return counts
+
+    folderAt = len(folders)
+    folders.append(None)
+    for name in sorted(node1.children.keys() | node2.children.keys()):
+        child1 = node1.children.get(name)
+        child2 = node2.children.get(name)
+        childPath = f"{path}/{name}"
+        if child2 == None:
+            for leafPath, keyVals in _leaves(child1, childPath):
+                itemDiffs.extend((leafPath, sKey, keyVals.get(sKey), MISSING) for sKey in fields)
+            counts[1] += child1.count
+        elif child1 == None:
+            for leafPath, keyVals in _leaves(child2, childPath):
+                itemDiffs.extend((leafPath, sKey, MISSING, keyVals.get(sKey)) for sKey in fields)
+            counts[2] += child2.count
+        else:
+            for i, n in enumerate(_diffNodes(child1, child2, childPath, depth + 1, fields, folders, itemDiffs)):
+                counts[i] += n
+
+    folders[folderAt] = (path or "/", depth, counts[0], counts[1], counts[2])
+    return counts
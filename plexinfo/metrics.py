@@ -0,0 +1,238 @@
+# Run metrics: phase timings, counters and http requests, off by default
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger("metrics")
+
+# The metrics of this run, None when they are not enabled
+_metrics = None
+
+
+class _NoPhase():
+    """phase() when the metrics are not enabled, does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        return False
+
+
+_NOPHASE = _NoPhase()
+
+
+class _Phase():
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        self.metrics.addPhase(self.name, time.perf_counter() - self.wall, time.thread_time() - self.cpu)
+        return False
+
+
+class Metrics():
+    """Phase timings and counters of a run
+
+    Phases are timed by wall clock, and by the cpu time of the thread
+    that ran them. A phase run more than once, or by several threads,
+    adds up.
+    """
+
+    def __init__(self):
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+        self._cpuStart = time.process_time()
+        self.phases = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._send = None
+
+    def addPhase(self, name, wall, cpu):
+        with self._lock:
+            phase = self.phases.setdefault(name, {"calls": 0, "wallSeconds": 0.0, "cpuSeconds": 0.0})
+            phase["calls"] += 1
+            phase["wallSeconds"] += wall
+            phase["cpuSeconds"] += cpu
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """The metrics as a dict, for json"""
+        with self._lock:
+            return {"started": self.started.isoformat(timespec="seconds"),
+                    "wallSeconds": round(time.perf_counter() - self._start, 4),
+                    "cpuSeconds": round(time.process_time() - self._cpuStart, 4),
+                    "phases": {name: {"calls": p["calls"], "wallSeconds": round(p["wallSeconds"], 4),
+                                      "cpuSeconds": round(p["cpuSeconds"], 4)}
+                               for name, p in self.phases.items()},
+                    "counters": dict(sorted(self.counters.items()))}
+
+    def hookRequests(self):
+        """Count the http requests and bytes received, by kind"""
+        self._send = requests.Session.send
+        metrics = self
+
+        def send(session, request, **kwargs):
+            response = metrics._send(session, request, **kwargs)
+            kind = requestKind(request.url)
+            metrics.count(f"http.requests.{kind}")
+            metrics.count(f"http.bytes.{kind}", len(response.content or b""))
+            return response
+
+        requests.Session.send = send
+
+    def unhookRequests(self):
+        if self._send != None:
+            requests.Session.send = self._send
+            self._send = None
+
+
+def requestKind(url):
+    """Kind of a plex request, for the http counters
+
+    Returns:
+        string: plextv, page (library section listing), metadata (item
+        details, i.e. plexapi reloads), children, or other
+    """
+    parts = urlsplit(url)
+    path = parts.path
+    if parts.hostname != None and parts.hostname.endswith("plex.tv"):
+        return "plextv"
+    if path.startswith("/library/sections/") and path.endswith("/all"):
+        return "page"
+    if path.startswith("/library/metadata/"):
+        return "children" if path.endswith("/children") else "metadata"
+    return "other"
+
+
+def enable():
+    """Start collecting the metrics of this run"""
+    global _metrics
+    if _metrics == None:
+        _metrics = Metrics()
+        _metrics.hookRequests()
+        logger.info("Metrics enabled")
+
+
+def disable():
+    """Stop collecting metrics"""
+    global _metrics
+    if _metrics != None:
+        _metrics.unhookRequests()
+        _metrics = None
+
+
+def enabled():
+    return _metrics != None
+
+
+def phase(name):
+    """Time a phase of the run
+
+    Usage:
+        with metrics.phase("db.diff"):
+            ...
+
+    Args:
+        name (string): phase name
+
+    Returns:
+        context manager, that does nothing when metrics are not enabled
+    """
+    if _metrics == None:
+        return _NOPHASE
+    return _Phase(_metrics, name)
+
+
+def count(name, n=1):
+    """Add n to a counter, nothing when metrics are not enabled
+
+    Args:
+        name (string): counter name
+        n (int, optional): Defaults to 1.
+    """
+    if _metrics != None:
+        _metrics.count(name, n)
+
+
+def summary():
+    """Metrics of the run as a dict, None when not enabled"""
+    if _metrics == None:
+        return None
+    return _metrics.summary()
+
+
+def write(outFile):
+    """Write the metrics of the run as json
+
+    Args:
+        outFile (string): json file
+    """
+    if _metrics == None:
+        return
+    with open(outFile, "w") as f:
+        json.dump(_metrics.summary(), f, indent=2)
+    logger.info(f"Metrics written to {outFile}")
+
+
+def profileCall(func, *args, top=25, **kwargs):
+    """Run func with cProfile, and print its top hot spots
+
+    Threads started by func are profiled too, their stats are added to
+    the stats of the calling thread.
+
+    Args:
+        func (function): function to profile
+        top (int, optional): functions printed. Defaults to 25.
+
+    Returns:
+        the return of func
+    """
+    threadProfiles = []
+    lock = threading.Lock()
+
+    def startThreadProfile(frame, event, arg):
+        # first event of a new thread, replaced by its own profiler
+        sys.setprofile(None)
+        prof = cProfile.Profile()
+        with lock:
+            threadProfiles.append(prof)
+        prof.enable()
+
+    prof = cProfile.Profile()
+    threading.setprofile(startThreadProfile)
+    prof.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        prof.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(prof, stream=sys.stdout)
+        with lock:
+            for threadProf in threadProfiles:
+                try:
+                    stats.add(threadProf)
+                except TypeError:
+                    # thread profile without any calls
+                    pass
+        print(f"\nTop {top} functions by own time:")
+        stats.sort_stats("tottime").print_stats(top)
+        print(f"Top {top} functions by cumulative time:")
+        stats.sort_stats("cumulative").print_stats(top)
@@ -0,0 +1,394 @@
+# Normalizes plexapi library items into records, once per item
+import re
+import sys
+import logging
+from collections import namedtuple
+from functools import lru_cache
+
+logger = logging.getLogger("normalize")
+
+# Library keys of a movie, in the order they are stored
+MOVIE_KEYS = ("guid", "Title", "TitleSort", "OrigTitle",
+              "Year", "Location", "Genres", "Media")
+
+# Library keys of a show episode and of a music track
+EPISODE_KEYS = ("guid", "Show", "Season", "Episode", "Title", "Year", "Location", "Media")
+TRACK_KEYS = ("guid", "Artist", "Album", "Track", "Title", "Duration", "Location", "Media")
+
+# Raw plex locations remembered by uFilePath()
+PATH_CACHE_SIZE = 16384
+
+# Path mapping applied by uFilePath(), see setPathMap()
+_pathMap = None
+
+
+class MovieRec(namedtuple("MovieRec", ("uFilePath", "location", "ratingKey", "updatedAt", "addedAt", "values",
+                                         "fields"))):
+    """Normalized movie record, built once per movie by normalizeMovie()
+
+    Episodes and tracks are the same record, see itemFromXml().
+
+    uFilePath : universal file path, the key the servers are compared on
+    location  : first plex location, as plex reported it
+    ratingKey, updatedAt, addedAt : plex item details for the snapshot
+    values    : the values of fields, in that order
+    fields    : the library keys of the record, MOVIE_KEYS or a projection
+                of them, see parseFields()
+    """
+    __slots__ = ()
+
+    @property
+    def keyVals(self):
+        """dict of fields to values"""
+        return dict(zip(self.fields, self.values))
+
+
+def parseFields(text):
+    """Library keys of a [compare] fields setting
+
+    Args:
+        text (string): comma separated keys of MOVIE_KEYS, any case.
+            Empty or None for all the keys.
+
+    Returns:
+        tuple: the keys, in MOVIE_KEYS order
+    """
+    if text == None or not text.strip():
+        return MOVIE_KEYS
+    byName = {k.lower(): k for k in MOVIE_KEYS}
+    selected = set()
+    for name in text.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name.lower() not in byName:
+            logger.critical(f"Unknown field {name}. Must be some of {', '.join(MOVIE_KEYS)}")
+            sys.exit(1)
+        selected.add(byName[name.lower()])
+    return tuple(k for k in MOVIE_KEYS if k in selected)
+
+
+class PathMap():
+    """Path mapping rules of the [pathmap] config section
+
+    Each rule maps a plex location to a universal file path:
+        prefix:FROM => TO    location starting with the FROM folder
+        regex:PATTERN => TO  location matching PATTERN (from the start),
+                             TO may use its groups, i.e. \\1. The
+                             pattern is matched with / separators.
+
+    The matched part is replaced by TO and the rest of the location is
+    kept. Locations are matched with / as the separator. The longest
+    prefix rule wins, then the first regex rule that matches.
+
+    The prefix rules are compiled into a trie, and the regex rules into a
+    single pattern, so a location is mapped in one pass over its
+    characters however many rules there are.
+    """
+    _END = ""
+
+    def __init__(self, rules=None):
+        """
+        Args:
+            rules (dict, optional): rule name to rule, i.e. appconfig.sec_pathmap
+        """
+        self.rules = dict(rules or {})
+        self._trie = {}
+        self._regexes = []
+        for name, rule in self.rules.items():
+            kind, sep, mapping = rule.partition(":")
+            pattern, sep2, target = mapping.rpartition("=>")
+            kind = kind.strip().lower()
+            pattern = pattern.strip()
+            target = target.strip()
+            if not sep or not sep2 or not pattern or kind not in ("prefix", "regex"):
+                logger.critical(f"Invalid [pathmap] rule {name} = {rule}, expected prefix:FROM => TO or regex:PATTERN => TO")
+                sys.exit(1)
+            if kind == "prefix":
+                node = self._trie
+                for ch in pattern.replace("\\", "/").rstrip("/"):
+                    node = node.setdefault(ch, {})
+                node[self._END] = target
+            else:
+                try:
+                    self._regexes.append((re.compile(pattern), target))
+                except re.error as err:
+                    logger.critical(f"Invalid [pathmap] rule {name} = {rule}: {err}")
+                    sys.exit(1)
+
+        self._regex = None
+        if self._regexes:
+            try:
+                self._regex = re.compile("|".join(f"(?P<_rule{i}>{r.pattern})"
+                                                  for i, (r, t) in enumerate(self._regexes)))
+            except re.error:
+                # i.e. the same group name in two rules, the rules are tried one by one
+                logger.debug("[pathmap] regex rules not combined")
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def map(self, path):
+        """Map a location, with / separators
+
+        Args:
+            path (string): plex location, with / as the separator
+
+        Returns:
+            string: mapped path, None if no rule matches
+        """
+        # longest prefix ending on a folder boundary
+        node = self._trie
+        found = None
+        for i, ch in enumerate(path):
+            node = node.get(ch)
+            if node == None:
+                break
+            if self._END in node and (i + 1 == len(path) or path[i + 1] == "/"):
+                found = (i + 1, node[self._END])
+        if found != None:
+            return found[1] + "/" + path[found[0]:]
+
+        if self._regex != None:
+            m = self._regex.match(path)
+            if m != None:
+                rule, target = self._regexes[int(m.lastgroup[5:])]
+                m = rule.match(path)
+                return m.expand(target) + "/" + path[m.end():]
+        else:
+            for rule, target in self._regexes:
+                m = rule.match(path)
+                if m != None:
+                    return m.expand(target) + "/" + path[m.end():]
+        return None
+
+
+def setPathMap(pathMap):
+    """Set the path mapping used by uFilePath()
+
+    Args:
+        pathMap (PathMap): the rules, None for no mapping
+    """
+    global _pathMap
+    _pathMap = pathMap if pathMap else None
+    uFilePath.cache_clear()
+
+
+def pathMapRules():
+    """The rules of the setPathMap() path mapping, to set it again in another process
+
+    Returns:
+        dict: rule name to rule, empty for no mapping
+    """
+    return dict(_pathMap.rules) if _pathMap != None else {}
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def uFilePath(plexLoc):
+    """Provides universal path and filename (no drive)
+
+    Both / and \\ are separators, whatever OS this runs on.
+    A location matched by a setPathMap() rule is mapped by the rule.
+    Otherwise windows paths lose the drive (or \\\\server\\share), other
+    paths lose the root and the first folder.
+
+    Args:
+        plexLoc (string): file path and name (plex location)
+
+    Returns:
+        string: full file path and name
+        example: /dir/dirA/dirB/my file name.mkv
+    """
+    path = plexLoc.replace("\\", "/")
+    mapped = _pathMap.map(path) if _pathMap != None else None
+    if mapped != None:
+        parts = [p for p in mapped.split("/") if p and p != "."]
+    elif path.startswith("//"):
+        # UNC path, //server/share is the drive
+        parts = [p for p in path.split("/") if p and p != "."][2:]
+    elif len(path) > 1 and path[1] == ":" and path[0].isalpha():
+        parts = [p for p in path[2:].split("/") if p and p != "."]
+    else:
+        parts = [p for p in path.split("/") if p and p != "."]
+        # the root counts as the first part of an absolute path
+        parts = parts[1:] if path.startswith("/") else parts[2:]
+    return "".join("/" + p for p in parts)
+
+
+def _genreStr(genreList):
+    return sorted(g.tag for g in genreList)
+
+
+def _epoch(dt):
+    """datetime to epoch seconds, None stays None"""
+    if dt == None:
+        return None
+    return int(dt.timestamp())
+
+
+def _xmlInt(value):
+    """int xml attribute, None stays None (plexapi utils.cast)"""
+    if value == None:
+        return None
+    return int(value)
+
+
+def _xmlEpoch(value):
+    """epoch xml attribute, as plexapi utils.toDatetime then _epoch()"""
+    if not value:
+        return None
+    # plexapi moves the times before the epoch to 86400
+    return int(value) if int(value) > 0 else 86400
+
+
+def _reprClean(value):
+    # plexapi PlexObject._clean()
+    if value:
+        value = str(value).replace('/library/metadata/', '')
+        value = value.replace('/children', '')
+        return value.replace(' ', '-')[:20]
+
+
+def _mediaRepr(elem):
+    """repr() of the plexapi Media object of a Media element"""
+    uid = _reprClean(_xmlInt(elem.attrib.get("id")))
+    name = _reprClean(elem.attrib.get("title"))
+    return '<%s>' % ':'.join([p for p in ["Media", uid, name] if p])
+
+
+def _xmlGenres(elem, genres):
+    if genres == None:
+        genres = [g.attrib.get("tag") for g in elem.findall("Genre")]
+    return str(sorted(genres))
+
+
+# How each library key is read from a Video element
+#   (elem, attrib, medias, locations, genres) -> value
+_XML_FIELDS = {
+    "guid": lambda elem, attrib, medias, locations, genres: str(attrib.get("guid")),
+    "Title": lambda elem, attrib, medias, locations, genres: attrib.get("title"),
+    "TitleSort": lambda elem, attrib, medias, locations, genres: attrib.get("titleSort", attrib.get("title")),
+    "OrigTitle": lambda elem, attrib, medias, locations, genres: attrib.get("originalTitle"),
+    "Year": lambda elem, attrib, medias, locations, genres: _xmlInt(attrib.get("year")),
+    "Location": lambda elem, attrib, medias, locations, genres: str(locations),
+    "Genres": lambda elem, attrib, medias, locations, genres: _xmlGenres(elem, genres),
+    "Media": lambda elem, attrib, medias, locations, genres: "[" + ", ".join(_mediaRepr(m) for m in medias) + "]"}
+
+# How each library key is read from a plexapi Movie
+#   (movie, locations) -> value
+_MOVIE_FIELDS = {
+    "guid": lambda m, locations: str(m.guid),
+    "Title": lambda m, locations: m.title,
+    "TitleSort": lambda m, locations: m.titleSort,
+    "OrigTitle": lambda m, locations: m.originalTitle,
+    "Year": lambda m, locations: m.year,
+    "Location": lambda m, locations: str(locations),
+    "Genres": lambda m, locations: str(_genreStr(m.genres)),
+    "Media": lambda m, locations: str(m.media)}
+
+
+# How each library key is read from an episode Video element
+_EPISODE_FIELDS = {
+    "guid": _XML_FIELDS["guid"],
+    "Show": lambda elem, attrib, medias, locations, genres: attrib.get("grandparentTitle"),
+    "Season": lambda elem, attrib, medias, locations, genres: _xmlInt(attrib.get("parentIndex")),
+    "Episode": lambda elem, attrib, medias, locations, genres: _xmlInt(attrib.get("index")),
+    "Title": _XML_FIELDS["Title"],
+    "Year": _XML_FIELDS["Year"],
+    "Location": _XML_FIELDS["Location"],
+    "Media": _XML_FIELDS["Media"]}
+
+# How each library key is read from a Track element
+_TRACK_FIELDS = {
+    "guid": _XML_FIELDS["guid"],
+    "Artist": lambda elem, attrib, medias, locations, genres: attrib.get("grandparentTitle"),
+    "Album": lambda elem, attrib, medias, locations, genres: attrib.get("parentTitle"),
+    "Track": lambda elem, attrib, medias, locations, genres: _xmlInt(attrib.get("index")),
+    "Title": _XML_FIELDS["Title"],
+    "Duration": lambda elem, attrib, medias, locations, genres: _xmlInt(attrib.get("duration")),
+    "Location": _XML_FIELDS["Location"],
+    "Media": _XML_FIELDS["Media"]}
+
+# Item type to its library keys and how they are read from xml
+ITEM_TYPES = {"movie": (MOVIE_KEYS, _XML_FIELDS),
+              "episode": (EPISODE_KEYS, _EPISODE_FIELDS),
+              "track": (TRACK_KEYS, _TRACK_FIELDS)}
+
+
+def _recFromXml(elem, readers, genres, fields):
+    """Record of an item element, with the readers of its keys (internal use only)"""
+    attrib = elem.attrib
+    medias = elem.findall("Media")
+    locations = [part.attrib.get("file") for media in medias for part in media.findall("Part")]
+    return MovieRec(uFilePath(locations[0]), locations[0], attrib.get("ratingKey"),
+                    _xmlEpoch(attrib.get("updatedAt")), _xmlEpoch(attrib.get("addedAt")),
+                    tuple(readers[k](elem, attrib, medias, locations, genres) for k in fields), fields)
+
+
+def xmlFilePath(elem):
+    """Universal file path of the first part of an item element, as its record
+
+    Args:
+        elem (xml.etree.ElementTree.Element): item element of a section listing
+
+    Returns:
+        string: the path, None for an item without a file
+    """
+    for media in elem.findall("Media"):
+        for part in media.findall("Part"):
+            return uFilePath(part.attrib.get("file"))
+    return None
+
+
+def movieFromXml(elem, genres=None, fields=MOVIE_KEYS):
+    """Normalized record of a movie from its plex xml element
+
+    The same record as normalizeMovie() of the plexapi Movie built from
+    the element, without building it, and without the requests plexapi
+    makes to reload a partial movie.
+
+    Args:
+        elem (xml.etree.ElementTree.Element): Video element of a section
+            listing or a /library/metadata response
+        genres (list, optional): genre tags of the movie. Defaults to the
+            Genre elements of elem.
+        fields (tuple, optional): library keys read, the others are not
+            read at all. Defaults to MOVIE_KEYS.
+
+    Returns:
+        MovieRec: the movie record
+    """
+    return _recFromXml(elem, _XML_FIELDS, genres, fields)
+
+
+def itemFromXml(elem, libtype, fields=None):
+    """Normalized record of a library item from its plex xml element
+
+    Args:
+        elem (xml.etree.ElementTree.Element): item element of a section listing
+        libtype (string): item type, a key of ITEM_TYPES
+        fields (tuple, optional): library keys read. Defaults to all the
+            keys of the item type.
+
+    Returns:
+        MovieRec: the item record, keyed by the universal file path of its first part
+    """
+    keys, readers = ITEM_TYPES[libtype]
+    return _recFromXml(elem, readers, None, keys if fields == None else fields)
+
+
+def normalizeMovie(m, fields=MOVIE_KEYS):
+    """Normalized record of a movie, each attribute is read once
+
+    Args:
+        m (plexapi.video.Movie): The movie
+        fields (tuple, optional): library keys read, the others are not
+            read at all. Defaults to MOVIE_KEYS.
+
+    Returns:
+        MovieRec: the movie record
+    """
+    locations = m.locations
+    return MovieRec(uFilePath(locations[0]), locations[0], str(m.ratingKey),
+                    _epoch(m.updatedAt), _epoch(m.addedAt),
+                    tuple(_MOVIE_FIELDS[k](m, locations) for k in fields), fields)
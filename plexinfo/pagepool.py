@@ -0,0 +1,121 @@
+# Parses and normalizes section listing pages in a pool of processes, off by default
+import re
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from plexinfo import normalize
+
+logger = logging.getLogger("pagepool")
+
+# The size attribute of the MediaContainer of a page, the items it has
+_PAGE_SIZE = re.compile(rb'<MediaContainer\b[^>]*?\ssize="(\d+)"')
+
+# The pool of this run, None when the pages are parsed by the fetch threads
+_pool = None
+_workers = 0
+
+
+def start(workers):
+    """Start the pool, the records of the pages are then built by worker processes
+
+    The processes get the path mapping of normalize.setPathMap() as it is
+    now, it has to be set before.
+
+    Args:
+        workers (int): processes of the pool, 0 for no pool
+    """
+    global _pool, _workers
+    stop()
+    if workers <= 0:
+        return
+    _pool = ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                                initargs=(normalize.pathMapRules(),))
+    # a forked process is started by the first task, here before the fetch threads are
+    _pool.submit(int).result()
+    _workers = workers
+    logger.info(f"Parsing the section pages with {workers} worker processes")
+
+
+def stop():
+    """Stop the pool, the pages are parsed by the fetch threads again"""
+    global _pool, _workers
+    if _pool != None:
+        _pool.shutdown()
+    _pool = None
+    _workers = 0
+
+
+def workers():
+    """Processes of the pool, 0 when there is no pool"""
+    return _workers
+
+
+def submit(data, libtype, fields, withMembers):
+    """Parse a page in the pool
+
+    Args:
+        data (bytes): the xml of the page, as plex sent it
+        libtype (string): item type, a key of normalize.ITEM_TYPES
+        fields (tuple): library keys of movie records, the other types
+            have all their keys
+        withMembers (bool): also read the Collection tags of the items
+
+    Returns:
+        concurrent.futures.Future: of the parsePage() result
+    """
+    return _pool.submit(parsePage, data, libtype, fields, withMembers)
+
+
+def pageSize(data):
+    """Items of a page, from the size attribute of its MediaContainer
+
+    The page is only parsed when it has no size attribute.
+
+    Args:
+        data (bytes): the xml of the page, None for an empty response
+
+    Returns:
+        int: the number of items
+    """
+    if data == None:
+        return 0
+    m = _PAGE_SIZE.search(data, 0, 4096)
+    if m != None:
+        return int(m.group(1))
+    return len(ElementTree.fromstring(data))
+
+
+def _initWorker(rules):
+    """Set the path mapping of the parent in a pool process"""
+    normalize.setPathMap(normalize.PathMap(rules))
+
+
+def parsePage(data, libtype, fields, withMembers):
+    """Records of the items of a page, runs in a pool process
+
+    The movie genres are not read, the listing does not have all of them.
+    Their value is the one of a movie without genres, the caller sets it
+    from the sectionGenres() of the section.
+
+    Args:
+        data (bytes): the xml of the page, None for an empty response
+        libtype (string): item type, a key of normalize.ITEM_TYPES
+        fields (tuple): library keys of movie records
+        withMembers (bool): also read the Collection tags of the items
+
+    Returns:
+        list: (normalize.MovieRec, collection tags) for each item, in the
+            page order. The tags are an empty tuple without withMembers.
+    """
+    if data == None:
+        return []
+    recs = []
+    for elem in ElementTree.fromstring(data):
+        if libtype == "movie":
+            rec = normalize.movieFromXml(elem, (), fields)
+        else:
+            rec = normalize.itemFromXml(elem, libtype)
+        tags = tuple(col.attrib.get("tag") for col in elem.findall("Collection")) if withMembers else ()
+        recs.append((rec, tags))
+    return recs
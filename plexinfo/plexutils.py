@@ -1,22 +1,199 @@
+import re
 import sys
 import logging
 import traceback
 import csv
+import time
+import queue
+import getpass
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import requests
+from requests.status_codes import _codes as codes
+from plexapi import TIMEOUT
+from plexapi.exceptions import BadRequest, NotFound, Unauthorized
+from plexapi.myplex import MyPlexAccount
+from plexapi.server import PlexServer
 from plexinfo import sqlitedb as mydb
+from plexinfo import merkle
+from plexinfo import normalize
+from plexinfo import metrics
+from plexinfo import mergediff
+from plexinfo import fuzzymatch
+from plexinfo import pagepool
 
 logger = logging.getLogger("PlexUtils")
 
+# Records put on the ingest queue at a time by an export worker
+INGEST_CHUNK = 500
 
-def connectPlexServer(plexAcct, svrName):
+# Ingest queue chunk kinds of library items, by item type
+ITEM_CHUNKS = {"movies": "movie", "episodes": "episode", "tracks": "track"}
+
+# Items requested per page when fetching a library section
+CONTAINER_SIZE = 500
+
+# Plex metadata type numbers used to filter a library section listing
+PLEX_TYPES = {"movie": 1, "episode": 4, "track": 10, "collection": 18}
+
+# Library section type to the type of its items that are compared,
+# sections of other types (photos) are not compared
+SECTION_ITEMS = {"movie": "movie", "show": "episode", "artist": "track"}
+
+# Sections fetched at the same time by exportSections()
+SECTION_WORKERS = 4
+
+# Retries of a plex request that failed with a transient error, the first
+# after RETRY_DELAY seconds, doubled for each retry up to RETRY_MAX_DELAY
+RETRIES = 5
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# http status of a plexapi BadRequest that is worth a retry
+_TRANSIENT_STATUS = re.compile(r"^\((429|5\d\d)\)")
+
+# Seconds to wait for the cached URI of a server before discovering it
+CACHED_TIMEOUT = 5
+
+
+def plexAccount(userName, userPass=None, cache=None):
+    """Sign in to plex.tv
+
+    With a cache, its token of the user is used without a password, and
+    the token of a sign in is cached.
+
+    Args:
+        userName (string): plex user id
+        userPass (string, optional): password, asked when needed and not given. Defaults to None.
+        cache (ConnectionCache, optional): token cache. Defaults to None.
+
+    Returns:
+        MyPlexAccount: the signed in account
+    """
+    token = cache.token() if cache != None else None
+    if token != None:
+        try:
+            with metrics.phase("auth"):
+                plexAcct = MyPlexAccount(token=token)
+            logger.info(f"username: {userName} authenticated with the cached token")
+            return plexAcct
+        except Exception as err:
+            logger.info(f"cached token of {userName} not accepted: {err}")
+            cache.forgetToken()
+
+    if userPass == None:
+        logger.debug(f"getpass from user {userName}")
+        userPass = getpass.getpass(prompt=f"Enter {userName}'s Plex Password: ")
+    msg = f"Authenticating {userName}"
+    print(msg)
+    logger.info(f"{msg}")
+    try:
+        with metrics.phase("auth"):
+            plexAcct = MyPlexAccount(userName, userPass)
+    except Exception as err:
+        logger.critical(f"Error:  {err}", exc_info=True)
+        sys.exit()
+
+    logger.info(f"username: {userName} authenticated.")
+    if cache != None:
+        cache.setToken(plexAcct.authenticationToken)
+        cache.save()
+    return plexAcct
+
+
+def resourceUris(resource):
+    """Connection URIs of a plex resource, in the order plexapi tries them
+
+    Local before remote, https before http, and only the remote ones of
+    a resource that is not owned.
+
+    Args:
+        resource (MyPlexResource): plex.tv resource of a server
+
+    Returns:
+        list: the URIs
+    """
+    connections = sorted(resource.connections, key=lambda c: c.local, reverse=True)
+    connections = [c for c in connections if resource.owned or not c.local]
+    return [c.uri for c in connections] + [c.httpuri for c in connections]
+
+
+def raceConnect(svrName, uris, token, timeout=None):
+    """Connect to all the URIs of a server at the same time, the first in order that answers wins
+
+    A URI wins when it answered and the URIs before it failed, so an
+    https URI is used instead of a faster http URI of the same server.
+
+    Args:
+        svrName (string): plex server name, for the messages
+        uris (list): server URIs, in the order they are preferred, see resourceUris()
+        token (string): server access token
+        timeout (int, optional): seconds to wait for each URI. Defaults to plexapi TIMEOUT.
+
+    Raises:
+        NotFound: no URI answered
+
+    Returns:
+        tuple: (PlexServer, uri)
+    """
+    if not uris:
+        raise NotFound(f"No connection to the server {svrName}")
+    pool = ThreadPoolExecutor(max_workers=len(uris))
+    futures = [pool.submit(PlexServer, uri, token, timeout=timeout) for uri in uris]
+    try:
+        for done in as_completed(futures):
+            for uri, future in zip(uris, futures):
+                if not future.done():
+                    # a URI before the ones that answered may still answer
+                    break
+                try:
+                    plexConnect = future.result()
+                except Exception as err:
+                    if future is done:
+                        logger.debug(f"{svrName}: {uri} failed: {err}")
+                    continue
+                logger.debug(f"{svrName}: {uri} answered")
+                return plexConnect, uri
+    finally:
+        # the slower URIs are not waited for
+        pool.shutdown(wait=False, cancel_futures=True)
+    raise NotFound(f"Unable to connect to the server {svrName}, tried {len(uris)} URIs")
+
+
+def connectPlexServer(signIn, svrName, cache=None):
     """Will connect to the server
-    plexAcct : MyPlexAccount object
-    svrName  : Plex server name
 
-    Returns : Plex server connection object"""
+    The cached URI of the server is tried first, without signing in. The
+    server's URIs from plex.tv are raced when there is none or it failed,
+    and the winner is cached.
+
+    Args:
+        signIn (function): returns the MyPlexAccount, only called for a discovery
+        svrName (string): Plex server name
+        cache (ConnectionCache, optional): connection cache. Defaults to None.
+
+    Returns:
+        PlexServer: Plex server connection object
+    """
     logger.debug(f"connecting to svrName: {svrName}")
     try:
-        plexConnect = plexAcct.resource(svrName).connect()
+        with metrics.phase("connect"):
+            cached = cache.server(svrName) if cache != None else None
+            if cached != None:
+                uri, token = cached
+                try:
+                    plexConnect = PlexServer(uri, token, timeout=CACHED_TIMEOUT)
+                    logger.debug(f"successfully connected to svrName: {svrName} at its cached {uri}")
+                    return plexConnect
+                except Exception as err:
+                    logger.info(f"{svrName}: cached {uri} failed, discovering the server: {err}")
+                    cache.forgetServer(svrName)
+            resource = signIn().resource(svrName)
+            plexConnect, uri = raceConnect(svrName, resourceUris(resource), resource.accessToken)
+            if cache != None:
+                cache.setServer(svrName, uri, resource.accessToken)
     except Exception as err:
         logger.critical(f"Error:  {err}", exc_info=True)
         sys.exit(1)
@@ -25,6 +202,34 @@ def connectPlexServer(plexAcct, svrName):
     return plexConnect
 
 
+def connectPlexServers(signIn, svrNames, cache=None):
+    """Will connect to all the servers at the same time
+
+    Args:
+        signIn (function): returns the MyPlexAccount, called once when a server
+            has to be discovered
+        svrNames (list): Plex server names
+        cache (ConnectionCache, optional): connection cache. Defaults to None.
+
+    Returns:
+        list: Plex server connection objects, same order as svrNames
+    """
+    lock = threading.Lock()
+    account = []
+
+    def signInOnce():
+        with lock:
+            if not account:
+                account.append(signIn())
+            return account[0]
+
+    with ThreadPoolExecutor(max_workers=max(len(svrNames), 1)) as pool:
+        plexServers = list(pool.map(lambda svrName: connectPlexServer(signInOnce, svrName, cache), svrNames))
+    if cache != None:
+        cache.save()
+    return plexServers
+
+
 def dump_movieLibAtt(movieLib):
     """Print attributes of the movie Library Type"""
     print(f"  Library Title: {movieLib.title}")
@@ -37,21 +242,290 @@ def dump_movieLibAtt(movieLib):
     print(f"  Scanner      : {movieLib.scanner}")
 
 
-def csvExportMovie(movieLib, outFile, maxItems=0):
+def setRetries(retries, delay=RETRY_DELAY):
+    """Set the retries of the plex requests that failed with a transient error
+
+    Args:
+        retries (int): retries of a request, 0 for none
+        delay (float, optional): seconds before the first retry, doubled for each retry. Defaults to RETRY_DELAY.
+    """
+    global RETRIES, RETRY_DELAY
+    RETRIES = max(int(retries), 0)
+    RETRY_DELAY = max(float(delay), 0.0)
+
+
+def isTransient(err):
+    """True for a plex request error that may not happen again
+
+    Connection errors, timeouts, and the http status 429 (too many
+    requests) and 5xx (server errors).
+    """
+    if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError)):
+        return True
+    return isinstance(err, BadRequest) and _TRANSIENT_STATUS.match(str(err)) != None
+
+
+def _queryBytes(plexServer, key, params=None):
+    """plexServer.query() without parsing the response (internal use only)
+
+    The same request and errors as query(), the response is the utf8
+    xml that query() parses, None when it is empty.
+    """
+    url = plexServer.url(key)
+    response = plexServer._session.get(url, headers=plexServer._headers(), timeout=TIMEOUT, params=params)
+    if response.status_code not in (200, 201):
+        codename = codes.get(response.status_code)[0]
+        errtext = response.text.replace('\n', ' ')
+        message = '(%s) %s; %s %s' % (response.status_code, codename, response.url, errtext)
+        if response.status_code == 401:
+            raise Unauthorized(message)
+        elif response.status_code == 404:
+            raise NotFound(message)
+        raise BadRequest(message)
+    data = response.text.encode('utf8')
+    return data if data.strip() else None
+
+
+def queryRetry(plexServer, key, params=None, raw=False):
+    """plexServer.query(), retried with an exponential backoff on transient errors
+
+    Args:
+        plexServer (plexapi.server.PlexServer): The server to query
+        key (string): request path
+        params (dict, optional): request parameters. Defaults to None.
+        raw (bool, optional): the response is not parsed. Defaults to False.
+
+    Returns:
+        xml.etree.ElementTree.Element: the response, as query(). The
+            response xml as bytes with raw, None when it is empty.
+    """
+    delay = RETRY_DELAY
+    attempt = 0
+    while True:
+        try:
+            if raw:
+                return _queryBytes(plexServer, key, params)
+            return plexServer.query(key, params=params)
+        except Exception as err:
+            if attempt >= RETRIES or not isTransient(err):
+                raise
+            attempt += 1
+            logger.warning(f"{key}: {err}. Retry {attempt} of {RETRIES} in {delay:.1f}s")
+            metrics.count("plex.retries", 1)
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+
+def iterSectionElems(section, libtype="movie", containerSize=CONTAINER_SIZE, maxItems=0, filters=None, start=0,
+                     onPage=None):
+    """Page through the xml elements of a library section listing
+
+    No plexapi objects are built, so nothing is reloaded. The listing has
+    the attributes and tags of the items (Media, Genre, Collection...).
+
+    Args:
+        section (plexapi.library.LibrarySection): The section to list
+        libtype (string, optional): item type, a key of PLEX_TYPES. Defaults to movie.
+        containerSize (int, optional): items per page. Defaults to CONTAINER_SIZE.
+        maxItems (int, optional): stop listing after this many items. Defaults to 0.
+        filters (dict, optional): listing filters, i.e. {"genre": 12}. Defaults to None.
+        start (int, optional): listing offset of the first item. Defaults to 0.
+        onPage (function, optional): called with the offset of the next
+            page, after all the items of a page were read. Defaults to None.
+
+    Yields:
+        xml.etree.ElementTree.Element: for each item
+    """
+    key = f"/library/sections/{section.key}/all?type={PLEX_TYPES[libtype]}"
+    for name, value in (filters or {}).items():
+        key += f"&{name}={value}"
+    while True:
+        pageSize = containerSize
+        if maxItems > 0:
+            pageSize = min(pageSize, maxItems - start)
+            if pageSize <= 0:
+                break
+
+        data = queryRetry(section._server, key, params={"X-Plex-Container-Start": start,
+                                                        "X-Plex-Container-Size": pageSize})
+        elems = list(data) if data != None else []
+        start += len(elems)
+        yield from elems
+        if onPage != None:
+            onPage(start)
+
+        if len(elems) < pageSize:
+            break
+
+    logger.debug(f"{section.title}: listed {start} {libtype} items")
+
+
+def iterSectionPages(section, libtype="movie", containerSize=CONTAINER_SIZE, maxItems=0, start=0):
+    """Page through a library section listing, without parsing the pages
+
+    The same requests as iterSectionElems(), the items of a page are
+    counted from its size attribute.
+
+    Args:
+        section (plexapi.library.LibrarySection): The section to list
+        libtype (string, optional): item type, a key of PLEX_TYPES. Defaults to movie.
+        containerSize (int, optional): items per page. Defaults to CONTAINER_SIZE.
+        maxItems (int, optional): stop listing after this many items. Defaults to 0.
+        start (int, optional): listing offset of the first item. Defaults to 0.
+
+    Yields:
+        tuple: (data, nextStart) for each page, data is the page xml as
+            bytes, None for an empty page, nextStart the offset of the
+            next page
+    """
+    key = f"/library/sections/{section.key}/all?type={PLEX_TYPES[libtype]}"
+    while True:
+        pageSize = containerSize
+        if maxItems > 0:
+            pageSize = min(pageSize, maxItems - start)
+            if pageSize <= 0:
+                break
+
+        data = queryRetry(section._server, key, params={"X-Plex-Container-Start": start,
+                                                        "X-Plex-Container-Size": pageSize}, raw=True)
+        itemCount = pagepool.pageSize(data)
+        start += itemCount
+        yield data, start
+
+        if itemCount < pageSize:
+            break
+
+    logger.debug(f"{section.title}: listed {start} {libtype} items")
+
+
+def _iterPoolRecs(section, libtype, maxItems, containerSize, members, fields, start, onPage, genres):
+    """Item records of a library section, parsed by the pagepool processes (internal use only)
+
+    The next pages are fetched while the pool parses the pages before
+    them, the records are yielded in the listing order whatever the
+    number of processes.
+    """
+    genresIdx = fields.index("Genres") if libtype == "movie" and "Genres" in fields else None
+    pending = deque()
+
+    def pageRecs(future, nextStart):
+        for rec, tags in future.result():
+            if genresIdx != None:
+                rec = rec._replace(values=rec.values[:genresIdx] + (str(sorted(genres.get(rec.ratingKey, []))),)
+                                   + rec.values[genresIdx + 1:])
+            if members != None:
+                for tag in tags:
+                    members.setdefault(tag, set()).add(rec.uFilePath)
+            yield rec
+        if onPage != None:
+            onPage(nextStart)
+
+    try:
+        for data, nextStart in iterSectionPages(section, libtype, containerSize, maxItems, start):
+            pending.append((pagepool.submit(data, libtype, fields, members != None), nextStart))
+            # a page for each process is parsed while the next one is fetched
+            if len(pending) > pagepool.workers():
+                yield from pageRecs(*pending.popleft())
+        while pending:
+            yield from pageRecs(*pending.popleft())
+    finally:
+        for future, nextStart in pending:
+            future.cancel()
+
+
+def sectionGenres(section, libtype="movie", containerSize=CONTAINER_SIZE):
+    """Genres of all the items of a library section
+
+    The listing of a section may not have all the genre tags of an item,
+    so the items of each genre are listed, with only the ratingKey read.
+    That is a request per genre and per page, not per item.
+
+    Args:
+        section (plexapi.library.LibrarySection): The section to list
+        libtype (string, optional): item type, a key of PLEX_TYPES. Defaults to movie.
+        containerSize (int, optional): items per page. Defaults to CONTAINER_SIZE.
+
+    Returns:
+        dict: ratingKey to list of genre tags
+    """
+    genres = {}
+    data = queryRetry(section._server, f"/library/sections/{section.key}/genre?type={PLEX_TYPES[libtype]}")
+    for genre in (data if data != None else []):
+        tag = genre.attrib.get("title")
+        for elem in iterSectionElems(section, libtype, containerSize, filters={"genre": genre.attrib["key"]}):
+            genres.setdefault(elem.attrib["ratingKey"], []).append(tag)
+    logger.debug(f"{section.title}: genres of {len(genres)} {libtype} items")
+    return genres
+
+
+def _addMembers(members, elem):
+    """Add a movie element to the member paths of its collections"""
+    cols = elem.findall("Collection")
+    if not cols:
+        return
+    path = normalize.xmlFilePath(elem)
+    if path == None:
+        return
+    for col in cols:
+        members.setdefault(col.attrib.get("tag"), set()).add(path)
+
+
+def collectionMembers(section, containerSize=CONTAINER_SIZE):
+    """Member paths of the collections of a movie library
+
+    One pass over the movie listing, by the Collection tags of the
+    movies, instead of a request for the children of each collection.
+
+    Args:
+        section (plexapi.library.MovieSection): The movie section
+        containerSize (int, optional): items per page. Defaults to CONTAINER_SIZE.
+
+    Returns:
+        dict: collection title to the set of the universal file paths of its movies
+    """
+    members = {}
+    for elem in iterSectionElems(section, "movie", containerSize):
+        _addMembers(members, elem)
+    return members
+
+
+def iterMetadataItems(plexServer, ratingKeys, containerSize=CONTAINER_SIZE):
+    """Fetch library items by ratingKey, containerSize keys per request
+
+    Args:
+        plexServer (plexapi.server.PlexServer): The server to fetch from
+        ratingKeys (list): ratingKeys of the items
+        containerSize (int, optional): items per request. Defaults to CONTAINER_SIZE.
+
+    Yields:
+        xml.etree.ElementTree.Element: for each item, with all its tags
+    """
+    for start in range(0, len(ratingKeys), containerSize):
+        keys = ratingKeys[start:start + containerSize]
+        data = queryRetry(plexServer, f"/library/metadata/{','.join(keys)}")
+        if data != None:
+            yield from data
+
+
+def csvExportMovie(movieLib, outFile, maxItems=0, containerSize=CONTAINER_SIZE, fields=normalize.MOVIE_KEYS):
     """Export movie library items to csv file
 
     Args:
         movieLib (plexapi.library.MovieSection): The movie section to export
         outFile ([string]): output file for the data
         maxItems (int, optional): max records to write. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        fields (tuple, optional): library keys exported. Defaults to normalize.MOVIE_KEYS.
     """
-    # Columns layout.
-    colHdr = ['LibName', 'guid', 'Title', 'TitleSort',
-              'OrigTitle', 'Year', 'Location', 'uFilePath', 'Genres', 'Media']
+    # Columns layout, LibName and uFilePath are always there
+    colHdr = [c for c in ['LibName', 'guid', 'Title', 'TitleSort',
+                          'OrigTitle', 'Year', 'Location', 'uFilePath', 'Genres', 'Media']
+              if c in ('LibName', 'uFilePath') or c in fields]
 
     # Get all media from the movie library
     logger.info(f"Getting all movies from the {movieLib.title}")
-    mList = movieLib.all()
+    mList = iterMovieRecs(movieLib, maxItems, containerSize, fields=fields)
     itemCount = 1
     if maxItems > 0:
         logging.warning(f"Max items that will be returned: {maxItems}")
@@ -60,19 +534,11 @@ def csvExportMovie(movieLib, outFile, maxItems=0):
     with outcsv:
         csvWrite = csv.DictWriter(outcsv, fieldnames=colHdr)
         csvWrite.writeheader()
-        for m in mList:
+        for rec in mList:
             itemCount += 1
-            mRow = {}
+            mRow = rec.keyVals
             mRow['LibName'] = movieLib.title
-            mRow['guid'] = m.guid
-            mRow['Title'] = m.title
-            mRow['TitleSort'] = m.titleSort
-            mRow['OrigTitle'] = m.originalTitle
-            mRow['Year'] = m.year
-            mRow['Location'] = m.locations
-            mRow['uFilePath'] = _uFilePath(m.locations[0])
-            mRow['Genres'] = _genreStr(m.genres)
-            mRow['Media'] = m.media
+            mRow['uFilePath'] = rec.uFilePath
             csvWrite.writerow(mRow)
 
             if itemCount == maxItems:
@@ -82,71 +548,101 @@ def csvExportMovie(movieLib, outFile, maxItems=0):
     print(f"Wrote {itemCount} items from {movieLib.title}")
 
 
-def _uFilePath(plexLoc):
-    """Provides universal path and filename (no drive)
+def iterMovieRecs(movieLib, maxItems=0, containerSize=CONTAINER_SIZE, members=None, fields=normalize.MOVIE_KEYS,
+                  start=0, onPage=None):
+    """Movie records of a movie library, fetched a page at a time
+
+    The records are read from the listing xml, with the genres of
+    sectionGenres(), so there is no request per movie. The genres are
+    only listed when they are one of the fields.
+
+    After pagepool.start() the pages are parsed and normalized by the
+    pool processes, with the same records.
 
     Args:
-        plexLoc (string): file path and name (plex location)
+        movieLib (plexapi.library.MovieSection): Movie lib section to export
+        maxItems (int, optional): max records to return. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        members (dict, optional): filled with the collection members, as
+            collectionMembers(). Defaults to None.
+        fields (tuple, optional): library keys of the records. Defaults to normalize.MOVIE_KEYS.
+        start (int, optional): listing offset of the first movie. Defaults to 0.
+        onPage (function, optional): called after each page, see iterSectionElems(). Defaults to None.
 
-    Returns:
-        string: full file path and name
-        example: /dir/dirA/dirB/my file name.mkv
+    Yields:
+        normalize.MovieRec: for each movie
     """
-    p_theLoc = Path(plexLoc)
-    logger.debug(f"plexLoc = {plexLoc}")
-    logger.debug(f"p_theLoc = {p_theLoc}")
-    logger.debug(f"str(p_theLoc) = {str(p_theLoc)}")
-    if p_theLoc.drive:
-        offset = 1  # windows path
-    else:
-        offset = 2  # non windows path
-    uPath = ""
-    for x in range(offset, len(p_theLoc.parts)):
-        uPath = uPath + f"/{p_theLoc.parts[x]}"
-    return uPath
-
+    logger.info(f"Getting all movies from the movie library: {movieLib.title}")
+    if maxItems > 0:
+        logger.warning(f"Max Movies allowed to be exported: {maxItems}")
 
-def _genreStr(genreList):
-    tmpLst = []
-    for i in genreList:
-        tmpLst.append(i.tag)
+    genres = sectionGenres(movieLib, "movie", containerSize) if "Genres" in fields else {}
+    if pagepool.workers() > 0:
+        yield from _iterPoolRecs(movieLib, "movie", maxItems, containerSize, members, fields, start, onPage, genres)
+        return
+    for elem in iterSectionElems(movieLib, "movie", containerSize, maxItems, start=start, onPage=onPage):
+        if members != None:
+            _addMembers(members, elem)
+        yield normalize.movieFromXml(elem, genres.get(elem.attrib.get("ratingKey"), []), fields)
 
-    tmpLst.sort()
-    return tmpLst
 
+def iterSectionRecs(section, libtype, maxItems=0, containerSize=CONTAINER_SIZE, members=None,
+                    fields=normalize.MOVIE_KEYS, start=0, onPage=None):
+    """Item records of a library section, fetched a page at a time
 
-def _collection2Rec(dbObj, colKey, colVal):
-    """Add collection records to database
+    After pagepool.start() the pages are parsed and normalized by the
+    pool processes, with the same records.
 
     Args:
-        dbObj (class sqlitedb.LocalDB): Database obj to be updated
-        colKey (class sqlitedb.ColKey): The Collection Key record object
-        colVal (class sqlitedb.ColKeVal): The value of the Collect key
+        section (plexapi.library.LibrarySection): The section to export
+        libtype (string): item type, a value of SECTION_ITEMS
+        maxItems (int, optional): max records to return. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        members (dict, optional): filled with the collection members of a
+            movie section, as collectionMembers(). Defaults to None.
+        fields (tuple, optional): library keys of movie records, the other
+            types have all their keys. Defaults to normalize.MOVIE_KEYS.
+        start (int, optional): listing offset of the first item. Defaults to 0.
+        onPage (function, optional): called after each page, see iterSectionElems(). Defaults to None.
+
+    Yields:
+        normalize.MovieRec: for each item
     """
-    # Saving the key
-    logger.debug(f"writing to database collection key: {colKey.sKey}")
-    colVal.srckey_id = dbObj.addColKeyRec(colKey)
-    logger.debug(f"writing to database collection key value: {colVal.sValue}")
-    dbObj.addColValRec(colVal)
+    if libtype == "movie":
+        yield from iterMovieRecs(section, maxItems, containerSize, members, fields, start, onPage)
+        return
+    if pagepool.workers() > 0:
+        yield from _iterPoolRecs(section, libtype, maxItems, containerSize, None, None, start, onPage, None)
+        return
+    for elem in iterSectionElems(section, libtype, containerSize, maxItems, start=start, onPage=onPage):
+        yield normalize.itemFromXml(elem, libtype)
 
 
-def _movie2Rec(dbObj, svrName, uFilePath, libName, sKey, keyVal):
-    "TODO: Why all the values for mydb.LibSrcKey? Just sent over mydb.LibSrcKey"
-    srcR = mydb.LibSrcKey()
-    srcR.svrName = svrName
-    srcR.uFilePath = uFilePath
-    srcR.libName = libName
-    srcR.sKey = sKey
+def iterCollectionRecs(movieLib, maxItems=0, containerSize=CONTAINER_SIZE, members=None):
+    """Collection records of a movie library, fetched a page at a time
 
-    valR = mydb.LibKeyVal()
-    valR.sValue = keyVal
-    logger.debug(f"write to lib key table, and get rowID")
-    valR.srckey_id = dbObj.addLibKeyRec(srcR)
-    logger.debug(f"rowID : {valR.srckey_id}")
-    dbObj.addLibValRec(valR)
+    Args:
+        movieLib (plexapi.library.MovieSection): Movie lib section to export
+        maxItems (int, optional): max collections to return. Defaults to 0.
+        containerSize (int, optional): collections fetched per page. Defaults to CONTAINER_SIZE.
+        members (dict, optional): collection members from an earlier pass
+            over the movies. Defaults to a collectionMembers() pass.
+
+    Yields:
+        tuple: (colName, keyVals, colMembers) for each collection, the
+            member paths are only counted in keyVals
+    """
+    if members == None:
+        members = collectionMembers(movieLib, containerSize)
+    for elem in iterSectionElems(movieLib, "collection", containerSize, maxItems):
+        colName = elem.attrib.get("title")
+        colMembers = members.get(colName, set())
+        yield colName, {"collectionMode": elem.attrib.get("collectionMode"),
+                        "collectionSort": elem.attrib.get("collectionSort"),
+                        "childCount": str(len(colMembers))}, colMembers
 
 
-def movieLib2Db(dbObj, movieLib, svrName, maxItems=0):
+def movieLib2Db(dbObj, movieLib, svrName, maxItems=0, containerSize=CONTAINER_SIZE, fields=normalize.MOVIE_KEYS):
     """Export movie library items into database
 
     Args:
@@ -154,85 +650,536 @@ def movieLib2Db(dbObj, movieLib, svrName, maxItems=0):
         movieLib (plexapi.library.MovieSection): Movie lib section to export
         svrName (string): Name of the plex server
         maxItems (int, optional): max records to write. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        fields (tuple, optional): library keys saved. Defaults to normalize.MOVIE_KEYS.
     """
-    # Get all media from the movie library
-    logger.info(f"Getting all movies from the movie library: {movieLib.title}")
-    mList = movieLib.all()
     itemCount = 0
-    if maxItems > 0:
-        logger.warning(f"Max Movies allowed to be exported: {maxItems}")
-
     logger.debug("updating database")
-    for m in mList:
-        itemCount += 1
-        # The Key part of the key/value pair
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="guid", keyVal=str(m.guid))
-        # ##############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="Title", keyVal=m.title)
-        # ##############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="TitleSort", keyVal=m.titleSort)
-        # ###############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="OrigTitle", keyVal=m.originalTitle)
-        # ###############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="Year", keyVal=m.year)
-        # ###############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="Location", keyVal=str(m.locations))
-        # ###############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="Genres", keyVal=str(_genreStr(m.genres)))
-        # ###############################
-        _movie2Rec(dbObj, svrName=svrName, uFilePath=_uFilePath(
-            m.locations[0]), libName=movieLib.title, sKey="Media", keyVal=str(m.media))
-
-        if itemCount % 20 == 0:
-            logging.info(f"Movies exported to db: {itemCount}")
-
-        if itemCount == maxItems:
-            break
+    with metrics.phase("movieLib2Db"), dbObj.batchWriter() as bw:
+        srcR = mydb.LibSrcKey()
+        srcR.svrName = svrName
+        srcR.libName = movieLib.title
+        for rec in iterMovieRecs(movieLib, maxItems, containerSize, fields=fields):
+            itemCount += 1
+            srcR.uFilePath = rec.uFilePath
+            bw.addLibItem(srcR, rec.keyVals)
+            bw.addSnapItem(svrName, movieLib.title, rec.ratingKey, rec.uFilePath, rec.updatedAt, rec.addedAt,
+                           rec.location)
+
+            if itemCount % 20 == 0:
+                logging.info(f"Movies exported to db: {itemCount}")
+    metrics.count("items.movies", itemCount)
 
+    logger.info(
+        f"{svrName}: {itemCount} movies, {bw.rowCount} rows written ({bw.rowsPerSec:.0f} rows/sec)")
     logger.debug("database update done")
 
 
-def collection2Db(dbObj, movieLib, dbSvrNameTag, maxItems=0):
-    pass
-    mCollections = movieLib.collection()
-    # Iterate thru collections (mCollections) in the Movie Library
-    itemCount = 1
-    for c in mCollections:
-        c_keyRec = mydb.ColKey()
-        c_valRec = mydb.ColKeyVal()
+def collection2Db(dbObj, movieLib, dbSvrNameTag, maxItems=0, containerSize=CONTAINER_SIZE):
+    """Export the collections of a movie library into database
 
+    Args:
+        dbObj (sqlitedb.LocalDB object): database object to update
+        movieLib (plexapi.library.MovieSection): Movie lib section to export
+        dbSvrNameTag (string): Name of the plex server
+        maxItems (int, optional): max collections to write. Defaults to 0.
+        containerSize (int, optional): collections fetched per page. Defaults to CONTAINER_SIZE.
+    """
+    with metrics.phase("collection2Db"), dbObj.batchWriter() as bw:
+        c_keyRec = mydb.ColKey()
         c_keyRec.svrName = dbSvrNameTag
         c_keyRec.libName = movieLib.title
-        c_keyRec.colName = c.title
+        for colName, keyVals, colMembers in iterCollectionRecs(movieLib, maxItems, containerSize):
+            c_keyRec.colName = colName
+            bw.addColItem(c_keyRec, keyVals)
+            bw.addColMembers(dbSvrNameTag, movieLib.title, colName, colMembers)
 
-        c_keyRec.sKey = "collectionMode"
-        c_valRec.sValue = c.collectionMode
-        _collection2Rec(dbObj, c_keyRec, c_valRec)
+    logger.info(
+        f"{dbSvrNameTag}: {bw.rowCount} collection rows written ({bw.rowsPerSec:.0f} rows/sec)")
 
-        c_keyRec.sKey = "collectionSort"
-        c_valRec.sValue = c.collectionSort
-        _collection2Rec(dbObj, c_keyRec, c_valRec)
 
-        childList = []
-        for c_child in c.children:
-            childList.append(c_child.title)
+def movieLibTree(plexServer, libName, maxItems=0, containerSize=CONTAINER_SIZE, fields=merkle.QUICK_FIELDS):
+    """Merkle tree of a movie library, without saving it to a database
 
-        childList.sort()
-        c_keyRec.sKey = f"children"
-        c_valRec.sValue = str(childList)
-        _collection2Rec(dbObj, c_keyRec, c_valRec)
+    Args:
+        plexServer (plexapi.server.PlexServer): The server to fetch from
+        libName (string): Movie library name
+        maxItems (int, optional): max movies to fetch. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        fields (tuple, optional): keys that are read and hashed. Defaults to merkle.QUICK_FIELDS.
 
-        if itemCount == maxItems:
-            break
+    Returns:
+        merkle.MerkleTree: sealed tree of the movies
+    """
+    tree = merkle.MerkleTree(fields)
+    movieLib = plexServer.library.section(libName)
+    with metrics.phase("fetch.tree"):
+        for rec in iterMovieRecs(movieLib, maxItems, containerSize, fields=fields):
+            tree.add(rec.uFilePath, rec.keyVals)
+        tree.seal()
+    metrics.count("items.movies", tree.root.count)
+    logger.info(f"{libName}: {tree.root.count} movies in the tree")
+    return tree
+
+
+def _ingest(dbObj, ingestQ, running, counts, knownItems=None):
+    """Write the chunks of the export workers to the database
+
+    The calling thread is the only writer, until `running` workers have
+    put their done (or error) on the ingest queue.
+
+    Args:
+        dbObj (sqlitedb.LocalDB object): database object to update
+        ingestQ (queue.Queue): chunks of the workers, see _ChunkQueue
+        running (int): number of workers
+        counts (dict): (dbSvrNameTag, libName) to a dict of counts by
+            chunk kind, the counts of the chunks are added
+        knownItems (dict, optional): (dbSvrNameTag, libName) to the
+            snapshot items refreshed. Defaults to None.
+
+    Returns:
+        sqlitedb.BatchWriter: the closed writer, for its row counts
+    """
+    srcR = mydb.LibSrcKey()
+    c_keyRec = mydb.ColKey()
+    with dbObj.batchWriter() as bw:
+        while running:
+            kind, dbSvrNameTag, chunkLib, chunk = ingestQ.get()
+            known = (knownItems or {}).get((dbSvrNameTag, chunkLib)) or {}
+            count = counts.get((dbSvrNameTag, chunkLib))
+            srcR.svrName = dbSvrNameTag
+            srcR.libName = chunkLib
+            if kind in ITEM_CHUNKS:
+                for rec in chunk:
+                    if rec.ratingKey in known:
+                        # replacing the movie, its path may have changed
+                        srcR.uFilePath = known[rec.ratingKey][0]
+                        bw.deleteLibItem(srcR, movie=kind == "movies")
+                    srcR.uFilePath = rec.uFilePath
+                    bw.addLibItem(srcR, rec.keyVals, movie=kind == "movies")
+                    bw.addSnapItem(dbSvrNameTag, chunkLib, rec.ratingKey, rec.uFilePath,
+                                   rec.updatedAt, rec.addedAt, rec.location)
+                count[kind] += len(chunk)
+                metrics.count(f"items.{kind}", len(chunk))
+            elif kind == "deleted":
+                for ratingKey, uFilePath in chunk:
+                    srcR.uFilePath = uFilePath
+                    bw.deleteLibItem(srcR)
+                    bw.deleteSnapItem(dbSvrNameTag, chunkLib, ratingKey)
+                count["deleted"] += len(chunk)
+                metrics.count("items.deleted", len(chunk))
+            elif kind == "collections":
+                c_keyRec.svrName = dbSvrNameTag
+                c_keyRec.libName = chunkLib
+                for colName, keyVals, colMembers in chunk:
+                    c_keyRec.colName = colName
+                    bw.addColItem(c_keyRec, keyVals)
+                    bw.addColMembers(dbSvrNameTag, chunkLib, colName, colMembers)
+                count["collections"] += len(chunk)
+                metrics.count("items.collections", len(chunk))
+            elif kind == "checkpoint":
+                # committed with the items before it, by the same flush
+                nextStart, plexServer, fields = chunk
+                bw.setCheckpoint(dbSvrNameTag, chunkLib, nextStart, plexServer, fields)
+            elif kind == "done":
+                if chunk != None:
+                    count["seconds"] = chunk
+                logger.info(f"{dbSvrNameTag}: export of {chunkLib} done {count}")
+                running -= 1
+            else:
+                # the items written so far are kept, with the checkpoint of a full export
+                bw.flush()
+                logger.critical(f"{dbSvrNameTag}: {chunkLib} Error:  {chunk}", exc_info=chunk)
+                logger.critical("Run again with --resume to continue the export from its checkpoint")
+                sys.exit(1)
+    return bw
+
+
+class _ChunkQueue():
+    """Records of one kind, put on the ingest queue in chunks of INGEST_CHUNK
+
+    A checkpoint puts the partial chunk first, so the ingest thread has
+    every record before the checkpoint when it gets it.
+    """
+
+    def __init__(self, ingestQ, kind, dbSvrNameTag, libName):
+        self.ingestQ = ingestQ
+        self.kind = kind
+        self.dbSvrNameTag = dbSvrNameTag
+        self.libName = libName
+        self._chunk = []
+
+    def flush(self):
+        """Put the partial chunk on the queue"""
+        self.ingestQ.put((self.kind, self.dbSvrNameTag, self.libName, self._chunk))
+        self._chunk = []
+
+    def putAll(self, recs):
+        """Put all the records on the queue, the last chunk is put even when empty"""
+        for rec in recs:
+            self._chunk.append(rec)
+            if len(self._chunk) == INGEST_CHUNK:
+                self.flush()
+        self.flush()
+
+    def checkpoint(self, nextStart, plexServer, fields=None):
+        """Put the records so far and a checkpoint on the queue
+
+        Args:
+            nextStart (int): listing offset of the records not put yet
+            plexServer (string): name of the plex server exported
+            fields (tuple, optional): library keys of the records. Defaults to None, all of them.
+        """
+        if self._chunk:
+            self.flush()
+        self.ingestQ.put(("checkpoint", self.dbSvrNameTag, self.libName,
+                          (nextStart, plexServer, ",".join(fields) if fields != None else None)))
+
+
+def _putChunks(ingestQ, kind, dbSvrNameTag, libName, recs):
+    """Put records on the ingest queue in chunks of INGEST_CHUNK"""
+    _ChunkQueue(ingestQ, kind, dbSvrNameTag, libName).putAll(recs)
 
-        itemCount += 1
+
+def _exportWorker(ingestQ, dbSvrNameTag, plexServer, libName, known, movieMax, colMax, containerSize, fields,
+                  start=None):
+    """Fetch one server's movie library and collections onto the ingest queue
+
+    Runs in an export thread, records are put on the queue in chunks of
+    INGEST_CHUNK as (kind, dbSvrNameTag, libName, records).
+
+    With a snapshot (known) only the movies that are new or have a
+    different updatedAt are fetched, and the snapshot movies that are no
+    longer listed are put on the queue as deleted.
+
+    With a start offset all the movies from there are fetched, with a
+    checkpoint after each page. known are then the movies saved before
+    the export was interrupted, and the collection members are fetched
+    on their own.
+    """
+    try:
+        movieLib = plexServer.library.section(libName)
+        members = {}
+        if start != None:
+            members = {} if start == 0 else None
+            movies = _ChunkQueue(ingestQ, "movies", dbSvrNameTag, libName)
+            with metrics.phase("fetch.movies"):
+                movies.putAll(iterMovieRecs(movieLib, movieMax, containerSize, members, fields, start,
+                                            lambda nextStart: movies.checkpoint(nextStart, plexServer.friendlyName,
+                                                                                fields)))
+        else:
+            listing = {}
+            with metrics.phase("fetch.listing"):
+                for elem in iterSectionElems(movieLib, "movie", containerSize, movieMax):
+                    listing[elem.attrib["ratingKey"]] = int(elem.attrib.get("updatedAt", 0))
+                    _addMembers(members, elem)
+            gone = [(k, v[0]) for k, v in known.items() if k not in listing]
+            changed = [k for k, updatedAt in listing.items()
+                       if k not in known or known[k][1] != updatedAt]
+            logger.info(
+                f"{dbSvrNameTag}: {len(listing)} movies listed, {len(changed)} new or changed, {len(gone)} deleted")
+            _putChunks(ingestQ, "deleted", dbSvrNameTag, libName, gone)
+            with metrics.phase("fetch.movies"):
+                _putChunks(ingestQ, "movies", dbSvrNameTag, libName,
+                           (normalize.movieFromXml(elem, fields=fields)
+                            for elem in iterMetadataItems(plexServer, changed, containerSize)))
+
+        # after the movies, their Collection tags are the collection members
+        with metrics.phase("fetch.collections"):
+            _putChunks(ingestQ, "collections", dbSvrNameTag, libName,
+                       iterCollectionRecs(movieLib, colMax, containerSize, members))
+
+        ingestQ.put(("done", dbSvrNameTag, libName, None))
+    except Exception as err:
+        ingestQ.put(("error", dbSvrNameTag, libName, err))
+
+
+def _resumePoint(dbObj, dbSvrNameTag, libName, plexServer, fields):
+    """The listing offset an interrupted export of the same plex server and fields got to
+
+    Returns:
+        int: the offset, None when there is no checkpoint to resume from
+    """
+    point = dbObj.getCheckpoint(dbSvrNameTag, libName)
+    if point == None:
+        return None
+    nextStart, pointServer, pointFields = point
+    if pointServer != plexServer.friendlyName or pointFields != (",".join(fields) if fields != None else None):
+        logger.info(f"{dbSvrNameTag}: checkpoint of {libName} is of another export of {pointServer}, not resumed")
+        return None
+    logger.info(f"{dbSvrNameTag}: resuming the export of {pointServer} {libName} from item {nextStart}")
+    return nextStart
+
+
+def exportServers(dbObj, plexServers, libName, movieMax=0, colMax=0, containerSize=CONTAINER_SIZE,
+                  incremental=False, fields=normalize.MOVIE_KEYS, resume=False):
+    """Export a movie library and its collections from several servers at the same time
+
+    Each server is fetched in its own thread. The calling thread is the
+    only writer to the database, sqlite connections can not be shared
+    between threads.
+
+    With incremental, a server tag that has a snapshot of the library
+    from the same plex server, and the same fields, only refreshes the
+    movies that changed since then. Otherwise the data saved for the
+    server tag is replaced.
+
+    A full export saves a checkpoint with each page of movies. With
+    resume, a server tag whose export of the same plex server and fields
+    was interrupted continues from its checkpoint.
+
+    Args:
+        dbObj (sqlitedb.LocalDB object): database object to update
+        plexServers (list): (dbSvrNameTag, plex server connection) for each server
+        libName (string): Movie library name
+        movieMax (int, optional): max movies per server. Defaults to 0.
+        colMax (int, optional): max collections per server. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        incremental (bool, optional): refresh from the snapshot. Defaults to False.
+        fields (tuple, optional): library keys saved. Defaults to normalize.MOVIE_KEYS.
+        resume (bool, optional): continue interrupted exports. Defaults to False.
+
+    Returns:
+        dict: dbSvrNameTag to {"movies": count, "collections": count, "deleted": count}
+    """
+    # Bounded so a slow writer holds back the fetch instead of buffering everything
+    ingestQ = queue.Queue(maxsize=len(plexServers) * 8)
+    counts = {}
+    knownItems = {}
+    starts = {}
+    for dbSvrNameTag, plexServer in plexServers:
+        counts[(dbSvrNameTag, libName)] = {"movies": 0, "collections": 0, "deleted": 0}
+        knownItems[(dbSvrNameTag, libName)] = None
+        # a full export from the start, unless it is resumed or refreshes the snapshot
+        starts[dbSvrNameTag] = 0
+        if resume:
+            starts[dbSvrNameTag] = _resumePoint(dbObj, dbSvrNameTag, libName, plexServer, fields)
+            if starts[dbSvrNameTag] != None:
+                knownItems[(dbSvrNameTag, libName)] = dbObj.snapshotItems(dbSvrNameTag, libName)
+                dbObj.clearCollections(dbSvrNameTag, libName)
+                continue
+            starts[dbSvrNameTag] = 0
+        snap = dbObj.getSnapshot(dbSvrNameTag, libName) if incremental else None
+        # snapshots from before the fields setting have all of them
+        snapFields = normalize.parseFields(snap[2]) if snap != None else None
+        if snap != None and snap[0] == plexServer.friendlyName and snapFields == fields:
+            logger.info(f"{dbSvrNameTag}: refreshing snapshot of {snap[0]} {libName} taken at {snap[1]}")
+            knownItems[(dbSvrNameTag, libName)] = dbObj.snapshotItems(dbSvrNameTag, libName)
+            dbObj.clearCollections(dbSvrNameTag, libName)
+            starts[dbSvrNameTag] = None
+        else:
+            if snap != None and snap[0] != plexServer.friendlyName:
+                logger.info(f"{dbSvrNameTag}: snapshot is of {snap[0]}, replacing it")
+            elif snap != None:
+                logger.info(f"{dbSvrNameTag}: snapshot has the fields {','.join(snapFields)}, replacing it")
+            dbObj.clearLibrary(dbSvrNameTag, libName)
+
+    syncTime = int(time.time())
+    for dbSvrNameTag, plexServer in plexServers:
+        threading.Thread(target=_exportWorker, name=f"export-{dbSvrNameTag}", daemon=True,
+                         args=(ingestQ, dbSvrNameTag, plexServer, libName, knownItems[(dbSvrNameTag, libName)],
+                               movieMax, colMax, containerSize, fields, starts[dbSvrNameTag])).start()
+
+    with metrics.phase("export"):
+        bw = _ingest(dbObj, ingestQ, len(plexServers), counts, knownItems)
+
+    for dbSvrNameTag, plexServer in plexServers:
+        dbObj.setSnapshot(dbSvrNameTag, libName, plexServer.friendlyName, syncTime, fields)
+        dbObj.clearCheckpoint(dbSvrNameTag, libName)
+
+    logger.info(
+        f"All servers exported, {bw.rowCount} rows written ({bw.rowsPerSec:.0f} rows/sec)")
+    return {dbSvrNameTag: count for (dbSvrNameTag, chunkLib), count in counts.items()}
+
+
+def _sectionWorker(ingestQ, dbSvrNameTag, section, libtype, maxItems, colMax, containerSize, fields, start=0):
+    """Fetch one library section of a server onto the ingest queue
+
+    Runs in the exportSections() worker pool, the items are put on the
+    queue as for _exportWorker(), with a checkpoint after each page, the
+    collections of a movie section, and the seconds the section took
+    with its done.
+    """
+    began = time.perf_counter()
+    try:
+        kind = f"{libtype}s"
+        # a resumed export has not seen the collection tags of the items before start
+        members = {} if libtype == "movie" and start == 0 else None
+        itemFields = fields if libtype == "movie" else None
+        items = _ChunkQueue(ingestQ, kind, dbSvrNameTag, section.title)
+        with metrics.phase(f"fetch.{kind}"):
+            items.putAll(iterSectionRecs(section, libtype, maxItems, containerSize, members, fields, start,
+                                         lambda nextStart: items.checkpoint(nextStart, section._server.friendlyName,
+                                                                            itemFields)))
+        if libtype == "movie":
+            with metrics.phase("fetch.collections"):
+                _putChunks(ingestQ, "collections", dbSvrNameTag, section.title,
+                           iterCollectionRecs(section, colMax, containerSize, members))
+        ingestQ.put(("done", dbSvrNameTag, section.title, time.perf_counter() - began))
+    except Exception as err:
+        ingestQ.put(("error", dbSvrNameTag, section.title, err))
+
+
+def _sectionPool(taskQ, ingestQ, maxItems, colMax, containerSize, fields):
+    """A thread of the exportSections() worker pool, exports sections until there are none left"""
+    while True:
+        try:
+            dbSvrNameTag, section, libtype, start = taskQ.get_nowait()
+        except queue.Empty:
+            return
+        _sectionWorker(ingestQ, dbSvrNameTag, section, libtype, maxItems, colMax, containerSize, fields, start)
+
+
+def exportSections(dbObj, plexServers, sectionNames=None, workers=SECTION_WORKERS, maxItems=0, colMax=0,
+                   containerSize=CONTAINER_SIZE, fields=normalize.MOVIE_KEYS, resume=False):
+    """Export all the movie, show and music sections of several servers
+
+    The sections of every server are fetched by a pool of `workers`
+    threads, a section of one server per task, so a large section only
+    holds back one thread. The calling thread is the only writer to
+    the database. The data saved for each section and server tag is
+    replaced, shows are saved by episode and music by track.
+
+    A checkpoint is saved with each page of items. With resume, a section
+    whose export was interrupted continues from its checkpoint.
+
+    Args:
+        dbObj (sqlitedb.LocalDB object): database object to update
+        plexServers (list): (dbSvrNameTag, plex server connection) for each server
+        sectionNames (list, optional): only these sections. Defaults to None, all of them.
+        workers (int, optional): sections fetched at the same time. Defaults to SECTION_WORKERS.
+        maxItems (int, optional): max items per section and server. Defaults to 0.
+        colMax (int, optional): max collections per movie section and server. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        fields (tuple, optional): library keys of the movies saved. Defaults to normalize.MOVIE_KEYS.
+        resume (bool, optional): continue interrupted exports. Defaults to False.
+
+    Returns:
+        list: a dict for each section, in name order, with its "section"
+            name, item "type", and for each dbSvrNameTag its counts by
+            chunk kind and the "seconds" it took, a server without the
+            section has no counts
+    """
+    # the sections of each server, a section of another type than on the first server is not compared
+    tasks = []
+    sectionTypes = {}
+    for dbSvrNameTag, plexServer in plexServers:
+        for section in plexServer.library.sections():
+            libtype = SECTION_ITEMS.get(section.type)
+            if libtype == None or (sectionNames != None and section.title not in sectionNames):
+                continue
+            if sectionTypes.setdefault(section.title, libtype) != libtype:
+                logger.warning(f"{dbSvrNameTag}: section {section.title} is {section.type}, "
+                               f"not compared with the {sectionTypes[section.title]} section")
+                continue
+            tasks.append((dbSvrNameTag, plexServer, section, libtype))
+
+    counts = {}
+    knownItems = {}
+    starts = {}
+    for dbSvrNameTag, plexServer, section, libtype in tasks:
+        counts[(dbSvrNameTag, section.title)] = {f"{libtype}s": 0, "collections": 0, "deleted": 0, "seconds": 0.0}
+        start = None
+        if resume:
+            start = _resumePoint(dbObj, dbSvrNameTag, section.title, plexServer,
+                                 fields if libtype == "movie" else None)
+        if start != None:
+            knownItems[(dbSvrNameTag, section.title)] = dbObj.snapshotItems(dbSvrNameTag, section.title)
+            dbObj.clearCollections(dbSvrNameTag, section.title)
+        else:
+            start = 0
+            dbObj.clearLibrary(dbSvrNameTag, section.title)
+        starts[(dbSvrNameTag, section.title)] = start
+    logger.info(f"Exporting {len(sectionTypes)} sections, {len(tasks)} server sections with {workers} workers")
+
+    # Bounded so a slow writer holds back the fetch instead of buffering everything
+    ingestQ = queue.Queue(maxsize=max(workers, 1) * 8)
+    syncTime = int(time.time())
+    taskQ = queue.Queue()
+    for dbSvrNameTag, plexServer, section, libtype in tasks:
+        taskQ.put((dbSvrNameTag, section, libtype, starts[(dbSvrNameTag, section.title)]))
+    for n in range(min(max(workers, 1), len(tasks))):
+        threading.Thread(target=_sectionPool, name=f"section-{n}", daemon=True,
+                         args=(taskQ, ingestQ, maxItems, colMax, containerSize, fields)).start()
+    with metrics.phase("export"):
+        bw = _ingest(dbObj, ingestQ, len(tasks), counts, knownItems)
+
+    for dbSvrNameTag, plexServer, section, libtype in tasks:
+        dbObj.setSnapshot(dbSvrNameTag, section.title, plexServer.friendlyName, syncTime,
+                          fields if libtype == "movie" else None)
+        dbObj.clearCheckpoint(dbSvrNameTag, section.title)
+    logger.info(
+        f"All sections exported, {bw.rowCount} rows written ({bw.rowsPerSec:.0f} rows/sec)")
+
+    results = []
+    for title in sorted(sectionTypes):
+        result = {"section": title, "type": sectionTypes[title]}
+        for dbSvrNameTag, plexServer in plexServers:
+            if (dbSvrNameTag, title) in counts:
+                result[dbSvrNameTag] = counts[(dbSvrNameTag, title)]
+        results.append(result)
+    return results
+
+
+def _sortedLibRecs(plexServer, libName, movieMax, colMax, containerSize, fields):
+    """Movie and collection records of a server, sorted for mergediff (internal use only)"""
+    movieLib = plexServer.library.section(libName)
+    members = {}
+    with metrics.phase("fetch.movies"):
+        movies = mergediff.sortedRecords((rec.uFilePath, rec.keyVals) for rec in
+                                         iterMovieRecs(movieLib, movieMax, containerSize, members, fields))
+    with metrics.phase("fetch.collections"):
+        # with their members, read twice
+        collections = list(mergediff.sortedRecords(iterCollectionRecs(movieLib, colMax, containerSize, members)))
+    return movies, collections
+
+
+def mergeCompare(plexServers, libName, libFile, colFile, movieMax=0, colMax=0, containerSize=CONTAINER_SIZE,
+                 fields=normalize.MOVIE_KEYS, diffOnly=False, movedFile=None, colDiffOnly=False, fmt="csv",
+                 compress=None, memberFile=None):
+    """Compare a movie library and its collections of two servers, without the database
+
+    Both servers are fetched at the same time, their records are sorted
+    by universal file path (collection name), then merge joined straight
+    to the diff csv files, in the same layout as LocalDB.exportLibDiff()
+    and exportColDiff().
+
+    Args:
+        plexServers (list): plex server connection of server1 and server2
+        libName (string): Movie library name
+        libFile (string): movie library diff csv file
+        colFile (string): collection diff csv file
+        movieMax (int, optional): max movies per server. Defaults to 0.
+        colMax (int, optional): max collections per server. Defaults to 0.
+        containerSize (int, optional): items fetched per page. Defaults to CONTAINER_SIZE.
+        fields (tuple, optional): library keys compared. Defaults to normalize.MOVIE_KEYS.
+        diffOnly (bool, optional): only the movie keys that are different,
+            as the wide schema. Defaults to False.
+        movedFile (string, optional): csv file of the moved or renamed
+            movies, see fuzzymatch.exportMoved(). Defaults to None, not written.
+        colDiffOnly (bool, optional): only the collection keys that are different. Defaults to False.
+        fmt (string, optional): csv or jsonl format of the files, see diffout.FORMATS. Defaults to csv.
+        compress (string, optional): compression of the files, see diffout.COMPRESSIONS. Defaults to None.
+        memberFile (string, optional): csv file of the collection members
+            only on one server, see mergediff.exportMemberDiff(). Defaults to None, not written.
+
+    Returns:
+        dict: "library" and "collections" counts of mergediff.mergeDiff(),
+            "moved" counts of fuzzymatch.exportMoved() and the "members" rows
+    """
+    with ThreadPoolExecutor(max_workers=len(plexServers)) as pool:
+        (movies1, cols1), (movies2, cols2) = pool.map(
+            lambda svr: _sortedLibRecs(svr, libName, movieMax, colMax, containerSize, fields), plexServers)
+    counts = {"collections": mergediff.exportDiff(cols1, cols2, colFile, libName, "colname", diffOnly=colDiffOnly,
+                                                  fmt=fmt, compress=compress)}
+    unmatched = ({}, {}) if movedFile != None else None
+    counts["library"] = mergediff.exportDiff(movies1, movies2, libFile, libName, diffOnly=diffOnly,
+                                             unmatched=unmatched, fmt=fmt, compress=compress)
+    if movedFile != None:
+        counts["moved"] = fuzzymatch.exportMoved(movedFile, libName, *unmatched, fmt=fmt, compress=compress)
+    if memberFile != None:
+        counts["members"] = mergediff.exportMemberDiff(cols1, cols2, memberFile, libName, fmt, compress)
+    return counts
 
 
 if __name__ == '__main__':
@@ -1,23 +1,214 @@
 import sys
+import time
 import logging
 import sqlite3
 import hashlib
-import csv
+from itertools import groupby
 from pathlib import Path
+from plexinfo import metrics
+from plexinfo import diffout
 
 logger = logging.getLogger("sqlitedb")
 
+# Database schema modes
+#  eav  : movie keys/values stored in t_libkeys/t_libvals (createtables.sql)
+#  wide : one t_movies row per movie (createtables_wide.sql)
+SCHEMAS = ("eav", "wide")
+
+# Storage profiles, the pragmas a database connection is set up with
+#  durable        : a snapshot file kept between runs, written through a
+#                   write-ahead log, a crash loses at most the last commits
+#  fast-ephemeral : a database rebuilt from plex on every run, with the
+#                   rollback journal in memory and no syncs to the disk
+# The foreign keys stay on in both, the values are deleted with their
+# keys by ON DELETE CASCADE.
+PROFILES = {"durable": (("journal_mode", "WAL"),
+                        ("synchronous", "NORMAL"),
+                        ("cache_size", -65536),
+                        ("mmap_size", 268435456),
+                        ("temp_store", "MEMORY")),
+            "fast-ephemeral": (("journal_mode", "MEMORY"),
+                               ("synchronous", "OFF"),
+                               ("cache_size", -262144),
+                               ("mmap_size", 268435456),
+                               ("temp_store", "MEMORY"))}
+
+# auto is durable for a database file and fast-ephemeral without one,
+# see LocalDB.checkSpill()
+STORAGE_PROFILES = tuple(PROFILES) + ("auto",)
+
+# MB a database without a file may use before it is moved to a temporary file
+RAM_BUDGET = 1024
+
+# Movie library key (sKey) to t_movies column
+MOVIE_COLUMNS = {"guid": "guid",
+                 "Title": "title",
+                 "TitleSort": "titleSort",
+                 "OrigTitle": "originalTitle",
+                 "Year": "year",
+                 "Location": "locations",
+                 "Genres": "genres",
+                 "Media": "media"}
+
+# Diff queries materialized by LocalDB.buildDiff()
+# Library diff for the eav schema, every key of every library item
+_libDiffSql = """
+SELECT library, filePath, sKey, server1_VAL, server2_VAL,
+       CASE WHEN server1_VAL = server2_VAL THEN '' ELSE '***Different***' END AS isDiff
+  FROM (SELECT l.name AS library, p.name AS filePath, f.name AS sKey,
+               CASE WHEN k1.ID IS NULL THEN '--Value missing--' WHEN v1.s_value IS NULL THEN '--NULL VALUE--' ELSE v1.s_value END AS server1_VAL,
+               CASE WHEN k2.ID IS NULL THEN '--Value missing--' WHEN v2.s_value IS NULL THEN '--NULL VALUE--' ELSE v2.s_value END AS server2_VAL
+          FROM (SELECT DISTINCT library_id, path_id, skey_id FROM t_libkeys) AS k
+               JOIN t_dim_library AS l ON l.ID = k.library_id
+               JOIN t_dim_path AS p ON p.ID = k.path_id
+               JOIN t_dim_skey AS f ON f.ID = k.skey_id
+               LEFT JOIN t_libkeys AS k1 ON k1.library_id = k.library_id AND k1.path_id = k.path_id AND k1.skey_id = k.skey_id
+                                        AND k1.server_id = (SELECT ID FROM t_dim_server WHERE name = 'server1')
+               LEFT JOIN t_libvals AS v1 ON v1.srckey_id = k1.ID
+               LEFT JOIN t_libkeys AS k2 ON k2.library_id = k.library_id AND k2.path_id = k.path_id AND k2.skey_id = k.skey_id
+                                        AND k2.server_id = (SELECT ID FROM t_dim_server WHERE name = 'server2')
+               LEFT JOIN t_libvals AS v2 ON v2.srckey_id = k2.ID)
+ ORDER BY library, filePath, sKey"""
+
+# Library diff for the wide schema, only the keys that differ
+_movieDiffSql = "SELECT library, filePath, sKey, server1_VAL, server2_VAL, isDiff FROM v_movie_DiffResults"
+
+# Library items that are not movies (episodes, tracks) are key/values in
+# the wide schema too, only their keys that differ are added to its diff
+_wideItemDiffSql = ("SELECT library, filePath, sKey, server1_VAL, server2_VAL, isDiff FROM ({movieSql}) "
+                    "UNION ALL "
+                    "SELECT library, filePath, sKey, server1_VAL, server2_VAL, isDiff FROM (" + _libDiffSql +
+                    ") WHERE isDiff <> '' "
+                    "ORDER BY library, filePath, sKey")
+
+# Library column of the materialized diff tables, indexed for the
+# exports of one library
+_DIFF_LIBRARY = {"t_lib_DiffResults": "library", "t_col_DiffResults": "libname"}
+
+# Values of the N-way matrix, same as the diff results
+_VALUE_MISSING = '--Value missing--'
+_NULL_VALUE = '--NULL VALUE--'
+
+# Dimension tables, the server, library, path, collection and key names
+# the key tables refer to by ID
+_DIM_TABLES = ("t_dim_server", "t_dim_library", "t_dim_path", "t_dim_colname", "t_dim_skey")
+
+# Delete of the keys of a server tag and library, by their names
+_DIM_DELETE = ("DELETE FROM {table} WHERE server_id = (SELECT ID FROM t_dim_server WHERE name = ?) "
+               "AND library_id = (SELECT ID FROM t_dim_library WHERE name = ?)")
+
+# Columns added after a snapshot database may have been created,
+# (table, column, type) added by LocalDB.initDB()
+_ADDED_COLUMNS = (("t_snapitems", "location", "TEXT"),
+                  ("t_snapshots", "fields", "TEXT"))
+
+# Collection diff, every key of every collection
+_colDiffSql = """
+SELECT libname, colname, sKey, server1_VAL, server2_VAL,
+       CASE WHEN server1_VAL = server2_VAL THEN '' ELSE '***Different***' END AS isDiff
+  FROM (SELECT l.name AS libname, c.name AS colname, f.name AS sKey,
+               CASE WHEN k1.ID IS NULL THEN '--Value missing--' WHEN v1.s_value IS NULL THEN '--NULL VALUE--' ELSE v1.s_value END AS server1_VAL,
+               CASE WHEN k2.ID IS NULL THEN '--Value missing--' WHEN v2.s_value IS NULL THEN '--NULL VALUE--' ELSE v2.s_value END AS server2_VAL
+          FROM (SELECT DISTINCT library_id, colname_id, skey_id FROM t_colkeys) AS k
+               JOIN t_dim_library AS l ON l.ID = k.library_id
+               JOIN t_dim_colname AS c ON c.ID = k.colname_id
+               JOIN t_dim_skey AS f ON f.ID = k.skey_id
+               LEFT JOIN t_colkeys AS k1 ON k1.library_id = k.library_id AND k1.colname_id = k.colname_id AND k1.skey_id = k.skey_id
+                                        AND k1.server_id = (SELECT ID FROM t_dim_server WHERE name = 'server1')
+               LEFT JOIN t_colvals AS v1 ON v1.colkey_id = k1.ID
+               LEFT JOIN t_colkeys AS k2 ON k2.library_id = k.library_id AND k2.colname_id = k.colname_id AND k2.skey_id = k.skey_id
+                                        AND k2.server_id = (SELECT ID FROM t_dim_server WHERE name = 'server2')
+               LEFT JOIN t_colvals AS v2 ON v2.colkey_id = k2.ID)
+ ORDER BY libname, colname, sKey"""
+
+# Members only on one of the servers, of the collections whose member
+# sets are different, each a range of the primary key
+_memberDiffSql = """
+WITH changed AS (
+    SELECT s1.library, s1.colname FROM t_colmembersets AS s1
+           LEFT JOIN t_colmembersets AS s2 ON s2.server = 'server2' AND s2.library = s1.library AND s2.colname = s1.colname
+     WHERE s1.server = 'server1' AND s2.memberHash IS NOT s1.memberHash {library1}
+    UNION
+    SELECT s2.library, s2.colname FROM t_colmembersets AS s2
+           LEFT JOIN t_colmembersets AS s1 ON s1.server = 'server1' AND s1.library = s2.library AND s1.colname = s2.colname
+     WHERE s2.server = 'server2' AND s1.memberHash IS NOT s2.memberHash {library2})
+SELECT m.library, m.colname, m.member, 'only ' || m.server AS status
+  FROM changed AS c
+       JOIN t_colmembers AS m ON m.server IN ('server1', 'server2') AND m.library = c.library AND m.colname = c.colname
+ WHERE NOT EXISTS (SELECT 1 FROM t_colmembers AS o
+                    WHERE o.server = CASE m.server WHEN 'server1' THEN 'server2' ELSE 'server1' END
+                      AND o.library = m.library AND o.colname = m.colname AND o.member = m.member)
+ ORDER BY m.library, m.colname, m.member, status"""
+
+
+def memberHash(members):
+    """Hash of the member set of a collection, the same whatever their order
+
+    Args:
+        members (iterable): member paths
+
+    Returns:
+        string: md5 hex digest
+    """
+    return hashlib.md5("\n".join(sorted(members)).encode()).hexdigest()
+
+
+class _MemberHash():
+    """sqlite aggregate of memberHash() (internal use only)"""
+
+    def __init__(self):
+        self.members = []
+
+    def step(self, member):
+        self.members.append(member)
+
+    def finalize(self):
+        return memberHash(self.members)
+
 
 class LocalDB():
-    def __init__(self, dbLoc=None):
+    def __init__(self, dbLoc=None, batchSize=5000, schema="eav", fields=None, profile="auto", ramBudget=RAM_BUDGET):
         """init the sqlite database class
 
         Args:
             dbLoc ([string], optional): database filename. Defaults to :memory:
+            batchSize (int, optional): rows buffered by a BatchWriter before
+                they are flushed in one transaction. Defaults to 5000.
+            schema (string, optional): movie schema mode, one of SCHEMAS.
+                Defaults to eav.
+            fields (tuple, optional): library keys compared, the keys of
+                MOVIE_COLUMNS or some of them. Defaults to all of them.
+            profile (string, optional): storage profile, one of
+                STORAGE_PROFILES. Defaults to auto.
+            ramBudget (int, optional): MB of an auto database without a
+                file, before it is moved to a temporary file. Defaults to RAM_BUDGET.
         """
         self.conn = None
+        self.batchSize = batchSize
+        if schema not in SCHEMAS:
+            logger.critical(
+                f"Unknown database schema: {schema}. Must be one of {SCHEMAS}")
+            sys.exit(1)
+        if profile not in STORAGE_PROFILES:
+            logger.critical(
+                f"Unknown storage profile: {profile}. Must be one of {STORAGE_PROFILES}")
+            sys.exit(1)
+
+        self.schema = schema
+        self.fields = tuple(fields) if fields != None else tuple(MOVIE_COLUMNS)
+        # Set when the diff tables are current, see buildDiff()
+        self._diffBuilt = False
+        # Dimension table name to ID caches, read when first needed, see _dimID()
+        self._dims = None
+        self._dimNext = None
         if dbLoc == None:
             dbLoc = ":memory:"
+        self.ramBudget = ramBudget
+        # only an auto database without a file is moved, see checkSpill()
+        self._spill = profile == "auto" and dbLoc == ":memory:"
+        if profile == "auto":
+            profile = "fast-ephemeral" if dbLoc == ":memory:" else "durable"
+        self.profile = profile
 
         logger.debug(f"attempt open db {dbLoc}")
         try:
@@ -33,12 +224,59 @@ class LocalDB():
 
         logger.debug(f"successful connection to {dbLoc}")
 
+        self._setPragmas()
         c = self.conn.cursor()
-        c.execute("PRAGMA foreign_keys = ON")
         c.execute("PRAGMA database_list;")
         xtmp = c.fetchall()
         logger.debug(f"PRAGMA database_list: {xtmp}")
 
+    def _setPragmas(self):
+        """Set up the connection with the pragmas of the storage profile (internal use only)"""
+        c = self.conn.cursor()
+        c.execute("PRAGMA foreign_keys = ON")
+        for pragma, value in PROFILES[self.profile]:
+            c.execute(f"PRAGMA {pragma} = {value}")
+        c.execute("PRAGMA journal_mode")
+        logger.debug(f"storage profile {self.profile}, journal mode {c.fetchone()[0]}")
+
+    def checkSpill(self):
+        """Move a database in memory to a temporary file once it is larger than the RAM budget
+
+        Only an auto profile database without a file is moved, once, and
+        is fast-ephemeral on the file too. Its pages are copied with the
+        sqlite backup API, then only the page cache is in memory. sqlite
+        deletes the temporary file when the database is closed.
+
+        Returns:
+            [bool]: True when the database was moved
+        """
+        if not self._spill:
+            return False
+        c = self.conn.cursor()
+        c.execute("PRAGMA page_count")
+        pageCount = c.fetchone()[0]
+        c.execute("PRAGMA page_size")
+        dbSize = pageCount * c.fetchone()[0]
+        if dbSize <= self.ramBudget * 1024 * 1024:
+            return False
+
+        logger.info(f"Database is {dbSize // (1024 * 1024)} MB, over the {self.ramBudget} MB in memory, "
+                    f"moving it to a temporary file")
+        with metrics.phase("db.spill"):
+            try:
+                # an empty file name is a temporary database file
+                fileConn = sqlite3.connect("", detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+                self.conn.backup(fileConn)
+            except sqlite3.Error as e:
+                logger.critical(f"Unexpected error moving the database to a temporary file. Exception: {e}",
+                                exc_info=True)
+                sys.exit(1)
+        self.conn.close()
+        self.conn = fileConn
+        self._spill = False
+        self._setPragmas()
+        return True
+
     def _exeScriptFile(self, scriptFileName):
         """Executes a Script file. (internal use only)
 
@@ -98,7 +336,8 @@ class LocalDB():
     def initDB(self, scriptPath):
         """Create tables, views, indexes for the database
 
-        ASSUMPTION database is new, and tables do not exist.
+        Only the scripts for tables that do not exist yet are run, so an
+        existing snapshot database is kept.
         Args:
             scriptPath (string): Path to script(s). Defaults to None.
         """
@@ -106,9 +345,298 @@ class LocalDB():
         gtScripts = Path(scriptPath)
         logger.info(f"Executing scripts to create database")
 
-        scriptFile = gtScripts / "createtables.sql"
-        logger.debug(f"Executing {scriptFile}")
-        self._exeScriptFile(scriptFileName=f'{scriptFile}')
+        if not self._hasTable("t_libkeys"):
+            scriptFile = gtScripts / "createtables.sql"
+            logger.debug(f"Executing {scriptFile}")
+            self._exeScriptFile(scriptFileName=f'{scriptFile}')
+        elif not self._hasTable("t_dim_path"):
+            # snapshot databases from before the dimension tables
+            scriptFile = gtScripts / "migrate_dims.sql"
+            logger.info(f"Moving the library and collection keys to the dimension tables")
+            self._exeScriptFile(scriptFileName=f'{scriptFile}')
+            self._dims = None
+
+        if self.schema == "wide" and not self._hasTable("t_movies"):
+            scriptFile = gtScripts / "createtables_wide.sql"
+            logger.debug(f"Executing {scriptFile}")
+            self._exeScriptFile(scriptFileName=f'{scriptFile}')
+
+        if not (self._hasTable("t_snapshots") and self._hasTable("t_snapitems")):
+            scriptFile = gtScripts / "createtables_snapshots.sql"
+            logger.debug(f"Executing {scriptFile}")
+            self._exeScriptFile(scriptFileName=f'{scriptFile}')
+
+        if not self._hasTable("t_checkpoints"):
+            scriptFile = gtScripts / "createtables_checkpoints.sql"
+            logger.debug(f"Executing {scriptFile}")
+            self._exeScriptFile(scriptFileName=f'{scriptFile}')
+
+        if not self._hasTable("t_colmembers"):
+            scriptFile = gtScripts / "createtables_members.sql"
+            logger.debug(f"Executing {scriptFile}")
+            self._exeScriptFile(scriptFileName=f'{scriptFile}')
+
+        # snapshot databases from before these columns, a table that is not there has nothing to add to
+        for table, column, colType in _ADDED_COLUMNS:
+            if not self._hasTable(table):
+                continue
+            if column not in [r[1] for r in self._exeSQLSelect(f"PRAGMA table_info({table})")]:
+                logger.info(f"Adding column {table}.{column}")
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {colType}")
+                self.conn.commit()
+
+    def _hasTable(self, tableName):
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (tableName,))
+        return c.fetchone()[0] > 0
+
+    def _loadDims(self):
+        """Read the dimension tables into the name to ID caches (internal use only)"""
+        self._dims = {}
+        self._dimNext = {}
+        for table in _DIM_TABLES:
+            rows = self._exeSQLSelect(f"SELECT name, ID FROM {table}")
+            self._dims[table] = dict(rows)
+            self._dimNext[table] = max((r[1] for r in rows), default=0) + 1
+
+    def _dimID(self, table, name, newRows=None):
+        """The ID of a name in a dimension table (internal use only)
+
+        A name that is not in the table yet gets the next ID of the table,
+        when newRows is given, and (ID, name) is added to newRows[table].
+        The caller writes the new rows, see _insertDims(), in the
+        transaction of the key rows that refer to them.
+
+        Args:
+            table (string): one of _DIM_TABLES
+            name (string): server tag, library name, file path, collection name or key
+            newRows (dict, optional): table to the new (ID, name) rows.
+                Defaults to None, only look the name up.
+
+        Returns:
+            [int]: the ID, None when the name is new and newRows is None
+        """
+        if self._dims == None:
+            self._loadDims()
+        ids = self._dims[table]
+        dimID = ids.get(name)
+        if dimID == None and newRows != None:
+            dimID = ids[name] = self._dimNext[table]
+            self._dimNext[table] += 1
+            newRows.setdefault(table, []).append((dimID, name))
+        return dimID
+
+    def _insertDims(self, c, newRows):
+        """Write the new dimension rows of _dimID(), in the open transaction (internal use only)"""
+        for table, rows in newRows.items():
+            c.executemany(f"INSERT INTO {table} (ID, name) VALUES (?, ?)", rows)
+
+    def isInitialized(self):
+        """Check if initDB has already created the tables
+
+        Returns:
+            [bool]: True when the database has the tables
+        """
+        return self._hasTable("t_libkeys")
+
+    def _exeSQLSelect(self, sql, theVals=()):
+        """Run a select type sql. (internal use only)
+
+        Returns:
+            [list]: all the rows
+            Unexpected error will exit app
+        """
+        logger.debug(f"Sql: {sql}")
+        try:
+            c = self.conn.cursor()
+            c.execute(sql, theVals)
+            return c.fetchall()
+        except Exception as e:
+            logger.critical(
+                f"Unexpected error executing sql: {sql}. Values are {theVals} Exception: {e}", exc_info=True)
+            sys.exit(1)
+
+    def getSnapshot(self, server, library):
+        """The saved snapshot of a library for a server tag
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+
+        Returns:
+            [tuple]: (plexServer, lastSync, fields), None if there is no snapshot.
+                fields is comma separated, None for a snapshot of all the keys
+        """
+        rows = self._exeSQLSelect("SELECT plexServer, lastSync, fields FROM t_snapshots WHERE server = ? AND library = ?",
+                                  (server, library))
+        if rows:
+            return rows[0]
+        return None
+
+    def setSnapshot(self, server, library, plexServer, lastSync, fields=None):
+        """Save the snapshot details of a library for a server tag
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+            plexServer (string): name of the plex server the data came from
+            lastSync (int): epoch time of the refresh
+            fields (tuple, optional): library keys saved. Defaults to None, all of them.
+        """
+        sql = "INSERT OR REPLACE INTO t_snapshots (server, library, plexServer, lastSync, fields) VALUES (?, ?, ?, ?, ?)"
+        return self._exeSQLInsert(sql, (server, library, plexServer, lastSync,
+                                        ",".join(fields) if fields != None else None))
+
+    def getCheckpoint(self, server, library):
+        """The checkpoint of an unfinished export of a library for a server tag
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+
+        Returns:
+            [tuple]: (nextStart, plexServer, fields), None if there is no
+                unfinished export. nextStart is the listing offset of the
+                first item that may not be saved
+        """
+        rows = self._exeSQLSelect("SELECT nextStart, plexServer, fields FROM t_checkpoints WHERE server = ? AND library = ?",
+                                  (server, library))
+        if rows:
+            return rows[0]
+        return None
+
+    def clearCheckpoint(self, server, library):
+        """Delete the checkpoint of a library for a server tag, its export is done
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+        """
+        return self._exeSQLInsert("DELETE FROM t_checkpoints WHERE server = ? AND library = ?",
+                                  (server, library))
+
+    def snapshotItems(self, server, library):
+        """The items saved in the snapshot of a library for a server tag
+
+        Returns:
+            [dict]: ratingKey to (filePath, updatedAt)
+        """
+        rows = self._exeSQLSelect("SELECT ratingKey, filePath, updatedAt FROM t_snapitems WHERE server = ? AND library = ?",
+                                  (server, library))
+        return {r[0]: (r[1], r[2]) for r in rows}
+
+    def clearLibrary(self, server, library):
+        """Delete all library items, collections and the snapshot of a library for a server tag
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+        """
+        logger.debug(f"clearing {server} {library}")
+        for sql in (_DIM_DELETE.format(table="t_libkeys"),
+                    _DIM_DELETE.format(table="t_colkeys"),
+                    "DELETE FROM t_snapitems WHERE server = ? AND library = ?",
+                    "DELETE FROM t_snapshots WHERE server = ? AND library = ?",
+                    "DELETE FROM t_checkpoints WHERE server = ? AND library = ?",
+                    "DELETE FROM t_colmembers WHERE server = ? AND library = ?",
+                    "DELETE FROM t_colmembersets WHERE server = ? AND library = ?"):
+            self._exeSQLInsert(sql, (server, library))
+        if self.schema == "wide":
+            self._exeSQLInsert("DELETE FROM t_movies WHERE server = ? AND library = ?",
+                               (server, library))
+        self._diffBuilt = False
+
+    def clearCollections(self, server, library):
+        """Delete the collections and their members of a library for a server tag
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+        """
+        self._exeSQLInsert(_DIM_DELETE.format(table="t_colkeys"), (server, library))
+        for table in ("t_colmembers", "t_colmembersets"):
+            self._exeSQLInsert(f"DELETE FROM {table} WHERE server = ? AND library = ?", (server, library))
+        self._diffBuilt = False
+
+    def rekeyPaths(self, mapPath):
+        """Re-key the snapshot to new universal file paths, in place
+
+        The new path of each snapshot item is computed from the plex
+        location saved with it, and the library items are moved to it
+        with one update per table, nothing is fetched from plex again.
+        Items saved without a location keep their path.
+
+        Args:
+            mapPath (function): plex location to universal file path,
+                i.e. normalize.uFilePath
+
+        Returns:
+            [int]: number of snapshot items with a new path
+        """
+        self.conn.create_function("upath", 1, mapPath)
+        self.conn.create_aggregate("memberhash", 1, _MemberHash)
+        try:
+            c = self.conn.cursor()
+            c.execute("DROP TABLE IF EXISTS temp.t_rekey")
+            c.execute("CREATE TEMP TABLE t_rekey (server TEXT, library TEXT, oldPath TEXT, newPath TEXT, "
+                      "PRIMARY KEY (server, library, oldPath))")
+            c.execute("INSERT OR IGNORE INTO temp.t_rekey (server, library, oldPath, newPath) "
+                      "SELECT server, library, filePath, upath(location) FROM t_snapitems "
+                      "WHERE location IS NOT NULL AND filePath IS NOT upath(location)")
+            rekeyed = c.execute("SELECT count(*) FROM temp.t_rekey").fetchone()[0]
+            # the library keys move to the path IDs of the new paths
+            c.execute("INSERT OR IGNORE INTO t_dim_path (name) SELECT newPath FROM temp.t_rekey")
+            c.execute("CREATE TEMP TABLE t_rekeyids (server_id INTEGER, library_id INTEGER, oldPath_id INTEGER, "
+                      "newPath_id INTEGER, PRIMARY KEY (library_id, oldPath_id, server_id))")
+            c.execute("INSERT INTO temp.t_rekeyids (server_id, library_id, oldPath_id, newPath_id) "
+                      "SELECT s.ID, l.ID, o.ID, n.ID FROM temp.t_rekey AS r "
+                      "JOIN t_dim_server AS s ON s.name = r.server JOIN t_dim_library AS l ON l.name = r.library "
+                      "JOIN t_dim_path AS o ON o.name = r.oldPath JOIN t_dim_path AS n ON n.name = r.newPath")
+            c.execute("UPDATE t_libkeys SET path_id = "
+                      "(SELECT r.newPath_id FROM temp.t_rekeyids AS r WHERE r.library_id = t_libkeys.library_id "
+                      "AND r.oldPath_id = t_libkeys.path_id AND r.server_id = t_libkeys.server_id) "
+                      "WHERE EXISTS (SELECT 1 FROM temp.t_rekeyids AS r WHERE r.library_id = t_libkeys.library_id "
+                      "AND r.oldPath_id = t_libkeys.path_id AND r.server_id = t_libkeys.server_id)")
+            c.execute("DROP TABLE temp.t_rekeyids")
+            if self._hasTable("t_movies"):
+                # two movies mapped to the same path keep the last one, as when they are saved
+                c.execute("UPDATE OR REPLACE t_movies SET filePath = "
+                          "(SELECT r.newPath FROM temp.t_rekey AS r "
+                          "WHERE r.server = t_movies.server AND r.library = t_movies.library AND r.oldPath = t_movies.filePath) "
+                          "WHERE EXISTS (SELECT 1 FROM temp.t_rekey AS r "
+                          "WHERE r.server = t_movies.server AND r.library = t_movies.library AND r.oldPath = t_movies.filePath)")
+            # the collections with a re-keyed member get a new member hash
+            c.execute("CREATE TEMP TABLE t_rekeycols AS SELECT DISTINCT m.server, m.library, m.colname "
+                      "FROM t_colmembers AS m JOIN temp.t_rekey AS r "
+                      "ON r.server = m.server AND r.library = m.library AND r.oldPath = m.member")
+            c.execute("UPDATE OR REPLACE t_colmembers SET member = "
+                      "(SELECT r.newPath FROM temp.t_rekey AS r "
+                      "WHERE r.server = t_colmembers.server AND r.library = t_colmembers.library AND r.oldPath = t_colmembers.member) "
+                      "WHERE EXISTS (SELECT 1 FROM temp.t_rekey AS r "
+                      "WHERE r.server = t_colmembers.server AND r.library = t_colmembers.library AND r.oldPath = t_colmembers.member)")
+            c.execute("INSERT OR REPLACE INTO t_colmembersets (server, library, colname, memberCount, memberHash) "
+                      "SELECT m.server, m.library, m.colname, count(*), memberhash(m.member) "
+                      "FROM t_colmembers AS m JOIN temp.t_rekeycols AS k "
+                      "ON k.server = m.server AND k.library = m.library AND k.colname = m.colname "
+                      "GROUP BY m.server, m.library, m.colname")
+            c.execute("DROP TABLE temp.t_rekeycols")
+            c.execute("UPDATE t_snapitems SET filePath = upath(location) "
+                      "WHERE location IS NOT NULL AND filePath IS NOT upath(location)")
+            noLocation = c.execute("SELECT count(*) FROM t_snapitems WHERE location IS NULL").fetchone()[0]
+            c.execute("DROP TABLE temp.t_rekey")
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.critical(f"Unexpected error re-keying the snapshot paths. Exception: {e}", exc_info=True)
+            sys.exit(1)
+
+        if noLocation:
+            logger.warning(f"{noLocation} snapshot items have no plex location saved and were not re-keyed")
+        logger.info(f"Re-keyed {rekeyed} snapshot items")
+        self._diffBuilt = False
+        self._dims = None
+        return rekeyed
 
     def addLibKeyRec(self, srcRec):
         """Add a record to the Library Key table
@@ -119,10 +647,15 @@ class LocalDB():
         Returns:
             [int]: The primary key id for the added source record
         """
-        sql = "INSERT INTO t_libkeys (server, library, filePath, skey, uKey) VALUES (:server, :libName, :uFilePath, :sKey, :uKey)"
-        theVals = {'server': srcRec.svrName,
-                   'libName': srcRec.libName, 'uFilePath': srcRec.uFilePath, 'sKey': srcRec.sKey, 'uKey': srcRec.uKey}
+        sql = "INSERT INTO t_libkeys (server_id, library_id, path_id, skey_id) VALUES (:server, :libName, :uFilePath, :sKey)"
+        newDims = {}
+        theVals = {'server': self._dimID("t_dim_server", srcRec.svrName, newDims),
+                   'libName': self._dimID("t_dim_library", srcRec.libName, newDims),
+                   'uFilePath': self._dimID("t_dim_path", srcRec.uFilePath, newDims),
+                   'sKey': self._dimID("t_dim_skey", srcRec.sKey, newDims)}
+        self._insertDims(self.conn.cursor(), newDims)
         r = self._exeSQLInsert(sql, theVals)
+        self._diffBuilt = False
 
         # Getting the rowID for the record just added.
         try:
@@ -136,55 +669,350 @@ class LocalDB():
 
         return row[0]
 
+    def batchWriter(self, batchSize=None):
+        """Bulk ingest writer for library and collection records
+
+        Args:
+            batchSize (int, optional): rows buffered before a flush.
+                Defaults to the LocalDB batchSize.
+
+        Returns:
+            [class BatchWriter]: context managed writer for this database
+        """
+        if batchSize == None:
+            batchSize = self.batchSize
+        return BatchWriter(self, batchSize)
+
     def addLibValRec(self, keyRec):
         sql = "INSERT INTO t_libvals (srcKey_id, s_value) VALUES (:srcKey, :sValue)"
         theVals = {'srcKey': keyRec.srckey_id, 'sValue': keyRec.sValue}
         logger.debug(f"adding movie library value record")
         return self._exeSQLInsert(sql, theVals)
 
-    def exportLibDiff(self, oFile):
-        """Export the Library diff query to a csv file
+    def _diffQueries(self):
+        """Materialized diff table name and the query that fills it"""
+        if self.schema == "wide" and self.fields != tuple(MOVIE_COLUMNS):
+            # t_movies has all the columns, only the keys compared are diffed
+            libDiffSql = (_movieDiffSql + " WHERE sKey IN (" + ", ".join(f"'{k}'" for k in self.fields) +
+                          ") ORDER BY library, filePath, sKey")
+        elif self.schema == "wide":
+            libDiffSql = _movieDiffSql
+        else:
+            libDiffSql = _libDiffSql
+        if self.schema == "wide" and self._exeSQLSelect("SELECT 1 FROM t_libkeys LIMIT 1"):
+            libDiffSql = _wideItemDiffSql.format(movieSql=libDiffSql)
+        return {"t_lib_DiffResults": libDiffSql, "t_col_DiffResults": _colDiffSql}
+
+    def buildDiff(self):
+        """Materialize the library and collection diff results
+
+        The diff queries are run once into t_lib_DiffResults and
+        t_col_DiffResults, in export order, so exports only stream rows.
+        Rebuilt by the exports whenever records were added after the last
+        build.
+        """
+        for line in self.checkDiffPlan():
+            logger.warning(f"Diff query plan has a full scan: {line}")
+
+        with metrics.phase("db.diff"):
+            for table, sql in self._diffQueries().items():
+                logger.debug(f"materializing {table}")
+                try:
+                    c = self.conn.cursor()
+                    c.execute(f"DROP TABLE IF EXISTS {table}")
+                    c.execute(f"CREATE TABLE {table} AS {sql}")
+                    c.execute(f"CREATE INDEX ix_{table}_library ON {table} ({_DIFF_LIBRARY[table]})")
+                    self.conn.commit()
+                except Exception as e:
+                    logger.critical(
+                        f"Unexpected error executing sql: {sql}. Exception: {e}", exc_info=True)
+                    sys.exit(1)
+
+        self._diffBuilt = True
+        logger.debug("diff tables built")
+        self.checkSpill()
+
+    def checkDiffPlan(self):
+        """Check the diff queries for full table scans with EXPLAIN QUERY PLAN
+
+        Scans of subqueries (co-routines, materialized views) and scans
+        using an index are fine, any other SCAN reads a whole table.
+
+        Returns:
+            [list]: plan lines with a full table scan, empty when there are none
+        """
+        fullScans = []
+        for table, sql in self._diffQueries().items():
+            try:
+                c = self.conn.cursor()
+                c.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = [row[3] for row in c.fetchall()]
+            except Exception as e:
+                logger.critical(
+                    f"Unexpected error executing sql: {sql}. Exception: {e}", exc_info=True)
+                sys.exit(1)
+
+            logger.debug(f"{table} query plan: {plan}")
+            subQueries = {line.split()[-1] for line in plan
+                          if line.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+            for line in plan:
+                words = line.split()
+                if words[0] != "SCAN" or "USING" in words or "CONSTANT" in words:
+                    continue
+                if words[1] not in subQueries:
+                    fullScans.append(f"{table}: {line}")
+
+        return fullScans
+
+    def _exportDiff(self, sql, oFile, theVals=(), fmt="csv", compress=None):
+        """Stream a diff query to a diff file (internal use only)"""
+        if not self._diffBuilt:
+            self.buildDiff()
+
+        diffout.checkOptions(fmt, compress)
+        with metrics.phase("csv.export"):
+            try:
+                logger.debug(f"executing sql: {sql}")
+                localc = self.conn.cursor()
+                localc.execute(sql, theVals)
+            except Exception as e:
+                logger.critical(
+                    f"Unexpected error executing sql: {sql}. Exception: {e}", exc_info=True)
+                sys.exit(1)
+
+            logger.debug(f"Writing sql results to:  {oFile}")
+            try:
+                rowCount = diffout.writeCursor(localc, oFile, fmt, compress)
+            except OSError as e:
+                logger.critical(f"Unexpected error writing {oFile}. Exception: {e}", exc_info=True)
+                sys.exit(1)
+        metrics.count("export.rows", rowCount)
+        logger.info(f"{oFile}: {rowCount} rows")
+        return rowCount
+
+    def _diffSelect(self, table, columns, library, diffOnly):
+        """The query of a diff table export and its parameters (internal use only)"""
+        sql = f"SELECT {columns} FROM {table}"
+        where = []
+        theVals = ()
+        if library != None:
+            where.append(f"{_DIFF_LIBRARY[table]} = ?")
+            theVals = (library,)
+        if diffOnly:
+            where.append("isDiff <> ''")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return sql + " ORDER BY rowid", theVals
+
+    def exportLibDiff(self, oFile, library=None, diffOnly=False, fmt="csv", compress=None):
+        """Export the Library diff results to a csv file
+
+        The wide schema only reports the keys that are different.
 
         Args:
             oFile (string): File name for the csv file
+            library (string, optional): only this library. Defaults to None, all of them.
+            diffOnly (bool, optional): only the keys that are different. Defaults to False.
+            fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+            compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
+
+        Returns:
+            [int]: number of rows written
         """
         logger.debug(f"oFile={oFile}")
+        sql, theVals = self._diffSelect("t_lib_DiffResults", "library, filePath, sKey, server1_VAL, server2_VAL, isDiff",
+                                        library, diffOnly)
+        return self._exportDiff(sql, oFile, theVals, fmt, compress)
 
-        sql = "SELECT library, filePath, skey, server1_val, server2_val, isDiff FROM v_lib_DiffResults"
+    def exportColDiff(self, oFile, library=None, diffOnly=False, fmt="csv", compress=None):
+        """Export the Collection diff results to a csv file
 
-        try:
-            logger.debug(f"executing sql: {sql}")
-            localc = self.conn.cursor()
-            localc.execute(sql)
+        Args:
+            oFile (string): File name for the csv file
+            library (string, optional): only this library. Defaults to None, all of them.
+            diffOnly (bool, optional): only the keys that are different. Defaults to False.
+            fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+            compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
 
-        except Exception as e:
-            logger.critical(
-                f"Unexpected error executing sql: {sql}. Values are {theVals} Exception: {e}", exc_info=True)
-            sys.exit(1)
+        Returns:
+            [int]: number of rows written
+        """
+        logger.debug(f"oFile={oFile}")
+        sql, theVals = self._diffSelect("t_col_DiffResults",
+                                        "libname AS library, colname, sKey, server1_VAL, server2_VAL, isDiff",
+                                        library, diffOnly)
+        return self._exportDiff(sql, oFile, theVals, fmt, compress)
+
+    def exportMemberDiff(self, oFile, library=None, fmt="csv", compress=None):
+        """Export the collection members only on one of the servers to a csv file
 
-        logger.debug(f"Writing sql results to:  {oFile}")
-        with open(oFile, "w", newline='') as csv_file:
-            csv_writer = csv.writer(csv_file, dialect='excel')
-            csv_writer.writerow([i[0] for i in localc.description])
-            csv_writer.writerows(localc)
+        Only the collections whose member sets are different are looked
+        at, by the hash of their members. Each row is a member path with
+        the status `only server1` or `only server2`.
+
+        Args:
+            oFile (string): File name for the csv file
+            library (string, optional): only this library. Defaults to None, all of them.
+            fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+            compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
 
-    def exportColDiff(self, oFile):
+        Returns:
+            [int]: number of rows written
+        """
         logger.debug(f"oFile={oFile}")
-        sql = "select libname as library, colname, skey, server1_val, server2_val, isdiff FROM v_col_DiffResults"
+        if library != None:
+            sql = _memberDiffSql.format(library1="AND s1.library = ?", library2="AND s2.library = ?")
+            return self._exportDiff(sql, oFile, (library, library), fmt, compress)
+        return self._exportDiff(_memberDiffSql.format(library1="", library2=""), oFile, (), fmt, compress)
+
+    def unmatchedItems(self, library, sKeys=("guid", "Title", "Year")):
+        """The library items only on server1 and only on server2
+
+        Read from the library diff results, built when they are not
+        current, where a missing item has a row for each of its keys.
+
+        Args:
+            library (string): library name
+            sKeys (tuple, optional): keys read. Defaults to guid, Title and Year.
+
+        Returns:
+            [tuple]: (only1, only2), dicts of filePath to {sKey: value}
+        """
+        if not self._diffBuilt:
+            self.buildDiff()
+        rows = self._exeSQLSelect("SELECT filePath, sKey, server1_VAL, server2_VAL FROM t_lib_DiffResults "
+                                  "WHERE library = ? AND (server1_VAL = ? OR server2_VAL = ?) ORDER BY rowid",
+                                  (library, _VALUE_MISSING, _VALUE_MISSING))
+        only1 = {}
+        only2 = {}
+        for filePath, sKey, val1, val2 in rows:
+            if val1 == _VALUE_MISSING:
+                keyVals, value = only2.setdefault(filePath, {}), val2
+            else:
+                keyVals, value = only1.setdefault(filePath, {}), val1
+            if sKey in sKeys:
+                keyVals[sKey] = None if value == _NULL_VALUE else value
+        return only1, only2
+
+    def _matrixItems(self, kind, tags):
+        """One ordered scan of the items of the servers (internal use only)
+
+        Yields:
+            tuple: (library, item, {server tag: {sKey: value}}) for each
+                library item (filePath) or collection (colname)
+        """
+        marks = ", ".join("?" for t in tags)
+        if kind == "col":
+            sql = ("SELECT k.libname, k.colname, k.svrname, k.sKey, v.s_value FROM v_colkeys AS k "
+                   "LEFT JOIN t_colvals AS v ON v.colkey_id = k.ID "
+                   f"WHERE k.svrname IN ({marks}) ORDER BY k.libname, k.colname")
+        elif self.schema == "wide":
+            cols = ", ".join(MOVIE_COLUMNS[k] for k in self.fields)
+            sql = f"SELECT library, filePath, server, {cols} FROM t_movies WHERE server IN ({marks}) ORDER BY library, filePath"
+        else:
+            sql = ("SELECT k.library, k.filePath, k.server, k.sKey, v.s_value FROM v_libkeys AS k "
+                   "LEFT JOIN t_libvals AS v ON v.srckey_id = k.ID "
+                   f"WHERE k.server IN ({marks}) ORDER BY k.library, k.filePath")
         try:
             logger.debug(f"executing sql: {sql}")
-            localc = self.conn.cursor()
-            localc.execute(sql)
+            c = self.conn.cursor()
+            c.execute(sql, tuple(tags))
         except Exception as e:
             logger.critical(
-                f"Unexpected error executing sql: {sql}. Values are {theVals} Exception: {e}", exc_info=True)
+                f"Unexpected error executing sql: {sql}. Exception: {e}", exc_info=True)
             sys.exit(1)
 
-        logger.debug(f"Writing sql results to:  {oFile}")
-        with open(oFile, "w", newline='') as csv_file:
-            csv_writer = csv.writer(csv_file, dialect='excel')
-            csv_writer.writerow([i[0] for i in localc.description])
-            csv_writer.writerows(localc)
+        wide = kind == "lib" and self.schema == "wide"
+        for (library, item), rows in groupby(c, key=lambda r: (r[0], r[1])):
+            byTag = {}
+            for r in rows:
+                if wide:
+                    # one row per movie and server, with all the fields
+                    byTag[r[2]] = dict(zip(self.fields, r[3:]))
+                else:
+                    byTag.setdefault(r[2], {})[r[3]] = r[4]
+            yield library, item, byTag
+
+    def _exportMatrix(self, kind, oFile, servers, reference, itemCol, fmt="csv", compress=None):
+        """Write the N-way matrix of a scan to a diff file (internal use only)"""
+        tags = [tag for tag, name in servers]
+        if reference != None and reference not in tags:
+            logger.critical(f"Reference server {reference} is not one of {tags}")
+            sys.exit(1)
+
+        diffout.checkOptions(fmt, compress)
+        rowCount = 0
+        with metrics.phase("db.matrix"), diffout.openText(oFile, compress) as textFile:
+            csv_writer = diffout.DiffWriter(textFile, ["library", itemCol, "sKey"] + [name for tag, name in servers] +
+                                            ["expected", "disagree"], fmt)
+            for library, item, byTag in self._matrixItems(kind, tags):
+                keyVals = list(byTag.values())
+                if len(keyVals) == len(tags) and all(kv == keyVals[0] for kv in keyVals):
+                    # the same on all the servers
+                    continue
+                for sKey in sorted({k for kv in keyVals for k in kv}):
+                    values = []
+                    for tag in tags:
+                        kv = byTag.get(tag)
+                        if kv == None or sKey not in kv:
+                            values.append(_VALUE_MISSING)
+                        else:
+                            values.append(_NULL_VALUE if kv[sKey] == None else kv[sKey])
+                    if reference != None:
+                        expected = values[tags.index(reference)]
+                    else:
+                        # the first server's value wins a tie
+                        counts = {}
+                        for value in values:
+                            counts[value] = counts.get(value, 0) + 1
+                        expected = max(values, key=counts.get)
+                    disagree = [name for (tag, name), value in zip(servers, values) if value != expected]
+                    if disagree:
+                        csv_writer.writerow([library, item, sKey] + values + [expected, ";".join(disagree)])
+                        rowCount += 1
+        logger.info(f"{rowCount} keys with servers that disagree written to {oFile}")
+        return rowCount
+
+    def exportLibMatrix(self, oFile, servers, reference=None, fmt="csv", compress=None):
+        """Export the N-way library comparison of several servers to a csv file
+
+        All the servers are compared at once, in one scan of the library
+        items ordered by file path. Each key of each movie is compared to
+        the majority value of the servers, or to the value of a reference
+        server, and only the keys some server disagrees on are written,
+        with a column for the value of each server.
+
+        Args:
+            oFile (string): File name for the csv file
+            servers (list): (server tag, server name) of each server, the
+                csv column order
+            reference (string, optional): server tag of the reference
+                server. Defaults to None, the majority.
+            fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+            compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
+
+        Returns:
+            [int]: number of rows written
+        """
+        return self._exportMatrix("lib", oFile, servers, reference, "filePath", fmt, compress)
+
+    def exportColMatrix(self, oFile, servers, reference=None, fmt="csv", compress=None):
+        """Export the N-way collection comparison of several servers to a csv file
+
+        Same as exportLibMatrix() for the collections.
+
+        Args:
+            oFile (string): File name for the csv file
+            servers (list): (server tag, server name) of each server
+            reference (string, optional): server tag of the reference
+                server. Defaults to None, the majority.
+            fmt (string, optional): csv or jsonl, see diffout.FORMATS. Defaults to csv.
+            compress (string, optional): gzip, bz2 or xz, see diffout.COMPRESSIONS. Defaults to None.
+
+        Returns:
+            [int]: number of rows written
+        """
+        return self._exportMatrix("col", oFile, servers, reference, "colname", fmt, compress)
 
     def addColKeyRec(self, keyRec):
         """Add a record to the Collection keys table
@@ -196,12 +1024,17 @@ class LocalDB():
             [int]: The primary key id for the added key record
         """
         pass
-        sql = "INSERT INTO t_colkeys (svrName, libName, colName, sKey, uKey) VALUES (:svrName, :libName, :colName, :sKey, :uKey)"
-        theVals = {'svrName': keyRec.svrName, 'libName': keyRec.libName,
-                   'colName': keyRec.colName, "sKey": keyRec.sKey, "uKey": keyRec.uKey}
+        sql = "INSERT INTO t_colkeys (server_id, library_id, colname_id, skey_id) VALUES (:svrName, :libName, :colName, :sKey)"
+        newDims = {}
+        theVals = {'svrName': self._dimID("t_dim_server", keyRec.svrName, newDims),
+                   'libName': self._dimID("t_dim_library", keyRec.libName, newDims),
+                   'colName': self._dimID("t_dim_colname", keyRec.colName, newDims),
+                   "sKey": self._dimID("t_dim_skey", keyRec.sKey, newDims)}
+        self._insertDims(self.conn.cursor(), newDims)
 
         logger.debug(f"adding collection key record : {theVals}, ")
         r = self._exeSQLInsert(sql, theVals)
+        self._diffBuilt = False
         # Getting the rowID for the record just added.
         try:
             xcursor = self.conn.cursor()
@@ -223,6 +1056,290 @@ class LocalDB():
         return self._exeSQLInsert(sql, theVals)
 
 
+class BatchWriter():
+    """Buffers key/value records and writes them with executemany
+
+    Each flush writes the buffered key and value rows in a single
+    transaction. Key IDs are assigned here instead of asking the database
+    for last_insert_rowid() after every row, which is safe as long as this
+    writer is the only one adding rows while it is open. The server,
+    library, path, collection and key names are interned in the dimension
+    tables, new names are written with the rows of the flush.
+
+    Usage:
+        with dbObj.batchWriter() as bw:
+            bw.addLibItem(srcKey, {"Title": "A Movie", "Year": 2001})
+    """
+    _libKeySql = "INSERT INTO t_libkeys (ID, server_id, library_id, path_id, skey_id) VALUES (?, ?, ?, ?, ?)"
+    _libValSql = "INSERT INTO t_libvals (srcKey_id, s_value) VALUES (?, ?)"
+    _colKeySql = "INSERT INTO t_colkeys (ID, server_id, library_id, colname_id, skey_id) VALUES (?, ?, ?, ?, ?)"
+    _colValSql = "INSERT INTO t_colvals (colkey_id, s_value) VALUES (?, ?)"
+    _movieSql = (f"INSERT OR REPLACE INTO t_movies (server, library, filePath, {', '.join(MOVIE_COLUMNS.values())}) "
+                 f"VALUES (?, ?, ?{', ?' * len(MOVIE_COLUMNS)})")
+    _libDelSql = "DELETE FROM t_libkeys WHERE library_id = ? AND path_id = ? AND server_id = ?"
+    _movieDelSql = "DELETE FROM t_movies WHERE server = ? AND library = ? AND filePath = ?"
+    _snapSql = ("INSERT OR REPLACE INTO t_snapitems (server, library, ratingKey, filePath, updatedAt, addedAt, location) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    _snapDelSql = "DELETE FROM t_snapitems WHERE server = ? AND library = ? AND ratingKey = ?"
+    _memberSql = "INSERT OR IGNORE INTO t_colmembers (server, library, colname, member) VALUES (?, ?, ?, ?)"
+    _memberSetSql = ("INSERT OR REPLACE INTO t_colmembersets (server, library, colname, memberCount, memberHash) "
+                     "VALUES (?, ?, ?, ?, ?)")
+    _checkpointSql = ("INSERT OR REPLACE INTO t_checkpoints (server, library, plexServer, fields, nextStart, updatedAt) "
+                      "VALUES (?, ?, ?, ?, ?, ?)")
+
+    def __init__(self, dbObj, batchSize=5000):
+        """
+        Args:
+            dbObj (class LocalDB): database the records are written to
+            batchSize (int, optional): rows buffered before a flush.
+        """
+        self.dbObj = dbObj
+        self.batchSize = max(int(batchSize), 1)
+        self.rowCount = 0
+        self.elapsed = 0.0
+        self._libRecs = []
+        self._colRecs = []
+        self._movieRecs = []
+        self._libDels = []
+        self._snapRecs = []
+        self._snapDels = []
+        self._memberRecs = []
+        self._memberSets = []
+        self._checkpoints = {}
+        self._dimRecs = {}
+        self._startTime = None
+
+    def __enter__(self):
+        self._startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        if excType is None:
+            self.flush()
+        else:
+            logger.warning(
+                f"Discarding {self._buffered} unflushed rows after error: {excVal}")
+            self._clear()
+            self.dbObj.conn.rollback()
+            self.dbObj._dims = None
+
+        self.elapsed = time.perf_counter() - self._startTime
+        logger.info(
+            f"BatchWriter wrote {self.rowCount} rows in {self.elapsed:.2f}s ({self.rowsPerSec:.0f} rows/sec)")
+        return False
+
+    @property
+    def rowsPerSec(self):
+        """Rows written per second since the writer was opened"""
+        if self._startTime == None:
+            return 0.0
+        elapsed = self.elapsed or (time.perf_counter() - self._startTime)
+        if elapsed <= 0:
+            return 0.0
+        return self.rowCount / elapsed
+
+    @property
+    def _buffered(self):
+        return (len(self._libRecs) + len(self._colRecs) + len(self._movieRecs) +
+                len(self._libDels) + len(self._snapRecs) + len(self._snapDels) +
+                len(self._memberRecs) + len(self._memberSets))
+
+    def _clear(self):
+        self._libRecs = []
+        self._colRecs = []
+        self._movieRecs = []
+        self._libDels = []
+        self._snapRecs = []
+        self._snapDels = []
+        self._memberRecs = []
+        self._memberSets = []
+        self._checkpoints = {}
+        self._dimRecs = {}
+
+    def deleteLibItem(self, srcKey, movie=True):
+        """Buffer the delete of all the keys of one library item
+
+        Deletes are written before the adds of the same flush.
+
+        Args:
+            srcKey (class LibSrcKey): The library item, sKey is not used
+            movie (bool, optional): a movie, as addLibItem(). Defaults to True.
+        """
+        self._libDels.append((srcKey.svrName, srcKey.libName, srcKey.uFilePath, movie))
+        if self._buffered >= self.batchSize:
+            self.flush()
+
+    def addSnapItem(self, server, library, ratingKey, uFilePath, updatedAt, addedAt, location=None):
+        """Buffer the snapshot record of a library item
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+            ratingKey (string): plex ratingKey of the item
+            uFilePath (string): universal file path the item is saved under
+            updatedAt (int): epoch time plex last updated the item
+            addedAt (int): epoch time the item was added to plex
+            location (string, optional): plex location the uFilePath is from
+        """
+        self._snapRecs.append((server, library, ratingKey, uFilePath, updatedAt, addedAt, location))
+        if self._buffered >= self.batchSize:
+            self.flush()
+
+    def deleteSnapItem(self, server, library, ratingKey):
+        """Buffer the delete of the snapshot record of a library item"""
+        self._snapDels.append((server, library, ratingKey))
+        if self._buffered >= self.batchSize:
+            self.flush()
+
+    def setCheckpoint(self, server, library, nextStart, plexServer, fields=None):
+        """Buffer the checkpoint of an export, written after the rows buffered before it
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+            nextStart (int): listing offset of the items not buffered yet
+            plexServer (string): name of the plex server exported
+            fields (string, optional): comma separated library keys saved. Defaults to None, all of them.
+        """
+        self._checkpoints[(server, library)] = (server, library, plexServer, fields, nextStart, int(time.time()))
+
+    def addLibItem(self, srcKey, keyVals, movie=True):
+        """Buffer all the key/values of one library item
+
+        The eav schema gets one key/value record per key, the wide schema
+        a single t_movies row for a movie.
+
+        Args:
+            srcKey (class LibSrcKey): The library key record, sKey is not used
+            keyVals (dict): sKey to value, keys are from MOVIE_COLUMNS for a movie
+            movie (bool, optional): a movie, other items (episodes, tracks)
+                are key/value records in both schemas. Defaults to True.
+        """
+        if self.dbObj.schema == "wide" and movie:
+            self._movieRecs.append((srcKey.svrName, srcKey.libName, srcKey.uFilePath) +
+                                   tuple(keyVals.get(k) for k in MOVIE_COLUMNS))
+            if self._buffered >= self.batchSize:
+                self.flush()
+            return
+
+        itemIDs = self._itemIDs(srcKey.svrName, srcKey.libName, "t_dim_path", srcKey.uFilePath)
+        dimID = self.dbObj._dimID
+        self._libRecs.extend(itemIDs + (dimID("t_dim_skey", sKey, self._dimRecs), sValue)
+                             for sKey, sValue in keyVals.items())
+        if self._buffered >= self.batchSize:
+            self.flush()
+
+    def _itemIDs(self, server, library, itemTable, item):
+        """(server_id, library_id, item ID) of a library item or collection, names interned (internal use only)"""
+        dimID = self.dbObj._dimID
+        return (dimID("t_dim_server", server, self._dimRecs), dimID("t_dim_library", library, self._dimRecs),
+                dimID(itemTable, item, self._dimRecs))
+
+    def addColItem(self, colKey, keyVals):
+        """Buffer all the key/values of one collection
+
+        Args:
+            colKey (class ColKey): The collection key record, sKey is not used
+            keyVals (dict): sKey to value
+        """
+        itemIDs = self._itemIDs(colKey.svrName, colKey.libName, "t_dim_colname", colKey.colName)
+        dimID = self.dbObj._dimID
+        self._colRecs.extend(itemIDs + (dimID("t_dim_skey", sKey, self._dimRecs), sValue)
+                             for sKey, sValue in keyVals.items())
+        if self._buffered >= self.batchSize:
+            self.flush()
+
+    def addColMembers(self, server, library, colName, members):
+        """Buffer the members of one collection, and the hash of the member set
+
+        Args:
+            server (string): server tag, i.e. server1
+            library (string): library name
+            colName (string): collection name
+            members (iterable): universal file paths of the member movies
+        """
+        members = set(members)
+        self._memberRecs.extend((server, library, colName, m) for m in members)
+        self._memberSets.append((server, library, colName, len(members), memberHash(members)))
+        if self._buffered >= self.batchSize:
+            self.flush()
+
+    def _nextID(self, c, table):
+        c.execute(f"SELECT coalesce(max(ID), 0) FROM {table}")
+        return c.fetchone()[0] + 1
+
+    def flush(self):
+        """Write all buffered rows in one transaction"""
+        rows = self._buffered
+        if rows == 0 and not self._checkpoints:
+            return
+
+        logger.debug(f"flushing {rows} buffered rows")
+        with metrics.phase("db.flush"):
+            try:
+                c = self.dbObj.conn.cursor()
+                if self._dimRecs:
+                    self.dbObj._insertDims(c, self._dimRecs)
+                if self._libDels:
+                    wide = self.dbObj.schema == "wide"
+                    if wide:
+                        c.executemany(self._movieDelSql, [d[:3] for d in self._libDels if d[3]])
+                    # t_libvals rows are removed by the ON DELETE CASCADE,
+                    # an item with a name that is not interned has no keys
+                    dimID = self.dbObj._dimID
+                    keyDels = []
+                    for svrName, libName, uFilePath, movie in self._libDels:
+                        if wide and movie:
+                            continue
+                        ids = (dimID("t_dim_library", libName), dimID("t_dim_path", uFilePath),
+                               dimID("t_dim_server", svrName))
+                        if None not in ids:
+                            keyDels.append(ids)
+                    c.executemany(self._libDelSql, keyDels)
+                if self._snapDels:
+                    c.executemany(self._snapDelSql, self._snapDels)
+                if self._libRecs:
+                    firstID = self._nextID(c, "t_libkeys")
+                    c.executemany(self._libKeySql, [(firstID + i,) + r[:4]
+                                                    for i, r in enumerate(self._libRecs)])
+                    c.executemany(self._libValSql, [(firstID + i, r[4])
+                                                    for i, r in enumerate(self._libRecs)])
+                if self._colRecs:
+                    firstID = self._nextID(c, "t_colkeys")
+                    c.executemany(self._colKeySql, [(firstID + i,) + r[:4]
+                                                    for i, r in enumerate(self._colRecs)])
+                    c.executemany(self._colValSql, [(firstID + i, r[4])
+                                                    for i, r in enumerate(self._colRecs)])
+                if self._movieRecs:
+                    c.executemany(self._movieSql, self._movieRecs)
+                if self._snapRecs:
+                    c.executemany(self._snapSql, self._snapRecs)
+                if self._memberRecs:
+                    c.executemany(self._memberSql, self._memberRecs)
+                if self._memberSets:
+                    c.executemany(self._memberSetSql, self._memberSets)
+                if self._checkpoints:
+                    c.executemany(self._checkpointSql, list(self._checkpoints.values()))
+                self.dbObj.conn.commit()
+                self.dbObj._diffBuilt = False
+                self.dbObj.checkSpill()
+
+            except sqlite3.IntegrityError as e:
+                # nothing of the batch is written, its checkpoints included, so a resume refetches it
+                self.dbObj.conn.rollback()
+                logger.critical(
+                    f"sqlite integrity error flushing {rows} rows, none were written: {e.args[0]}", exc_info=True)
+                sys.exit(1)
+            except Exception as e:
+                logger.critical(
+                    f"Unexpected error flushing {rows} rows. Exception: {e}", exc_info=True)
+                sys.exit(1)
+
+        self.rowCount += rows
+        metrics.count("db.rows", rows)
+        self._clear()
+
+
 class LibSrcKey():
     def __init__(self):
         self.svrName = ""
@@ -230,16 +1347,6 @@ class LibSrcKey():
         self.uFilePath = ""
         self.sKey = ""
 
-    @property
-    def uKey(self):
-        # Returns unique key created by
-        # returning md5 hexdigest of the combined:
-        #  - Library Name (libname)
-        #  - Universal File Path (uFilePath)
-        #  - Key (sKey)
-        str2hash = self.libName + self.uFilePath + self.sKey
-        return hashlib.md5(str2hash.encode()).hexdigest()
-
 
 class LibKeyVal():
     def __init__(self):
@@ -257,16 +1364,6 @@ class ColKey():
         self.colName = ""
         self.sKey = ""
 
-    @property
-    def uKey(self):
-        # Returns unique key created by
-        # returning md5 hexdigest of the combined:
-        #  - Library Name (libname)
-        #  - Collection Name (colName)
-        #  - Key (sKey)
-        str2hash = self.libName + self.colName + self.sKey
-        return hashlib.md5(str2hash.encode()).hexdigest()
-
 
 class ColKeyVal():
     def __init__(self):
@@ -0,0 +1,218 @@
+# Record and replay of the plex http responses, for runs without network
+import os
+import sys
+import json
+import time
+import logging
+import zipfile
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger("transport")
+
+# Name of the index in the archive
+INDEX_NAME = "index.json"
+
+# Request details that are not part of the key, they change on every run
+# or are secret
+_IGNORED_PARAMS = ("x-plex-token",)
+_KEY_HEADERS = ("X-Plex-Container-Start", "X-Plex-Container-Size")
+
+
+def requestKey(request):
+    """Key a request is recorded and replayed under
+
+    The method, the url without the plex token (query parameters sorted)
+    and the plex container (paging) headers.
+
+    Args:
+        request (requests.PreparedRequest): the request
+
+    Returns:
+        string: the key
+    """
+    scheme, netloc, path, query, fragment = urlsplit(request.url)
+    params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+                    if k.lower() not in _IGNORED_PARAMS)
+    key = f"{request.method} {urlunsplit((scheme, netloc, path, urlencode(params), ''))}"
+    for header in _KEY_HEADERS:
+        if request.headers.get(header) != None:
+            key += f" {header}={request.headers[header]}"
+    return key
+
+
+class Recorder():
+    """Records every http response received through requests
+
+    The responses are written to a zip archive (deflate compressed) when
+    the recorder is stopped, with an index of the request keys.
+    The archive has the plex account details, i.e. the tokens, and is only
+    readable by the user.
+
+    Usage:
+        with Recorder("run.zip"):
+            plexAcct = MyPlexAccount(userName, userPass)
+            ...
+    """
+
+    def __init__(self, archivePath):
+        """
+        Args:
+            archivePath (string): zip archive written by stop()
+        """
+        self.archivePath = str(archivePath)
+        self._index = {}
+        self._bodies = []
+        self._lock = threading.Lock()
+        self._send = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        self.stop()
+        return False
+
+    def start(self):
+        """Start recording all the requests sessions"""
+        self._send = HTTPAdapter.send
+        recorder = self
+
+        def send(adapter, request, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = recorder._send(adapter, request, **kwargs)
+            except requests.exceptions.RequestException as err:
+                recorder._add(request, {"error": type(err).__name__, "message": str(err),
+                                        "elapsed": time.perf_counter() - start}, None)
+                raise
+            # reads the body, plexapi does not stream
+            content = response.content
+            recorder._add(request, {"status": response.status_code, "reason": response.reason,
+                                    "headers": dict(response.headers),
+                                    "elapsed": time.perf_counter() - start}, content)
+            return response
+
+        HTTPAdapter.send = send
+        logger.info(f"Recording plex responses to {self.archivePath}")
+
+    def _add(self, request, entry, content):
+        key = requestKey(request)
+        with self._lock:
+            if content != None:
+                entry["body"] = f"responses/{len(self._bodies):06d}"
+                self._bodies.append((entry["body"], content))
+            self._index.setdefault(key, []).append(entry)
+        logger.debug(f"recorded {key}")
+
+    def stop(self):
+        """Stop recording and write the archive"""
+        if self._send == None:
+            return
+        HTTPAdapter.send = self._send
+        self._send = None
+        with self._lock:
+            # created only readable by the user, it has the tokens
+            fd = os.open(self.archivePath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for name, content in self._bodies:
+                    zf.writestr(name, content)
+                zf.writestr(INDEX_NAME, json.dumps(self._index, indent=1, sort_keys=True))
+        logger.info(f"Recorded {len(self._bodies)} plex responses to {self.archivePath}")
+
+
+class Replayer():
+    """Serves the http responses of a Recorder archive, nothing is sent
+
+    The responses of a request key are served in the order they were
+    recorded, the last one is served again when there are more requests.
+    A request that was not recorded fails with a ConnectionError, like an
+    unreachable server.
+
+    Usage:
+        with Replayer("run.zip"):
+            plexAcct = MyPlexAccount(userName, "")
+            ...
+    """
+
+    def __init__(self, archivePath):
+        """
+        Args:
+            archivePath (string): zip archive written by a Recorder
+        """
+        self.archivePath = str(archivePath)
+        self._zip = None
+        self._index = {}
+        self._served = {}
+        self._lock = threading.Lock()
+        self._send = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        self.stop()
+        return False
+
+    def start(self):
+        """Serve all the requests sessions from the archive"""
+        try:
+            self._zip = zipfile.ZipFile(self.archivePath)
+            self._index = json.loads(self._zip.read(INDEX_NAME))
+        except Exception as err:
+            logger.critical(f"Cannot read the replay archive {self.archivePath}: {err}", exc_info=True)
+            sys.exit(1)
+        self._served = {}
+        self._send = HTTPAdapter.send
+        replayer = self
+
+        def send(adapter, request, **kwargs):
+            return replayer._response(adapter, request)
+
+        HTTPAdapter.send = send
+        logger.info(f"Replaying plex responses from {self.archivePath}")
+
+    def _response(self, adapter, request):
+        key = requestKey(request)
+        with self._lock:
+            entries = self._index.get(key)
+            if not entries:
+                logger.warning(f"Not recorded: {key}")
+                raise requests.exceptions.ConnectionError(f"Not recorded in {self.archivePath}: {key}", request=request)
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            entry = entries[min(served, len(entries) - 1)]
+            content = self._zip.read(entry["body"]) if "body" in entry else None
+        logger.debug(f"replayed {key}")
+
+        if "error" in entry:
+            errType = getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)
+            raise errType(entry["message"], request=request)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        # the recorded body is already decoded
+        response.headers.pop("Content-Encoding", None)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        return response
+
+    def stop(self):
+        """Stop serving from the archive"""
+        if self._send == None:
+            return
+        HTTPAdapter.send = self._send
+        self._send = None
+        self._zip.close()
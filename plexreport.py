@@ -1,5 +1,4 @@
 import sys
-import getpass
 import logging.config
 import yaml
 import argparse
@@ -10,7 +9,9 @@ from datetime import datetime
 from plexinfo import sqlitedb as mydb
 from plexinfo import plexutils as myutil
 from plexinfo import appconfig as appcfg
-from plexapi.myplex import MyPlexAccount
+from plexinfo import normalize
+from plexinfo import metrics
+from plexinfo import conncache
 
 logger = logging.getLogger("PlexReport")
 
@@ -32,27 +33,17 @@ def main(args):
         logger.debug(f"loading config file: {cfgFile}")
         appcfg.loadCfg(cfgFile)
         logger.info(f"Config file loaded: {cfgFile}")
-        logger.debug(f"config section [main]: {appcfg.sec_main}")
+        logger.debug(f"config section [compare]: {appcfg.sec_compare}")
     else:
         logger.debug(f"config file {cfgFile} not found")
+    normalize.setPathMap(normalize.PathMap(appcfg.sec_pathmap))
 
-    logger.debug(f"getpass from user {args.userName}")
-    userPass = getpass.getpass(
-        prompt=f"Enter {args.userName}'s Plex Password: ")
-    msg = f"Authenticating {args.userName}"
-    print(msg)
-    logger.info(f"{msg}")
-    try:
-        plexAcct = MyPlexAccount(args.userName, userPass)
-    except Exception as err:
-        logger.critical(f"Error:  {err}", exc_info=True)
-        sys.exit()
-
-    logger.info(f"username: {args.userName} authenticated.")
+    cache = conncache.fromConfig(appcfg.sec_server, appcfg.sec_paths['data'], args.userName)
 
     ###################################################
     dbFile = ":memory:"
-    db1 = mydb.LocalDB(dbLoc=dbFile)
+    fields = normalize.parseFields(appcfg.sec_compare.get("fields"))
+    db1 = mydb.LocalDB(dbLoc=dbFile, fields=fields)
     db1.initDB(plexScripts)
     print("-"*70)
     ############################################################
@@ -60,37 +51,36 @@ def main(args):
     msg = f"Connecting to servers"
     print(msg)
     logger.info(f"{msg}")
-    plexServer1 = myutil.connectPlexServer(plexAcct, args.server1)
-
-    msg = f"{args.server1} - Connected"
-    print(msg)
-    logger.info(f"{msg}")
-
-    plexServer2 = myutil.connectPlexServer(plexAcct, args.server2)
-    msg = f"{args.server2} - Connected"
-    print(msg)
-    logger.info(f"{msg}")
+    plexServer1, plexServer2 = myutil.connectPlexServers(
+        lambda: myutil.plexAccount(args.userName, cache=cache), [args.server1, args.server2], cache)
+    for svrName in [args.server1, args.server2]:
+        msg = f"{svrName} - Connected"
+        print(msg)
+        logger.info(f"{msg}")
 
     ############################################################
-    # Reporting on Collection differences
-
+    # Exporting collections and movies from both servers
     print()
-    maxItems = int(appcfg.sec_main.get("collectionmax", 0))
-    if maxItems != 0:
-        msg = f"--OVERRIDE Max collections = {maxItems}"
+    colMax = int(appcfg.sec_compare.get("collectionmax", 0))
+    if colMax != 0:
+        msg = f"--OVERRIDE Max collections = {colMax}"
         print(msg)
         logger.info(msg)
 
-    print(f"{args.server1}: Exporting collection data from movie library section : {args.secName}")
-    xmovLib = plexServer1.library.section(args.secName)
-    myutil.collection2Db(
-        db1, xmovLib, dbSvrNameTag='server1', maxItems=maxItems)
+    movieMax = int(appcfg.sec_compare.get("moviemax", 0))
+    if movieMax != 0:
+        msg = f"--OVERRIDE Max movies = {movieMax}"
+        print(msg)
+        logger.info(msg)
 
-    print(f"{args.server2}: Exporting collection data from movie library section : {args.secName}")
-    xmovLib = plexServer2.library.section(args.secName)
-    myutil.collection2Db(
-        db1, xmovLib, dbSvrNameTag='server2', maxItems=maxItems)
+    print(f"{args.server1}, {args.server2}: Exporting collection and movie data from movie library section : {args.secName}")
+    myutil.exportServers(db1, [('server1', plexServer1), ('server2', plexServer2)], args.secName,
+                         movieMax=movieMax, colMax=colMax,
+                         containerSize=int(appcfg.sec_compare.get("containersize", myutil.CONTAINER_SIZE)),
+                         fields=fields)
 
+    ############################################################
+    # Reporting on Collection differences
     csvFilename = f"{args.secName}_collections_{now.strftime('%Y-%m-%d-%H%M')}.csv"
     if args.dirSave == None:
         collectionCSVFile = Path.cwd() / csvFilename
@@ -99,25 +89,17 @@ def main(args):
 
     print(f"Creating Collection Diff file {collectionCSVFile}")
     db1.exportColDiff(collectionCSVFile)
-    ############################################################
-    # Reporting on movie differences
-    print()
-    maxItems = int(appcfg.sec_main.get("moviemax", 0))
-    if maxItems != 0:
-        msg = f"--OVERRIDE Max movies = {maxItems}"
-        print(msg)
-        logger.info(msg)
-
-    print(f"{args.server1}: Exporting movie data from movie library section : {args.secName}")
-    xmovLib = plexServer1.library.section(args.secName)
-    myutil.movieLib2Db(db1, xmovLib, 'server1',
-                       maxItems=maxItems)
 
-    print(f"{args.server2}: Exporting movie data from movie library section : {args.secName}")
-    xmovLib = plexServer2.library.section(args.secName)
-    myutil.movieLib2Db(db1, xmovLib, 'server2',
-                       maxItems=maxItems)
+    csvFilename = f"{args.secName}_members_{now.strftime('%Y-%m-%d-%H%M')}.csv"
+    if args.dirSave == None:
+        memberCSVFile = Path.cwd() / csvFilename
+    else:
+        memberCSVFile = Path(args.dirSave) / csvFilename
 
+    print(f"Creating Collection Members Diff file {memberCSVFile}")
+    db1.exportMemberDiff(memberCSVFile)
+    ############################################################
+    # Reporting on movie differences
     csvFilename = f"{args.secName}_library_{now.strftime('%Y-%m-%d-%H%M')}.csv"
     # Path.cwd
     if args.dirSave == None:
@@ -153,5 +135,19 @@ if __name__ == '__main__':
     movLibGroup.add_argument(
         '--OutPath', help='Directory path where csv files will be placed. Default is current directory', metavar='DirPath', type=str, dest='dirSave')
 
+    parser.add_argument(
+        '--metrics', help='Write the timings and counts of the run to a json file', metavar='out.json', type=str, dest='metricsFile')
+    parser.add_argument(
+        '--profile', help='Run with cProfile and print the top hot spots', action='store_true', dest='profile')
     parsedArgs = parser.parse_args()
-    main(parsedArgs)
+    if parsedArgs.metricsFile != None:
+        metrics.enable()
+    try:
+        if parsedArgs.profile:
+            metrics.profileCall(main, parsedArgs)
+        else:
+            main(parsedArgs)
+    finally:
+        if parsedArgs.metricsFile != None:
+            metrics.write(parsedArgs.metricsFile)
+            print(f"Metrics written to {parsedArgs.metricsFile}")
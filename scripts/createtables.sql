@@ -6,178 +6,134 @@
 PRAGMA foreign_keys = off;
 BEGIN TRANSACTION;
 
+-- Dimension tables, each name is stored once and the key tables
+-- refer to it by its integer ID
+
+-- Table: t_dim_server
+CREATE TABLE t_dim_server (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+-- Table: t_dim_library
+CREATE TABLE t_dim_library (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+-- Table: t_dim_path
+-- Universal file paths of the library items
+CREATE TABLE t_dim_path (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+-- Table: t_dim_colname
+CREATE TABLE t_dim_colname (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+-- Table: t_dim_skey
+-- Key (field) names
+CREATE TABLE t_dim_skey (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
 -- Table: t_libvals
 CREATE TABLE t_libvals (
-    srckey_id  REFERENCES t_libkeys (ID) ON DELETE CASCADE
+    srckey_id  INTEGER REFERENCES t_libkeys (ID) ON DELETE CASCADE
                                          ON UPDATE CASCADE,
     s_value
 );
 
 
 -- Table: t_libkeys
+-- A key of a library item, (library_id, path_id, skey_id) is the same
+-- key on every server
 CREATE TABLE t_libkeys (
-    ID       INTEGER PRIMARY KEY AUTOINCREMENT
-                     NOT NULL,
-    server           NOT NULL,
-    library          NOT NULL,
-    filePath         NOT NULL,
-    sKey             NOT NULL,
-    uKey             NOT NULL
+    ID          INTEGER PRIMARY KEY AUTOINCREMENT
+                        NOT NULL,
+    server_id   INTEGER NOT NULL,
+    library_id  INTEGER NOT NULL,
+    path_id     INTEGER NOT NULL,
+    skey_id     INTEGER NOT NULL
 );
 
 
 -- Table: t_colkeys
 CREATE TABLE t_colkeys (
-    ID       INTEGER PRIMARY KEY AUTOINCREMENT
-                     NOT NULL,
-    svrname           NOT NULL,
-    libname          NOT NULL,
-    colname         NOT NULL,
-    sKey             NOT NULL,
-    uKey             NOT NULL
+    ID          INTEGER PRIMARY KEY AUTOINCREMENT
+                        NOT NULL,
+    server_id   INTEGER NOT NULL,
+    library_id  INTEGER NOT NULL,
+    colname_id  INTEGER NOT NULL,
+    skey_id     INTEGER NOT NULL
 );
 -- Table: t_colvals
 CREATE TABLE t_colvals (
-    colkey_id  REFERENCES t_colkeys (ID) ON DELETE CASCADE
+    colkey_id  INTEGER REFERENCES t_colkeys (ID) ON DELETE CASCADE
                                          ON UPDATE CASCADE,
     s_value
 );
 
--- View: v_col_server1
-CREATE VIEW v_col_server1 AS
-    SELECT uKey,
-           libname,
-           colname,
-           sKey,
-           s_value
-      FROM t_colkeys AS k
-           JOIN
-           t_colvals AS v ON k.ID = v.colkey_id
-     WHERE upper(k.svrname) = 'SERVER1';
-
--- View: v_col_server2
-CREATE VIEW v_col_server2 AS
-    SELECT uKey,
-           libname,
-           colname,
-           sKey,
-           s_value
-      FROM t_colkeys AS k
-           JOIN
-           t_colvals AS v ON k.ID = v.colkey_id
-     WHERE upper(k.svrname) = 'SERVER2';
-
--- View: v_col_AllKeys
-CREATE VIEW v_col_AllKeys AS
-    SELECT uKey,
-           libname,
-           colname,
-           sKey
-      FROM t_colkeys AS k
-     GROUP BY uKey
-     ORDER BY colname;
-
--- View: v_col_server1_2ALL
-CREATE VIEW v_col_server1_2ALL AS
-    SELECT v_col_AllKeys.uKey,
-           CASE WHEN v_col_server1.ukey IS NULL THEN '--Value missing--' WHEN s_value IS NULL THEN '--NULL VALUE--' ELSE s_value END AS server1_VAL
-      FROM v_col_AllKeys
-           LEFT JOIN
-           v_col_server1 ON v_col_AllKeys.uKey = v_col_server1.ukey;
-
--- View: v_col_server2_2ALL
-CREATE VIEW v_col_server2_2ALL AS
-    SELECT v_col_AllKeys.uKey,
-           CASE WHEN v_col_server2.ukey IS NULL THEN '--Value missing--' WHEN s_value IS NULL THEN '--NULL VALUE--' ELSE s_value END AS server2_VAL
-      FROM v_col_AllKeys
-           LEFT JOIN
-           v_col_server2 ON v_col_AllKeys.uKey = v_col_server2.ukey;
-
--- View: v_col_DiffResults
-CREATE VIEW v_col_DiffResults AS
-    SELECT libname,
-           colname,
-           skey,
-           server1_val,
-           server2_val,
-           CASE WHEN server1_val = server2_val THEN '' ELSE '***Different***' END AS isDiff
-      FROM v_col_AllKeys
-           LEFT JOIN
-           v_col_server1_2ALL ON v_col_ALLKeys.ukey = v_col_server1_2ALL.uKey
-           LEFT JOIN
-           v_col_server2_2ALL ON v_col_ALLKeys.ukey = v_col_server2_2ALL.uKey
-     ORDER BY libname,
-              colname,
-              skey;
-
--- View: v_lib_AllKeys
-CREATE VIEW v_lib_AllKeys AS
-    SELECT uKey,
-           library,
-           filePath,
-           sKey
-      FROM t_libkeys AS k
-     GROUP BY uKey
-     ORDER BY filePath;
+-- Index: ix_libkeys_item
+CREATE INDEX ix_libkeys_item ON t_libkeys (library_id, path_id, skey_id, server_id);
+
+-- Index: ix_libvals_srckey
+CREATE INDEX ix_libvals_srckey ON t_libvals (srckey_id);
+
+-- Index: ix_colkeys_item
+CREATE INDEX ix_colkeys_item ON t_colkeys (library_id, colname_id, skey_id, server_id);
 
+-- Index: ix_colvals_colkey
+CREATE INDEX ix_colvals_colkey ON t_colvals (colkey_id);
 
--- View: v_lib_server1
-CREATE VIEW v_lib_server1 AS
-    SELECT uKey,
-           library,
-           filePath,
-           sKey,
-           s_value
+-- View: v_libkeys
+-- The library keys with their names
+CREATE VIEW v_libkeys AS
+    SELECT k.ID,
+           s.name AS server,
+           l.name AS library,
+           p.name AS filePath,
+           f.name AS sKey
       FROM t_libkeys AS k
            JOIN
-           t_libvals AS v ON k.ID = v.srckey_id
-     WHERE upper(k.server) = 'SERVER1';
-
-
--- View: v_lib_server1_2ALL
-CREATE VIEW v_lib_server1_2ALL AS
-    SELECT v_lib_AllKeys.uKey,
-           CASE WHEN v_lib_server1.ukey IS NULL THEN '--Value missing--' WHEN s_value IS NULL THEN '--NULL VALUE--' ELSE s_value END AS server1_VAL
-      FROM v_lib_AllKeys
-           LEFT JOIN
-           v_lib_server1 ON v_lib_AllKeys.uKey = v_lib_server1.ukey;
-
-
--- View: v_lib_server2
-CREATE VIEW v_lib_server2 AS
-    SELECT uKey,
-           library,
-           filePath,
-           sKey,
-           s_value
-      FROM t_libkeys AS k
+           t_dim_server AS s ON s.ID = k.server_id
+           JOIN
+           t_dim_library AS l ON l.ID = k.library_id
+           JOIN
+           t_dim_path AS p ON p.ID = k.path_id
+           JOIN
+           t_dim_skey AS f ON f.ID = k.skey_id;
+
+-- View: v_colkeys
+-- The collection keys with their names
+CREATE VIEW v_colkeys AS
+    SELECT k.ID,
+           s.name AS svrname,
+           l.name AS libname,
+           c.name AS colname,
+           f.name AS sKey
+      FROM t_colkeys AS k
+           JOIN
+           t_dim_server AS s ON s.ID = k.server_id
+           JOIN
+           t_dim_library AS l ON l.ID = k.library_id
+           JOIN
+           t_dim_colname AS c ON c.ID = k.colname_id
            JOIN
-           t_libvals AS v ON k.ID = v.srckey_id
-     WHERE upper(k.server) = 'SERVER2';
-
-
--- View: v_lib_server2_2ALL
-CREATE VIEW v_lib_server2_2ALL AS
-    SELECT v_lib_AllKeys.uKey,
-           CASE WHEN v_lib_server2.ukey IS NULL THEN '--Value missing--' WHEN s_value IS NULL THEN '--NULL VALUE--' ELSE s_value END AS server2_VAL
-      FROM v_lib_AllKeys
-           LEFT JOIN
-           v_lib_server2 ON v_lib_AllKeys.uKey = v_lib_server2.ukey;
--- View: v_lib_DiffResults
-CREATE VIEW v_lib_DiffResults AS
-    SELECT library,
-           filePath,
-           skey,
-           server1_val,
-           server2_val,
-           CASE WHEN server1_val = server2_val THEN '' ELSE '***Different***' END AS isDiff
-      FROM v_lib_AllKeys
-           LEFT JOIN
-           v_lib_server1_2ALL ON v_lib_ALLKeys.ukey = v_lib_server1_2ALL.uKey
-           LEFT JOIN
-           v_lib_server2_2ALL ON v_lib_ALLKeys.ukey = v_lib_server2_2ALL.uKey
-     ORDER BY library,
-              filePath,
-              skey;
+           t_dim_skey AS f ON f.ID = k.skey_id;
 COMMIT TRANSACTION;
 PRAGMA foreign_keys = on;
@@ -0,0 +1,21 @@
+--
+-- Export checkpoints, run after createtables.sql
+--
+-- The listing offset an unfinished export of a library got to, committed
+-- with the items before it. Removed when the export is done.
+--
+PRAGMA foreign_keys = off;
+BEGIN TRANSACTION;
+
+-- Table: t_checkpoints
+CREATE TABLE t_checkpoints (
+    server       TEXT    NOT NULL,
+    library      TEXT    NOT NULL,
+    plexServer   TEXT    NOT NULL,
+    fields       TEXT,
+    nextStart    INTEGER NOT NULL,
+    updatedAt    INTEGER NOT NULL,
+    PRIMARY KEY (server, library)
+);
+COMMIT TRANSACTION;
+PRAGMA foreign_keys = on;
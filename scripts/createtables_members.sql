@@ -0,0 +1,30 @@
+--
+-- Collection members, run after createtables.sql
+--
+-- One row per member of a collection, the universal file path of the
+-- movie, and one row per collection with a hash of its members, so the
+-- members diff only looks at the collections whose members changed.
+--
+PRAGMA foreign_keys = off;
+BEGIN TRANSACTION;
+
+-- Table: t_colmembers
+CREATE TABLE t_colmembers (
+    server       TEXT    NOT NULL,
+    library      TEXT    NOT NULL,
+    colname      TEXT    NOT NULL,
+    member       TEXT    NOT NULL,
+    PRIMARY KEY (server, library, colname, member)
+) WITHOUT ROWID;
+
+-- Table: t_colmembersets
+CREATE TABLE t_colmembersets (
+    server       TEXT    NOT NULL,
+    library      TEXT    NOT NULL,
+    colname      TEXT    NOT NULL,
+    memberCount  INTEGER NOT NULL,
+    memberHash   TEXT    NOT NULL,
+    PRIMARY KEY (server, library, colname)
+) WITHOUT ROWID;
+COMMIT TRANSACTION;
+PRAGMA foreign_keys = on;
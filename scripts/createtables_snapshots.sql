@@ -0,0 +1,35 @@
+--
+-- Snapshot tables, run after createtables.sql
+--
+-- The plex items saved for each server tag and library, so a snapshot
+-- run only fetches the items that changed. Databases from before the
+-- snapshots get them too.
+--
+PRAGMA foreign_keys = off;
+BEGIN TRANSACTION;
+
+-- Table: t_snapshots
+-- One row per server tag and library, the plex server it was taken from
+CREATE TABLE IF NOT EXISTS t_snapshots (
+    server       TEXT NOT NULL,
+    library      TEXT NOT NULL,
+    plexServer   TEXT NOT NULL,
+    lastSync     INTEGER NOT NULL,
+    fields       TEXT,
+    PRIMARY KEY (server, library)
+);
+
+-- Table: t_snapitems
+-- Every library item saved for a server tag, by the plex ratingKey
+CREATE TABLE IF NOT EXISTS t_snapitems (
+    server       TEXT NOT NULL,
+    library      TEXT NOT NULL,
+    ratingKey    TEXT NOT NULL,
+    filePath     TEXT NOT NULL,
+    updatedAt    INTEGER,
+    addedAt      INTEGER,
+    location     TEXT,
+    PRIMARY KEY (server, library, ratingKey)
+);
+COMMIT TRANSACTION;
+PRAGMA foreign_keys = on;
@@ -0,0 +1,98 @@
+--
+-- Wide-row movie schema. Run after createtables.sql when [db] schema=wide
+--
+-- One row per (server, library, filePath) with a typed column for each
+-- movie key, instead of the t_libkeys/t_libvals key/value pair.
+--
+PRAGMA foreign_keys = off;
+BEGIN TRANSACTION;
+
+-- Table: t_movies
+CREATE TABLE t_movies (
+    server        TEXT    NOT NULL,
+    library       TEXT    NOT NULL,
+    filePath      TEXT    NOT NULL,
+    guid          TEXT,
+    title         TEXT,
+    titleSort     TEXT,
+    originalTitle TEXT,
+    year          INTEGER,
+    locations     TEXT,
+    genres        TEXT,
+    media         TEXT,
+    PRIMARY KEY (server, library, filePath)
+);
+
+-- Index: ix_movies_path
+CREATE INDEX ix_movies_path ON t_movies (library, filePath, server);
+
+-- View: v_movie_Pairs
+-- server1 and server2 rows side by side, only for movies that differ
+CREATE VIEW v_movie_Pairs AS
+    SELECT k.library,
+           k.filePath,
+           s1.filePath IS NOT NULL AS in1,
+           s1.guid AS guid1,
+           s1.title AS title1,
+           s1.titleSort AS titleSort1,
+           s1.originalTitle AS originalTitle1,
+           s1.year AS year1,
+           s1.locations AS locations1,
+           s1.genres AS genres1,
+           s1.media AS media1,
+           s2.filePath IS NOT NULL AS in2,
+           s2.guid AS guid2,
+           s2.title AS title2,
+           s2.titleSort AS titleSort2,
+           s2.originalTitle AS originalTitle2,
+           s2.year AS year2,
+           s2.locations AS locations2,
+           s2.genres AS genres2,
+           s2.media AS media2
+      FROM (SELECT DISTINCT library, filePath FROM t_movies) AS k
+           LEFT JOIN
+           t_movies AS s1 ON s1.server = 'server1' AND s1.library = k.library AND s1.filePath = k.filePath
+           LEFT JOIN
+           t_movies AS s2 ON s2.server = 'server2' AND s2.library = k.library AND s2.filePath = k.filePath
+     WHERE s1.filePath IS NULL OR s2.filePath IS NULL OR
+           s1.guid IS NOT s2.guid OR s1.title IS NOT s2.title OR
+           s1.titleSort IS NOT s2.titleSort OR s1.originalTitle IS NOT s2.originalTitle OR
+           s1.year IS NOT s2.year OR s1.locations IS NOT s2.locations OR
+           s1.genres IS NOT s2.genres OR s1.media IS NOT s2.media;
+
+-- View: v_movie_DiffResults
+-- Same layout as t_lib_DiffResults, only the keys that differ
+-- f is the key names reported in the diff, same as the names of t_dim_skey
+CREATE VIEW v_movie_DiffResults AS
+    WITH f (sKey) AS (VALUES ('guid'), ('Title'), ('TitleSort'), ('OrigTitle'),
+                             ('Year'), ('Location'), ('Genres'), ('Media'))
+    SELECT library,
+           filePath,
+           sKey,
+           server1_VAL,
+           server2_VAL,
+           '***Different***' AS isDiff
+      FROM (SELECT p.library,
+                   p.filePath,
+                   f.sKey,
+                   CASE WHEN NOT p.in1 THEN '--Value missing--' ELSE coalesce(
+                       CASE f.sKey WHEN 'guid' THEN p.guid1 WHEN 'Title' THEN p.title1
+                                   WHEN 'TitleSort' THEN p.titleSort1 WHEN 'OrigTitle' THEN p.originalTitle1
+                                   WHEN 'Year' THEN p.year1 WHEN 'Location' THEN p.locations1
+                                   WHEN 'Genres' THEN p.genres1 WHEN 'Media' THEN p.media1 END,
+                       '--NULL VALUE--') END AS server1_VAL,
+                   CASE WHEN NOT p.in2 THEN '--Value missing--' ELSE coalesce(
+                       CASE f.sKey WHEN 'guid' THEN p.guid2 WHEN 'Title' THEN p.title2
+                                   WHEN 'TitleSort' THEN p.titleSort2 WHEN 'OrigTitle' THEN p.originalTitle2
+                                   WHEN 'Year' THEN p.year2 WHEN 'Location' THEN p.locations2
+                                   WHEN 'Genres' THEN p.genres2 WHEN 'Media' THEN p.media2 END,
+                       '--NULL VALUE--') END AS server2_VAL
+              FROM v_movie_Pairs AS p
+                   CROSS JOIN
+                   f)
+     WHERE server1_VAL IS NOT server2_VAL
+     ORDER BY library,
+              filePath,
+              sKey;
+COMMIT TRANSACTION;
+PRAGMA foreign_keys = on;
@@ -0,0 +1,147 @@
+--
+-- Move a snapshot database from the md5 uKey key tables to the dimension
+-- tables of createtables.sql, run by initDB when t_libkeys has a uKey
+--
+-- The key IDs are kept, so t_libvals and t_colvals are not changed.
+-- The snapshot tables are not needed here, initDB creates them next
+-- (createtables_snapshots.sql) when an older database does not have them.
+--
+PRAGMA foreign_keys = off;
+BEGIN TRANSACTION;
+
+DROP VIEW IF EXISTS v_lib_DiffResults;
+DROP VIEW IF EXISTS v_lib_server1_2ALL;
+DROP VIEW IF EXISTS v_lib_server2_2ALL;
+DROP VIEW IF EXISTS v_lib_server1;
+DROP VIEW IF EXISTS v_lib_server2;
+DROP VIEW IF EXISTS v_lib_AllKeys;
+DROP VIEW IF EXISTS v_col_DiffResults;
+DROP VIEW IF EXISTS v_col_server1_2ALL;
+DROP VIEW IF EXISTS v_col_server2_2ALL;
+DROP VIEW IF EXISTS v_col_server1;
+DROP VIEW IF EXISTS v_col_server2;
+DROP VIEW IF EXISTS v_col_AllKeys;
+
+CREATE TABLE t_dim_server (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+CREATE TABLE t_dim_library (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+CREATE TABLE t_dim_path (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+CREATE TABLE t_dim_colname (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+CREATE TABLE t_dim_skey (
+    ID       INTEGER PRIMARY KEY
+                     NOT NULL,
+    name     TEXT    NOT NULL
+                     UNIQUE
+);
+
+INSERT INTO t_dim_server (name)
+    SELECT server FROM t_libkeys UNION SELECT svrname FROM t_colkeys;
+INSERT INTO t_dim_library (name)
+    SELECT library FROM t_libkeys UNION SELECT libname FROM t_colkeys;
+INSERT INTO t_dim_path (name)
+    SELECT DISTINCT filePath FROM t_libkeys;
+INSERT INTO t_dim_colname (name)
+    SELECT DISTINCT colname FROM t_colkeys;
+INSERT INTO t_dim_skey (name)
+    SELECT sKey FROM t_libkeys UNION SELECT sKey FROM t_colkeys;
+
+CREATE TABLE t_libkeys_dims (
+    ID          INTEGER PRIMARY KEY AUTOINCREMENT
+                        NOT NULL,
+    server_id   INTEGER NOT NULL,
+    library_id  INTEGER NOT NULL,
+    path_id     INTEGER NOT NULL,
+    skey_id     INTEGER NOT NULL
+);
+
+INSERT INTO t_libkeys_dims (ID, server_id, library_id, path_id, skey_id)
+    SELECT k.ID, s.ID, l.ID, p.ID, f.ID
+      FROM t_libkeys AS k
+           JOIN t_dim_server AS s ON s.name = k.server
+           JOIN t_dim_library AS l ON l.name = k.library
+           JOIN t_dim_path AS p ON p.name = k.filePath
+           JOIN t_dim_skey AS f ON f.name = k.sKey;
+
+CREATE TABLE t_colkeys_dims (
+    ID          INTEGER PRIMARY KEY AUTOINCREMENT
+                        NOT NULL,
+    server_id   INTEGER NOT NULL,
+    library_id  INTEGER NOT NULL,
+    colname_id  INTEGER NOT NULL,
+    skey_id     INTEGER NOT NULL
+);
+
+INSERT INTO t_colkeys_dims (ID, server_id, library_id, colname_id, skey_id)
+    SELECT k.ID, s.ID, l.ID, c.ID, f.ID
+      FROM t_colkeys AS k
+           JOIN t_dim_server AS s ON s.name = k.svrname
+           JOIN t_dim_library AS l ON l.name = k.libname
+           JOIN t_dim_colname AS c ON c.name = k.colname
+           JOIN t_dim_skey AS f ON f.name = k.sKey;
+
+-- foreign keys are off, the values are not deleted with the old keys
+DROP TABLE t_libkeys;
+ALTER TABLE t_libkeys_dims RENAME TO t_libkeys;
+DROP TABLE t_colkeys;
+ALTER TABLE t_colkeys_dims RENAME TO t_colkeys;
+
+CREATE INDEX ix_libkeys_item ON t_libkeys (library_id, path_id, skey_id, server_id);
+
+CREATE INDEX ix_colkeys_item ON t_colkeys (library_id, colname_id, skey_id, server_id);
+
+CREATE VIEW v_libkeys AS
+    SELECT k.ID,
+           s.name AS server,
+           l.name AS library,
+           p.name AS filePath,
+           f.name AS sKey
+      FROM t_libkeys AS k
+           JOIN
+           t_dim_server AS s ON s.ID = k.server_id
+           JOIN
+           t_dim_library AS l ON l.ID = k.library_id
+           JOIN
+           t_dim_path AS p ON p.ID = k.path_id
+           JOIN
+           t_dim_skey AS f ON f.ID = k.skey_id;
+
+CREATE VIEW v_colkeys AS
+    SELECT k.ID,
+           s.name AS svrname,
+           l.name AS libname,
+           c.name AS colname,
+           f.name AS sKey
+      FROM t_colkeys AS k
+           JOIN
+           t_dim_server AS s ON s.ID = k.server_id
+           JOIN
+           t_dim_library AS l ON l.ID = k.library_id
+           JOIN
+           t_dim_colname AS c ON c.ID = k.colname_id
+           JOIN
+           t_dim_skey AS f ON f.ID = k.skey_id;
+COMMIT TRANSACTION;
+PRAGMA foreign_keys = on;